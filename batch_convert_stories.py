@@ -5,14 +5,47 @@
 
 import sys
 import os
+import glob
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, Tuple, Union
 
 # 添加src目录到路径
 sys.path.insert(0, str(Path(__file__).parent / 'src'))
 
-from script_to_audio import convert_story_script
+from config import config
+from script_to_audio import ScriptToAudioConverter
+from checkpoint import ChapterCheckpoint
+from job_queue import KIND_CHAPTER, STATUS_DONE, JobQueue, submit_and_wait
+from synthesis_model import WorkEstimate
+from tts_metrics import PHASES, get_metrics, start_metrics_server
 from loguru import logger
+from tqdm import tqdm
+
+
+class BatchProgress:
+    """汇总所有同时进行的章节的片段进度"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bar = tqdm(total=0, desc="合成片段", unit="段")
+    
+    def add_total(self, n: int):
+        """章节解析完成后登记其片段数"""
+        with self._lock:
+            self._bar.total += n
+            self._bar.refresh()
+    
+    def advance(self, n: int = 1):
+        """完成n个片段"""
+        with self._lock:
+            self._bar.update(n)
+    
+    def close(self):
+        self._bar.close()
+
 
 def find_story_files(input_folder: str) -> List[Path]:
     """
@@ -68,51 +101,176 @@ def check_file_exists(file_path: Path) -> bool:
     """
     return file_path.exists()
 
-def batch_convert_stories(input_folder: str, skip_existing: bool = True, max_files: Optional[int] = None, max_conversations_per_file: Optional[int] = None):
+def expand_input_folders(patterns: List[str]) -> List[str]:
+    """
+    展开输入文件夹参数中的通配符，例如 "data/input/story-0*"
+    
+    Args:
+        patterns: 文件夹路径或通配符列表
+        
+    Returns:
+        List[str]: 去重后的文件夹列表（保持参数顺序）
+    """
+    folders = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = [m for m in sorted(glob.glob(pattern)) if Path(m).is_dir()]
+            if not matches:
+                logger.warning(f"没有匹配的文件夹: {pattern}")
+        else:
+            matches = [pattern]
+        
+        for folder in matches:
+            if folder not in folders:
+                folders.append(folder)
+    return folders
+
+def collect_jobs(input_folders: List[str], skip_existing: bool, max_files: Optional[int],
+                 retry_failed: bool = False) -> Tuple[List[Tuple[Path, Path]], int]:
+    """
+    收集所有待转换的章节
+    
+    Args:
+        input_folders: 输入文件夹列表
+        skip_existing: 是否跳过已存在的输出文件（有未完成断点的章节不会被跳过）
+        max_files: 每个文件夹最多处理的文件数量（用于测试）
+        retry_failed: 只收集有未完成断点（上次中断或有片段失败）的章节
+        
+    Returns:
+        Tuple[List[Tuple[Path, Path]], int]: [(输入文件, 输出文件)] 和跳过的文件数
+    """
+    jobs = []
+    skipped = 0
+    
+    for input_folder in input_folders:
+        # 查找所有MD文件
+        md_files = find_story_files(input_folder)
+        
+        # 限制处理数量（如果指定）
+        if max_files:
+            md_files = md_files[:max_files]
+            logger.info(f"限制处理前 {max_files} 个文件")
+        
+        for input_file in md_files:
+            output_file = get_output_path(input_file, input_folder)
+            incomplete = ChapterCheckpoint.exists_for(output_file)
+            
+            if retry_failed and not incomplete:
+                skipped += 1
+                continue
+            
+            # 检查是否需要跳过
+            if incomplete:
+                logger.info(f"发现未完成的断点，继续转换: {output_file}")
+            elif skip_existing and check_file_exists(output_file):
+                logger.info(f"跳过已存在的文件: {output_file}")
+                skipped += 1
+                continue
+            
+            jobs.append((input_file, output_file))
+    
+    return jobs, skipped
+
+def estimate_jobs(converter: ScriptToAudioConverter, chapter_jobs: List[Tuple[Path, Path]],
+                  max_conversations: int = 0, pack: Optional[bool] = None) -> List[WorkEstimate]:
+    """
+    按合成耗时模型估计每个章节的工作量（不计断点中已完成的片段）
+    
+    Args:
+        converter: 转换器
+        chapter_jobs: [(输入文件, 输出文件)]
+        max_conversations: 每个文件最多处理的对话数（0表示不限制）
+        pack: 是否合并相邻的同音色行
+        
+    Returns:
+        List[WorkEstimate]: 与chapter_jobs一一对应的工作量，无法读取的章节为空
+    """
+    estimates = []
+    for input_file, output_file in chapter_jobs:
+        try:
+            estimates.append(converter.estimate_chapter(str(input_file), max_conversations, pack, str(output_file)))
+        except OSError as e:
+            logger.warning(f"估算章节工作量失败: {input_file} - {e}")
+            estimates.append(WorkEstimate())
+    return estimates
+
+def format_seconds(seconds: float) -> str:
+    """把秒数格式化为 时:分:秒"""
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+def batch_convert_stories(input_folder: Union[str, List[str]], skip_existing: bool = True, max_files: Optional[int] = None, max_conversations_per_file: Optional[int] = None, concurrency: Optional[int] = None, jobs: int = 1, retry_failed: bool = False, pack: Optional[bool] = None, hls: Optional[bool] = None, normalize: Optional[bool] = None, pcm: Optional[bool] = None, metrics_port: Optional[int] = None, metrics_file: Optional[str] = None):
     """
     批量转换故事文件夹中的所有章节
     
     Args:
-        input_folder: 输入文件夹路径，例如 "data/input/story-02-零食星球"
+        input_folder: 输入文件夹路径或路径列表（支持通配符），例如 "data/input/story-02-零食星球"
         skip_existing: 是否跳过已存在的输出文件
-        max_files: 最多处理的文件数量（用于测试）
+        max_files: 每个文件夹最多处理的文件数量（用于测试）
         max_conversations_per_file: 每个文件最多处理的对话数（用于测试）
+        concurrency: 同时进行的最大TTS请求数（None表示使用配置默认值）；
+            jobs大于1时为所有章节共享的全局请求预算
+        jobs: 同时转换的章节数
+        retry_failed: 只重试有未完成断点的章节，且每个章节只重新合成缺失的片段
+        pack: 是否合并相邻的同音色行（None表示使用配置默认值）
+        hls: 是否同时输出可边生成边播放的HLS分段（None表示使用配置默认值）
+        normalize: 是否把各音色调整到同一响度（None表示使用配置默认值）
+        pcm: 是否请求WAV片段、整章只编码一次（None表示使用配置默认值）
+        metrics_port: 运行期间提供Prometheus格式请求指标的端口（None表示使用配置默认值，0表示不启动）
+        metrics_file: 运行结束时写入请求指标JSON的文件（None表示使用配置默认值）
     """
-    logger.info(f"开始批量转换: {input_folder}")
+    patterns = [input_folder] if isinstance(input_folder, str) else list(input_folder)
+    input_folders = expand_input_folders(patterns)
+    logger.info(f"开始批量转换: {', '.join(input_folders)}")
     
-    # 查找所有MD文件
-    md_files = find_story_files(input_folder)
-    if not md_files:
+    chapter_jobs, skipped = collect_jobs(input_folders, skip_existing, max_files, retry_failed)
+    total_files = len(chapter_jobs) + skipped
+    if not total_files:
         logger.error("没有找到任何MD文件")
         return
     
-    # 限制处理数量（如果指定）
-    if max_files:
-        md_files = md_files[:max_files]
-        logger.info(f"限制处理前 {max_files} 个文件")
+    if concurrency is None:
+        concurrency = config.TTS_CONCURRENCY
+    jobs = max(1, jobs)
+    max_conv = max_conversations_per_file if max_conversations_per_file else 0
     
     # 统计信息
-    total_files = len(md_files)
     processed = 0
-    skipped = 0
     success = 0
     failed = 0
     
-    logger.info(f"准备处理 {total_files} 个文件")
+    logger.info(f"准备处理 {len(chapter_jobs)} 个文件，同时转换 {jobs} 个章节")
     
-    # 逐个处理文件
-    for i, input_file in enumerate(md_files, 1):
-        logger.info(f"\n处理第 {i}/{total_files} 个文件: {input_file.name}")
-        
-        # 生成输出路径
-        output_file = get_output_path(input_file, input_folder)
-        
-        # 检查是否需要跳过
-        if skip_existing and check_file_exists(output_file):
-            logger.info(f"跳过已存在的文件: {output_file}")
-            skipped += 1
-            continue
-        
+    # 所有文件共用一个转换器（客户端、连接池和角色配置只加载一次），
+    # 去重和在途合并的统计覆盖整个运行；并行章节共享同一个请求线程池作为全局预算
+    request_workers = concurrency if jobs > 1 and concurrency > 1 else None
+    converter = ScriptToAudioConverter(request_workers=request_workers, pcm_pipeline=pcm)
+    progress = BatchProgress() if jobs > 1 else None
+    
+    # 按学习到的各音色合成耗时估算工作量；并行章节时先开始预计最长的章节
+    estimates = estimate_jobs(converter, chapter_jobs, max_conv, pack)
+    if jobs > 1 and config.TTS_LONGEST_FIRST:
+        ranked = sorted(zip(chapter_jobs, estimates), key=lambda item: -item[1].work_seconds)
+        chapter_jobs = [job for job, _ in ranked]
+    total = sum(estimates, WorkEstimate())
+    if jobs > 1:
+        eta = total.eta(concurrency)
+    else:
+        eta = sum(estimate.eta(concurrency) for estimate in estimates)
+    logger.info(f"预计音频时长 {format_seconds(total.audio_seconds)}，{total.requests} 次请求，"
+                f"预计需要 {format_seconds(eta)}")
+    started = time.perf_counter()
+    
+    metrics_port = config.TTS_METRICS_PORT if metrics_port is None else metrics_port
+    metrics_file = config.TTS_METRICS_FILE if metrics_file is None else metrics_file
+    metrics_server = None
+    if metrics_port:
+        try:
+            metrics_server = start_metrics_server(metrics_port)
+        except OSError as e:
+            logger.warning(f"请求指标服务启动失败: {e}")
+    
+    def convert_one(input_file: Path, output_file: Path) -> bool:
         # 创建输出目录
         output_file.parent.mkdir(parents=True, exist_ok=True)
         
@@ -120,30 +278,62 @@ def batch_convert_stories(input_folder: str, skip_existing: bool = True, max_fil
         logger.info(f"输入: {input_file}")
         logger.info(f"输出: {output_file}")
         
-        try:
-            # 执行转换
-            max_conv = max_conversations_per_file if max_conversations_per_file else 0
-            result = convert_story_script(
-                input_file=str(input_file),
-                output_file=str(output_file),
-                max_conversations=max_conv  # 0表示不限制
-            )
-            
-            if result:
-                logger.info(f"✅ 转换成功: {output_file.name}")
-                success += 1
-            else:
-                logger.error(f"❌ 转换失败: {input_file.name}")
-                failed += 1
-                
-        except Exception as e:
-            logger.error(f"❌ 转换异常: {input_file.name} - {e}")
+        # 执行转换
+        return converter.convert_script_to_audio(
+            input_file=str(input_file),
+            output_file=str(output_file),
+            max_conversations=max_conv,  # 0表示不限制
+            concurrency=concurrency,
+            progress=progress,
+            pack=pack,
+            hls=hls,
+            normalize=normalize
+        )
+    
+    def record(input_file: Path, output_file: Path, result: Optional[bool], error: Optional[Exception] = None):
+        nonlocal processed, success, failed
+        if result:
+            logger.info(f"✅ 转换成功: {output_file.name}")
+            success += 1
+        elif error is not None:
+            logger.error(f"❌ 转换异常: {input_file.name} - {error}")
+            failed += 1
+        else:
+            logger.error(f"❌ 转换失败: {input_file.name}")
             failed += 1
         
         processed += 1
         
         # 显示进度
-        logger.info(f"进度: {processed}/{total_files} (成功: {success}, 失败: {failed}, 跳过: {skipped})")
+        logger.info(f"进度: {processed}/{len(chapter_jobs)} (成功: {success}, 失败: {failed}, 跳过: {skipped})")
+    
+    try:
+        if jobs == 1:
+            # 逐个处理文件
+            for i, (input_file, output_file) in enumerate(chapter_jobs, 1):
+                logger.info(f"\n处理第 {i}/{len(chapter_jobs)} 个文件: {input_file.name}")
+                try:
+                    record(input_file, output_file, convert_one(input_file, output_file))
+                except Exception as e:
+                    record(input_file, output_file, None, e)
+        else:
+            # 多个章节同时转换
+            with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="chapter") as executor:
+                futures = {executor.submit(convert_one, input_file, output_file): (input_file, output_file)
+                           for input_file, output_file in chapter_jobs}
+                for future in as_completed(futures):
+                    input_file, output_file = futures[future]
+                    try:
+                        record(input_file, output_file, future.result())
+                    except Exception as e:
+                        record(input_file, output_file, None, e)
+    finally:
+        if progress is not None:
+            progress.close()
+        summary = converter.run_summary()
+        converter.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
     
     # 显示总结
     logger.info("\n" + "=" * 50)
@@ -153,28 +343,137 @@ def batch_convert_stories(input_folder: str, skip_existing: bool = True, max_fil
     logger.info(f"成功: {success}")
     logger.info(f"失败: {failed}")
     logger.info(f"跳过: {skipped}")
+    logger.info(f"用时: {format_seconds(time.perf_counter() - started)}（预计 {format_seconds(eta)}）")
+    logger.info(f"总段数: {summary['segments']}")
+    logger.info(f"去重节省请求: {summary['saved_requests']} "
+                f"(章节内重复 {summary['deduplicated']}，在途合并 {summary['coalesced']})")
+    if summary['resumed']:
+        logger.info(f"断点恢复片段: {summary['resumed']}")
+    if summary['cache']:
+        logger.info(f"缓存命中: {summary['cache']['hits']}")
+    log_request_metrics(metrics_file)
     
     if success > 0:
-        logger.info(f"\n✅ 音频文件已保存到: {Path('out') / Path(input_folder).name}")
+        for folder in input_folders:
+            logger.info(f"\n✅ 音频文件已保存到: {Path('out') / Path(folder).name}")
+
+def submit_to_daemon(input_folder: Union[str, List[str]], skip_existing: bool = True, max_files: Optional[int] = None, max_conversations_per_file: Optional[int] = None, concurrency: Optional[int] = None, retry_failed: bool = False, pack: Optional[bool] = None, hls: Optional[bool] = None, normalize: Optional[bool] = None, pcm: Optional[bool] = None, priority: int = 0, wait: bool = True) -> bool:
+    """
+    把待转换的章节作为任务提交给合成守护进程（见 src/synthesis_daemon.py），并等待完成
+    
+    参数与batch_convert_stories相同；同时转换的章节数由守护进程的DAEMON_WORKERS决定。
+    开启最长优先调度时按剧本文件大小从大到小提交，守护进程按提交顺序领取
+    
+    Args:
+        priority: 任务优先级，数值大的先执行
+        wait: 是否等待所有任务结束
+        
+    Returns:
+        bool: 是否全部成功（不等待时为是否提交成功）
+    """
+    patterns = [input_folder] if isinstance(input_folder, str) else list(input_folder)
+    chapter_jobs, skipped = collect_jobs(expand_input_folders(patterns), skip_existing, max_files, retry_failed)
+    if not chapter_jobs:
+        logger.info(f"没有需要转换的章节（跳过 {skipped} 个）")
+        return True
+    if config.TTS_LONGEST_FIRST:
+        chapter_jobs.sort(key=lambda job: -job[0].stat().st_size)
+    
+    payloads = [{
+        'input_file': str(input_file.resolve()),
+        'output_file': str(output_file.resolve()),
+        'max_conversations': max_conversations_per_file or 0,
+        'concurrency': concurrency,
+        'pack': pack,
+        'hls': hls,
+        'normalize': normalize,
+        'pcm': pcm
+    } for input_file, output_file in chapter_jobs]
+    results = submit_and_wait(JobQueue(), KIND_CHAPTER, payloads, priority, wait)
+    if not wait:
+        return True
+    
+    succeeded = sum(1 for job in results if job.status == STATUS_DONE)
+    logger.info(f"守护进程任务完成: 成功 {succeeded}/{len(results)}，跳过 {skipped}")
+    return succeeded == len(results)
+
+def log_request_metrics(metrics_file: Optional[str] = None):
+    """
+    输出请求各阶段的耗时分布，用于判断慢在网络、服务端还是本地处理
+    
+    Args:
+        metrics_file: 写入完整指标JSON的文件（可选）
+    """
+    metrics = get_metrics().summary()
+    if not metrics['requests']:
+        return
+    phases = metrics['phases_ms']
+    logger.info(f"TTS请求: {metrics['requests']} 次，结果: {metrics['outcomes']}，"
+                f"连接新建 {metrics['connections']['new']}，复用 {metrics['connections']['reused']}")
+    logger.info("请求阶段耗时(ms) p50/p95: " + "，".join(
+        f"{phase} {phases[phase]['p50']}/{phases[phase]['p95']}" for phase in PHASES))
+    if metrics_file:
+        try:
+            get_metrics().dump_json(metrics_file)
+        except OSError as e:
+            logger.warning(f"请求指标写入失败: {e}")
 
 def main():
     """主函数"""
     import argparse
     
     parser = argparse.ArgumentParser(description="批量转换故事文件夹中的章节为音频")
-    parser.add_argument("input_folder", help="输入文件夹路径，例如: data/input/story-02-零食星球")
+    parser.add_argument("input_folder", nargs="+", help="输入文件夹路径（可多个，支持通配符），例如: data/input/story-02-零食星球 或 'data/input/story-*'")
     parser.add_argument("--no-skip", action="store_true", help="不跳过已存在的文件，重新生成")
-    parser.add_argument("--max-files", type=int, help="最多处理的文件数量（用于测试）")
+    parser.add_argument("--max-files", type=int, help="每个文件夹最多处理的文件数量（用于测试）")
     parser.add_argument("--max-conversations", type=int, help="每个文件最多处理的对话数（用于测试）")
+    parser.add_argument("--concurrency", type=int, help="同时进行的最大TTS请求数（默认读取TTS_CONCURRENCY，1表示串行）；并行章节时为全局预算")
+    parser.add_argument("--jobs", type=int, default=1, help="同时转换的章节数（默认1，逐个处理）")
+    parser.add_argument("--pack", action="store_true", default=None, help="合并相邻的同音色行为一次请求（默认读取TTS_PACK_LINES）")
+    parser.add_argument("--hls", action="store_true", default=None, help="同时输出HLS分段和播放列表，可边生成边播放（默认读取HLS_OUTPUT）")
+    parser.add_argument("--normalize", action="store_true", default=None, help="把各音色调整到同一响度，避免换人说话时音量跳变（默认读取LOUDNESS_NORMALIZE）")
+    parser.add_argument("--pcm", action="store_true", default=None, help="向服务端请求WAV片段，整章合并后只编码一次，避免二次有损编码（默认读取TTS_PCM_PIPELINE）")
+    parser.add_argument("--metrics-port", type=int, help="运行期间在该端口提供 /metrics（Prometheus格式）和 /metrics.json（默认读取TTS_METRICS_PORT）")
+    parser.add_argument("--metrics-json", help="运行结束时把请求指标写入该JSON文件（默认读取TTS_METRICS_FILE）")
+    parser.add_argument("--daemon", action="store_true", help="提交给合成守护进程执行并等待结果（需先运行 python src/synthesis_daemon.py run）")
+    parser.add_argument("--priority", type=int, default=0, help="提交给守护进程时的任务优先级，数值大的先执行")
+    parser.add_argument("--no-wait", action="store_true", help="提交给守护进程后立即返回，不等待结果")
+    parser.add_argument("--retry-failed", action="store_true", help="只重试上次中断或有片段失败的章节，且只重新合成缺失的片段")
     
     args = parser.parse_args()
     
+    if args.daemon:
+        ok = submit_to_daemon(
+            input_folder=args.input_folder,
+            skip_existing=not args.no_skip,
+            max_files=args.max_files,
+            max_conversations_per_file=args.max_conversations,
+            concurrency=args.concurrency,
+            retry_failed=args.retry_failed,
+            pack=args.pack,
+            hls=args.hls,
+            normalize=args.normalize,
+            pcm=args.pcm,
+            priority=args.priority,
+            wait=not args.no_wait
+        )
+        sys.exit(0 if ok else 1)
+    
     # 执行批量转换
     batch_convert_stories(
         input_folder=args.input_folder,
         skip_existing=not args.no_skip,
         max_files=args.max_files,
-        max_conversations_per_file=args.max_conversations
+        max_conversations_per_file=args.max_conversations,
+        concurrency=args.concurrency,
+        jobs=args.jobs,
+        retry_failed=args.retry_failed,
+        pack=args.pack,
+        hls=args.hls,
+        normalize=args.normalize,
+        pcm=args.pcm,
+        metrics_port=args.metrics_port,
+        metrics_file=args.metrics_json
     )
 
 if __name__ == "__main__":
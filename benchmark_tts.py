@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+端到端压测：用本地模拟TTS服务（默认）或线上服务转换一个章节或整个故事库，
+报告请求吞吐、请求延迟分位数、重试次数和总耗时，便于对比不同配置
+"""
+
+import sys
+import json
+import glob
+import shutil
+import tempfile
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+# 添加src目录到路径
+sys.path.insert(0, str(Path(__file__).parent / 'src'))
+
+from config import config
+from loguru import logger
+
+from llm_tts_client import LLMTTSClient
+from script_to_audio import ScriptToAudioConverter
+from mp3_frames import iter_frames
+from tts_stub_server import StubTTSServer, add_profile_arguments, profile_from_args
+from tts_metrics import PHASES
+
+
+def collect_chapters(paths: Sequence[str]) -> List[Path]:
+    """
+    收集要转换的章节：参数可以是章节文件、故事文件夹或通配符
+
+    Args:
+        paths: 文件、文件夹或通配符列表
+
+    Returns:
+        List[Path]: 去重后的章节文件（保持参数顺序）
+    """
+    chapters = []
+    for pattern in paths:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for match in map(Path, matches):
+            files = sorted(match.glob("*.md")) if match.is_dir() else [match]
+            for file in files:
+                if file.is_file() and file not in chapters:
+                    chapters.append(file)
+    return chapters
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """已排序数据的分位数（最近秩法），空数据返回0"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(q / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def audio_seconds(path: Path) -> float:
+    """MP3文件的时长（秒），文件不存在时为0"""
+    if not path.exists():
+        return 0.0
+    return sum(header.duration for header, _ in iter_frames(path.read_bytes()))
+
+
+def run_benchmark(chapters: List[Path], output_dir: Path, concurrency: int, jobs: int,
+                  pack: Optional[bool], max_conversations: int) -> Dict[str, Any]:
+    """
+    转换所有章节并统计
+
+    Args:
+        chapters: 章节文件列表
+        output_dir: 输出目录
+        concurrency: 同时进行的最大TTS请求数（jobs大于1时为全局预算）
+        jobs: 同时转换的章节数
+        pack: 是否合并相邻的同音色行
+        max_conversations: 每个章节最多处理的段数（0表示不限制）
+
+    Returns:
+        Dict[str, Any]: 章节数、请求数、重试次数、吞吐、延迟分位数和音频时长等统计
+    """
+    request_workers = concurrency if jobs > 1 and concurrency > 1 else None
+    converter = ScriptToAudioConverter(request_workers=request_workers)
+    outputs = [output_dir / f"{i:04d}-{chapter.stem}.mp3" for i, chapter in enumerate(chapters)]
+
+    def convert_one(index: int) -> bool:
+        # 不使用断点，每次压测都完整请求一遍
+        return converter.convert_script_to_audio(str(chapters[index]), str(outputs[index]),
+                                                 max_conversations=max_conversations, concurrency=concurrency,
+                                                 resume=False, pack=pack, hls=False)
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="chapter") as executor:
+            results = list(executor.map(convert_one, range(len(chapters))))
+    finally:
+        wall_time = time.perf_counter() - start
+        converter.close()
+
+    client = converter.tts_client
+    latencies = sorted(client.request_latencies)
+    summary = converter.run_summary()
+    audio = sum(audio_seconds(path) for path in outputs)
+    return {
+        'chapters': len(chapters),
+        'failed_chapters': results.count(False),
+        'segments': summary['segments'],
+        'requests': len(latencies),
+        'retries': client.retry_count,
+        'throttles': summary['limiter']['throttles'],
+        'peak_limit': summary['limiter']['peak_limit'],
+        'wall_time': round(wall_time, 3),
+        'requests_per_second': round(len(latencies) / wall_time, 2) if wall_time else 0.0,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies) * 1000, 1) if latencies else 0.0,
+            'p50': round(percentile(latencies, 50) * 1000, 1),
+            'p95': round(percentile(latencies, 95) * 1000, 1),
+            'p99': round(percentile(latencies, 99) * 1000, 1),
+            'max': round(latencies[-1] * 1000, 1) if latencies else 0.0
+        },
+        'audio_seconds': round(audio, 1),
+        'realtime_factor': round(audio / wall_time, 1) if wall_time else 0.0,
+        'metrics': client.metrics.summary()
+    }
+
+
+def print_report(result: Dict[str, Any]):
+    """输出压测报告"""
+    latency = result['latency_ms']
+    print("=" * 50)
+    print(f"章节: {result['chapters']}（失败 {result['failed_chapters']}），片段: {result['segments']}")
+    print(f"请求: {result['requests']}，重试: {result['retries']}，限流: {result['throttles']}，"
+          f"并发上限峰值: {result['peak_limit']}")
+    print(f"总耗时: {result['wall_time']:.2f} 秒，吞吐: {result['requests_per_second']:.2f} 请求/秒")
+    print(f"请求延迟(ms): p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  "
+          f"平均 {latency['mean']}  最大 {latency['max']}")
+    print(f"音频时长: {result['audio_seconds']:.1f} 秒（{result['realtime_factor']:.1f}倍实时）")
+    phases = result['metrics']['phases_ms']
+    print("阶段耗时(ms) p50/p95: " + "  ".join(
+        f"{phase} {phases[phase]['p50']}/{phases[phase]['p95']}" for phase in PHASES))
+    connections = result['metrics']['connections']
+    print(f"连接: 新建 {connections['new']}，复用 {connections['reused']}，"
+          f"结果: {result['metrics']['outcomes']}")
+    if 'server' in result:
+        server = result['server']
+        print(f"模拟服务: 请求 {server['requests']}，429 {server['throttled_429']}，"
+              f"5xx {server['server_errors']}，并发超限 {server['quota_exceeded']}，"
+              f"峰值并发 {server['peak_concurrency']}")
+    print("=" * 50)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(
+        description="端到端压测：默认使用本地模拟TTS服务，不消耗线上配额")
+    parser.add_argument("input", nargs="+",
+                        help="章节文件、故事文件夹或通配符，例如 'data/input/story-*'")
+    parser.add_argument("--concurrency", type=int, help="同时进行的最大TTS请求数（默认读取TTS_CONCURRENCY）")
+    parser.add_argument("--jobs", type=int, default=1, help="同时转换的章节数（默认1）")
+    parser.add_argument("--pack", action="store_true", default=None, help="合并相邻的同音色行（默认读取TTS_PACK_LINES）")
+    parser.add_argument("--max-conversations", type=int, default=0, help="每个章节最多处理的段数（默认0，不限制）")
+    parser.add_argument("--live", action="store_true", help="使用TTS_HTTP_URL指向的真实服务（消耗配额）")
+    parser.add_argument("--output-dir", help="保留输出音频的目录（默认使用临时目录，结束后删除）")
+    parser.add_argument("--json", dest="json_path", help="把配置和结果写入JSON文件，便于对比")
+    parser.add_argument("--verbose", action="store_true", help="输出转换过程的日志")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    # 注入故障时重试日志很多，默认只输出报告和致命错误
+    if not args.verbose:
+        logger.remove()
+        logger.add(sys.stderr, level="CRITICAL")
+
+    chapters = collect_chapters(args.input)
+    if not chapters:
+        parser.error("没有找到任何章节文件")
+    concurrency = max(1, args.concurrency or config.TTS_CONCURRENCY)
+    jobs = max(1, args.jobs)
+
+    # 压测测量的是请求本身，不使用音频缓存
+    config.TTS_CACHE_ENABLED = False
+
+    server = None
+    state_dir = None
+    if not args.live:
+        try:
+            server = StubTTSServer(profile_from_args(args)).start_background()
+        except ValueError as e:
+            parser.error(str(e))
+        LLMTTSClient.HTTP_URL = server.http_url
+        LLMTTSClient.WS_URL = server.ws_url
+        # 模拟服务不校验凭据
+        config.TTS_TOKEN = config.TTS_TOKEN or 'stub-token'
+        config.TTS_APP_ID = config.TTS_APP_ID or 'stub-app'
+        # 模拟服务的耗时不代表真实服务：合成耗时模型写到临时目录，不影响正式运行的预计时长和派发顺序
+        state_dir = tempfile.mkdtemp(prefix="tts-bench-state-")
+        config.SYNTHESIS_MODEL_FILE = str(Path(state_dir) / 'synthesis_model.json')
+
+    output_dir = Path(args.output_dir) if args.output_dir else Path(tempfile.mkdtemp(prefix="tts-bench-"))
+    output_dir.mkdir(parents=True, exist_ok=True)
+    print(f"压测 {len(chapters)} 个章节，并发 {concurrency}，同时转换 {jobs} 个章节，"
+          f"{'线上服务 ' + LLMTTSClient.HTTP_URL if args.live else '本地模拟服务'}")
+
+    try:
+        result = run_benchmark(chapters, output_dir, concurrency, jobs, args.pack, args.max_conversations)
+        if server is not None:
+            result['server'] = dict(server.stats)
+    finally:
+        if server is not None:
+            server.close()
+        if not args.output_dir:
+            shutil.rmtree(output_dir, ignore_errors=True)
+        if state_dir is not None:
+            shutil.rmtree(state_dir, ignore_errors=True)
+
+    print_report(result)
+
+    if args.json_path:
+        settings = {
+            'inputs': args.input,
+            'concurrency': concurrency,
+            'jobs': jobs,
+            'pack': config.TTS_PACK_LINES if args.pack is None else args.pack,
+            'max_conversations': args.max_conversations,
+            'live': args.live,
+            'stub_profile': vars(server.profile) if server is not None else None
+        }
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({'settings': settings, 'result': result}, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入: {args.json_path}")
+
+    return 0 if result['failed_chapters'] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""
+按序流式写出音频
+片段可以乱序完成，写入器用重排缓冲区保证按剧本顺序追加到文件，完成后原子替换到目标路径；
+MP3片段按帧拼接（去掉各片段的标签和头帧，最后写入整体的Info头），片段之间可按帧插入静音停顿；
+PCM模式下片段为WAV，采样写入章节缓冲区，完成后整章编码一次（见pcm_audio）
+"""
+
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+try:
+    from loguru import logger
+except ImportError:
+    import logging
+    logger = logging.getLogger(__name__)
+
+from config import config
+from mp3_frames import Mp3Muxer, Mp3FormatError, prepare_segment
+from hls_writer import HlsSegmenter
+from pcm_audio import PcmChapterBuffer, PcmFormatError
+from tts_response import AudioBuffer
+
+
+class OrderedAudioWriter:
+    """
+    按序写出音频片段的写入器（线程安全）
+
+    调度方在派发第i个片段前调用reserve()占用重排窗口，片段完成后调用submit(i, data)。
+    当i之前的片段都已完成时，数据立即追加到临时文件并释放窗口，
+    因此内存中最多只保留window个片段。
+    """
+
+    def __init__(self, output_path: str, window: int = 32, audio_format: str = 'mp3',
+                 playlist_dir: Optional[str] = None, pauses: Optional[Sequence[int]] = None):
+        """
+        初始化写入器
+
+        Args:
+            output_path: 最终输出文件路径
+            window: 重排窗口大小，即最多同时在途（已派发未写出）的片段数
+            audio_format: 片段的音频格式，mp3按帧拼接，pcm（WAV片段）写入章节缓冲区后
+                按配置OUTPUT_FORMAT编码一次，其他格式直接追加字节
+            playlist_dir: 同时输出HLS分段的目录（仅mp3），片段按顺序写出后即可播放
+            pauses: 每个片段之前插入的静音时长（毫秒，按片段序号，仅mp3和pcm）；第一个写出的片段之前不插入
+        """
+        self.output_path = Path(output_path)
+        self.window = max(1, window)
+        self.audio_format = audio_format
+        self.pauses = pauses if audio_format in ('mp3', 'pcm') else None
+        self._muxer: Optional[Mp3Muxer] = None
+        self._pcm: Optional[PcmChapterBuffer] = None
+        self._segmenter: Optional[HlsSegmenter] = None
+        if playlist_dir is not None:
+            if audio_format == 'mp3':
+                self._segmenter = HlsSegmenter(playlist_dir)
+                logger.info(f"边生成边收听: {self._segmenter.playlist_path}")
+            else:
+                logger.warning(f"HLS分段只支持mp3，当前格式 {audio_format}，不输出分段")
+
+        self._slots = threading.Semaphore(self.window)
+        self._lock = threading.Lock()
+        self._flushed = threading.Condition(self._lock)
+        self._pending: Dict[int, Optional[AudioBuffer]] = {}
+        self._next_index = 0
+        self._file = None
+        self._tmp_path: Optional[str] = None
+
+        self.written_segments = 0
+        self.skipped_segments = 0
+        self.bytes_written = 0
+        # 被跳过（生成或写出失败）的片段序号
+        self.skipped_indices: List[int] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # 正常退出时由调用方决定commit；异常退出时丢弃临时文件
+        if exc_type is not None:
+            self.abort()
+
+    def _open(self):
+        """在目标目录创建临时文件（保证rename在同一文件系统内）"""
+        if self.audio_format == 'pcm':
+            self._pcm = PcmChapterBuffer(str(self.output_path.parent), prefix=f".{self.output_path.name}.")
+            return
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=self.output_path.parent,
+                                              prefix=f".{self.output_path.name}.", suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+        if self.audio_format == 'mp3':
+            self._muxer = Mp3Muxer(self._file)
+
+    def reserve(self):
+        """派发一个片段前调用，重排窗口已满时阻塞等待"""
+        self._slots.acquire()
+
+    def submit(self, index: int, data: Optional[AudioBuffer]):
+        """
+        提交一个已完成的片段
+
+        Args:
+            index: 片段序号（从0开始，按剧本顺序）
+            data: 音频数据，生成失败时为None（写出时跳过）
+        """
+        with self._lock:
+            self._pending[index] = data
+
+            try:
+                while self._next_index in self._pending:
+                    segment = self._pending.pop(self._next_index)
+                    written = False
+                    try:
+                        written = bool(segment) and self._write_segment(segment)
+                    except Exception as e:
+                        logger.error(f"片段 {self._next_index + 1} 写出异常: {e}")
+                    finally:
+                        # 无论写出是否成功都前进并释放窗口，避免后续片段永远等待
+                        if written:
+                            self.written_segments += 1
+                        else:
+                            logger.warning(f"跳过无效的音频片段 {self._next_index + 1}")
+                            self.skipped_segments += 1
+                            self.skipped_indices.append(self._next_index)
+                        self._next_index += 1
+                        self._slots.release()
+            finally:
+                self._flushed.notify_all()
+    
+    def join(self, count: int):
+        """
+        等待前count个片段全部写出（或跳过）
+
+        Args:
+            count: 片段总数
+        """
+        with self._flushed:
+            self._flushed.wait_for(lambda: self._next_index >= count)
+
+    def _write_segment(self, data: AudioBuffer) -> bool:
+        """追加写入一个片段（调用方需持有锁），返回是否写入"""
+        if self._file is None and self._pcm is None:
+            self._open()
+        
+        try:
+            pause_ms = 0
+            if self._pcm is not None:
+                # 与MP3相同，只在已经写出过片段之后插入停顿（前面的片段被跳过时输出不以静音开头）
+                if self.pauses is not None and self.written_segments:
+                    pause_ms = self.pauses[self._next_index]
+                self._pcm.add(data, pause_ms)
+                self.bytes_written = self._pcm.data_length
+            elif self._muxer is not None:
+                # 先解析，无效的片段不会留下停顿
+                segment = prepare_segment(data)
+                if self.pauses is not None and self.written_segments:
+                    pause_ms = self.pauses[self._next_index]
+                    self._muxer.add_silence(pause_ms)
+                self._muxer.add_prepared(segment)
+                self.bytes_written = self._muxer.bytes_written
+            else:
+                self._file.write(data)
+                self.bytes_written += len(data)
+        except (Mp3FormatError, PcmFormatError, OSError) as e:
+            logger.error(f"片段 {self._next_index + 1} 写出失败: {e}")
+            return False
+        
+        if self._segmenter is not None:
+            try:
+                self._segmenter.add_silence(pause_ms)
+                self._segmenter.add(data)
+            except (Mp3FormatError, OSError) as e:
+                logger.warning(f"HLS分段写出失败，停止分段输出: {e}")
+                self._segmenter = None
+        
+        logger.debug(f"已写出片段 {self._next_index + 1}，当前大小: {self.bytes_written} bytes")
+        return True
+
+    def commit(self) -> bool:
+        """
+        关闭临时文件并原子替换到目标路径
+
+        Returns:
+            bool: 是否写出了有效数据
+        """
+        with self._lock:
+            if self._pending:
+                logger.warning(f"仍有 {len(self._pending)} 个片段等待前序片段，未写出")
+
+            if (self._file is None and self._pcm is None) or self.bytes_written == 0:
+                logger.error("没有有效的音频数据可写出")
+                self._discard()
+                return False
+
+            if self._pcm is not None:
+                try:
+                    self._pcm.encode(str(self.output_path), config.OUTPUT_FORMAT, config.PCM_ENCODE_BITRATE)
+                except OSError as e:
+                    logger.error(f"章节编码失败: {e}")
+                    self._discard()
+                    return False
+                logger.info(f"音频时长: {self._pcm.duration:.3f} 秒")
+                self._discard()
+                self.bytes_written = self.output_path.stat().st_size
+                logger.info(f"音频写出完成: {self.output_path}")
+                logger.info(f"文件大小: {self.bytes_written} bytes，共 {self.written_segments} 个片段")
+                return True
+
+            if self._muxer is not None:
+                self._muxer.finalize()
+                logger.info(f"音频时长: {self._muxer.duration:.1f} 秒")
+            self._finish_playlist()
+            self._file.close()
+            self._file = None
+            os.replace(self._tmp_path, self.output_path)
+            self._tmp_path = None
+
+        logger.info(f"音频写出完成: {self.output_path}")
+        logger.info(f"文件大小: {self.bytes_written} bytes，共 {self.written_segments} 个片段")
+        return True
+
+    def abort(self):
+        """放弃写出，删除临时文件（已写出的HLS分段保留，播放列表标记结束）"""
+        with self._lock:
+            self._discard()
+            self._finish_playlist()
+
+    def _finish_playlist(self):
+        """在HLS播放列表中标记结束（调用方需持有锁）"""
+        if self._segmenter is not None:
+            try:
+                self._segmenter.finish()
+            except OSError as e:
+                logger.warning(f"HLS播放列表写出失败: {e}")
+            self._segmenter = None
+
+    def _discard(self):
+        """关闭并删除临时文件（调用方需持有锁）"""
+        if self._pcm is not None:
+            self._pcm.close()
+            self._pcm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._tmp_path and os.path.exists(self._tmp_path):
+            os.unlink(self._tmp_path)
+        self._tmp_path = None
+        self._pending.clear()
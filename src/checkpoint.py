@@ -0,0 +1,180 @@
+"""
+章节级断点续传
+每个片段合成成功后立即保存到 <输出文件>.parts/ 目录，并追加一条记录到日志文件；
+转换中断或部分片段失败时，重新运行只合成缺失的片段
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    from loguru import logger
+except ImportError:
+    import logging
+    logger = logging.getLogger(__name__)
+
+from tts_response import AudioBuffer
+
+
+class ChapterCheckpoint:
+    """
+    单个章节的断点
+
+    片段按请求键（内容哈希）保存，剧本修改后未变化的片段仍可复用。
+    日志文件只追加写入，进程在任意时刻被终止都不会损坏已记录的片段。
+    """
+
+    JOURNAL_NAME = 'segments.jsonl'
+    MISSING_NAME = 'missing.json'
+
+    def __init__(self, output_path: str):
+        """
+        初始化断点
+
+        Args:
+            output_path: 章节的最终输出文件路径
+        """
+        output_path = Path(output_path)
+        self.dir = self.dir_for(output_path)
+        self.suffix = output_path.suffix or '.bin'
+
+        self._lock = threading.Lock()
+        self._segments: Dict[str, int] = {}
+        self._loaded = False
+
+    @staticmethod
+    def dir_for(output_path) -> Path:
+        """断点目录路径"""
+        output_path = Path(output_path)
+        return output_path.with_name(output_path.name + '.parts')
+
+    @classmethod
+    def exists_for(cls, output_path) -> bool:
+        """输出文件是否有未完成的断点"""
+        return cls.dir_for(output_path).is_dir()
+
+    def _journal_path(self) -> Path:
+        return self.dir / self.JOURNAL_NAME
+
+    def path(self, key: str) -> Path:
+        """片段音频文件路径"""
+        return self.dir / f"{key}{self.suffix}"
+
+    def load(self) -> int:
+        """
+        加载已完成的片段
+
+        Returns:
+            int: 已完成的片段数
+        """
+        with self._lock:
+            self._segments.clear()
+            journal = self._journal_path()
+            if journal.exists():
+                with open(journal, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except json.JSONDecodeError:
+                            # 进程被终止时最后一行可能不完整
+                            continue
+                        if self.path(record['key']).exists():
+                            self._segments[record['key']] = record.get('line', 0)
+            self._loaded = True
+            count = len(self._segments)
+
+        if count:
+            logger.info(f"发现断点 {self.dir}，已完成 {count} 个片段")
+        return count
+
+    def has(self, key: str) -> bool:
+        """片段是否已完成"""
+        if not self._loaded:
+            self.load()
+        return key in self._segments
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        读取已完成的片段
+
+        Args:
+            key: 请求键
+
+        Returns:
+            Optional[bytes]: 音频数据，未完成时返回None
+        """
+        if not self.has(key):
+            return None
+        try:
+            return self.path(key).read_bytes()
+        except OSError:
+            return None
+
+    def put(self, key: str, data: AudioBuffer, line_number: int = 0):
+        """
+        保存一个已完成的片段（先原子写入音频文件，再追加日志）
+
+        Args:
+            key: 请求键
+            data: 音频数据
+            line_number: 片段在剧本中的行号
+        """
+        if not data:
+            return
+        with self._lock:
+            if key in self._segments:
+                return
+            self.dir.mkdir(parents=True, exist_ok=True)
+
+            path = self.path(key)
+            fd, tmp_path = tempfile.mkstemp(dir=self.dir, prefix=f".{key[:12]}.", suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+
+            with open(self._journal_path(), 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'key': key, 'line': line_number}) + '\n')
+            self._segments[key] = line_number
+
+    def record_missing(self, line_numbers: List[int]):
+        """
+        记录本次运行后仍缺失的行号
+
+        Args:
+            line_numbers: 缺失片段的行号
+        """
+        with self._lock:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            with open(self.dir / self.MISSING_NAME, 'w', encoding='utf-8') as f:
+                json.dump(sorted(line_numbers), f)
+
+    def missing_lines(self) -> List[int]:
+        """
+        上次运行后仍缺失的行号
+
+        Returns:
+            List[int]: 行号列表，没有记录时为空
+        """
+        try:
+            with open(self.dir / self.MISSING_NAME, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return []
+
+    def remove(self):
+        """章节全部完成后删除断点目录"""
+        with self._lock:
+            if self.dir.exists():
+                shutil.rmtree(self.dir, ignore_errors=True)
+                logger.debug(f"清理断点目录: {self.dir}")
+            self._segments.clear()
@@ -0,0 +1,188 @@
+"""
+自适应并发控制
+AIMD（加性增、乘性减）：请求成功时逐步放宽在途请求上限，遇到限流信号时减半
+"""
+
+import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, Deque, Tuple, AsyncIterator
+
+try:
+    from loguru import logger
+except ImportError:
+    import logging
+    logger = logging.getLogger(__name__)
+
+from config import config
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD并发控制器
+
+    线程安全且不绑定事件循环，可被多个客户端（各自运行在不同事件循环中）共享，
+    从而让整个进程的在途请求数贴近账号的真实并发配额。
+    """
+
+    def __init__(self, initial_limit: int = 4, min_limit: int = 1, max_limit: int = 32,
+                 decrease_factor: float = 0.5):
+        """
+        初始化控制器
+
+        Args:
+            initial_limit: 初始在途请求上限
+            min_limit: 上限的最小值
+            max_limit: 上限的最大值
+            decrease_factor: 遇到限流时上限乘以的系数
+        """
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.decrease_factor = decrease_factor
+
+        self._limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self._in_flight = 0
+        self._waiters: Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+        self._lock = threading.Lock()
+        # 每次减小上限后递增；减小之前发出的请求再被限流不会重复减小
+        self._epoch = 0
+
+        self.success_count = 0
+        self.throttle_count = 0
+        self.decrease_count = 0
+        self.peak_limit = int(self._limit)
+
+    @property
+    def limit(self) -> int:
+        """当前在途请求上限"""
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        """当前在途请求数"""
+        return self._in_flight
+
+    async def acquire(self):
+        """等待一个请求名额"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if not self._waiters and self._in_flight < self.limit:
+                self._in_flight += 1
+                return
+            future = loop.create_future()
+            self._waiters.append((loop, future))
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                try:
+                    self._waiters.remove((loop, future))
+                    granted = False
+                except ValueError:
+                    granted = True
+            # 名额已分配但结果已送达时需要归还；尚未送达的由_deliver归还
+            if granted and future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        """归还一个请求名额"""
+        with self._lock:
+            self._in_flight -= 1
+            self._wake_waiters()
+
+    def _wake_waiters(self):
+        """在上限允许的范围内唤醒等待者（调用方需持有锁）"""
+        while self._waiters and self._in_flight < self.limit:
+            loop, future = self._waiters.popleft()
+            self._in_flight += 1
+            loop.call_soon_threadsafe(self._deliver, future)
+
+    def _deliver(self, future: asyncio.Future):
+        """在等待者所在的事件循环中交付名额"""
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+    @property
+    def epoch(self) -> int:
+        """当前窗口编号，请求开始时记录，限流时传给on_throttle"""
+        return self._epoch
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[int]:
+        """占用一个请求名额的上下文管理器，返回请求开始时的窗口编号"""
+        await self.acquire()
+        try:
+            yield self._epoch
+        finally:
+            self.release()
+
+    def on_success(self):
+        """请求成功（在归还名额前调用）：上限被占满时，每成功约limit次上限加1"""
+        with self._lock:
+            self.success_count += 1
+            if self._limit < self.max_limit and self._in_flight >= self.limit:
+                self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+                self.peak_limit = max(self.peak_limit, self.limit)
+                self._wake_waiters()
+
+    def on_throttle(self, epoch: int):
+        """
+        收到限流信号（HTTP 429或并发超限）：上限乘性减小
+
+        Args:
+            epoch: 该请求开始时的窗口编号；早于最近一次减小的请求只计数不再减小
+        """
+        with self._lock:
+            self.throttle_count += 1
+            if epoch != self._epoch:
+                return
+            self._epoch += 1
+            old_limit = self.limit
+            self._limit = max(float(self.min_limit), self._limit * self.decrease_factor)
+            self.decrease_count += 1
+
+        logger.warning(f"触发限流，在途请求上限 {old_limit} -> {self.limit}")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        获取控制器统计信息
+
+        Returns:
+            Dict[str, Any]: 当前上限、在途数、峰值上限及成功/限流/减小次数
+        """
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'in_flight': self._in_flight,
+                'peak_limit': self.peak_limit,
+                'successes': self.success_count,
+                'throttles': self.throttle_count,
+                'decreases': self.decrease_count
+            }
+
+
+_shared_limiter: Optional[AdaptiveConcurrencyLimiter] = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_limiter() -> AdaptiveConcurrencyLimiter:
+    """
+    获取进程内共享的并发控制器（按配置创建）
+
+    Returns:
+        AdaptiveConcurrencyLimiter: 共享控制器
+    """
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None:
+            _shared_limiter = AdaptiveConcurrencyLimiter(
+                initial_limit=config.TTS_INITIAL_IN_FLIGHT,
+                min_limit=config.TTS_MIN_IN_FLIGHT,
+                max_limit=config.TTS_MAX_IN_FLIGHT
+            )
+        return _shared_limiter
@@ -16,10 +16,78 @@ class Config:
     TTS_APP_ID = os.getenv('TTS_APP_ID')
     TTS_CLUSTER = os.getenv('TTS_CLUSTER', 'volcano_tts')
     
+    # HTTP合成端点（可指向本地模拟服务，见 src/tts_stub_server.py）
+    TTS_HTTP_URL = os.getenv('TTS_HTTP_URL', 'https://openspeech.bytedance.com/api/v1/tts')
+    
+    # WebSocket流式合成端点（二进制协议）
+    TTS_WS_URL = os.getenv('TTS_WS_URL', 'wss://openspeech.bytedance.com/api/v1/tts/ws_binary')
+    
     # 新的音色和参数配置
     TTS_VOICE_TYPE = os.getenv('TTS_VOICE_TYPE', 'zh_male_M392_conversation_wvae_bigtts')
     TTS_SPEED_RATIO = float(os.getenv('TTS_SPEED_RATIO', '1.0'))
     
+    # 并发配置：同时进行的最大TTS请求数（1表示串行）
+    TTS_CONCURRENCY = int(os.getenv('TTS_CONCURRENCY', '1'))
+    
+    # 最长优先调度：按学习到的各音色合成耗时，先派发预计最长的片段和章节
+    TTS_LONGEST_FIRST = os.getenv('TTS_LONGEST_FIRST', 'true').lower() in ('1', 'true', 'yes')
+    
+    # 自适应并发控制（AIMD）：进程内所有请求共享的在途请求上限范围和初始值
+    TTS_MIN_IN_FLIGHT = int(os.getenv('TTS_MIN_IN_FLIGHT', '1'))
+    TTS_MAX_IN_FLIGHT = int(os.getenv('TTS_MAX_IN_FLIGHT', '32'))
+    TTS_INITIAL_IN_FLIGHT = int(os.getenv('TTS_INITIAL_IN_FLIGHT', '4'))
+    
+    # HTTP连接池配置：最大连接数和空闲连接保持时间（秒）
+    TTS_POOL_SIZE = int(os.getenv('TTS_POOL_SIZE', '32'))
+    TTS_KEEPALIVE_TIMEOUT = float(os.getenv('TTS_KEEPALIVE_TIMEOUT', '60'))
+    
+    # 音频缓存配置：相同文本和参数的合成结果缓存到磁盘，超过上限按LRU淘汰
+    TTS_CACHE_ENABLED = os.getenv('TTS_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    TTS_CACHE_MAX_MB = float(os.getenv('TTS_CACHE_MAX_MB', '2048'))
+    
+    # 请求计时指标：运行期间以Prometheus格式提供的端口（0表示不启动），结束时写入的JSON文件（空表示不写）
+    TTS_METRICS_PORT = int(os.getenv('TTS_METRICS_PORT', '0'))
+    TTS_METRICS_FILE = os.getenv('TTS_METRICS_FILE', '')
+    
+    # 单次TTS请求文本的UTF-8字节上限
+    TTS_MAX_REQUEST_BYTES = int(os.getenv('TTS_MAX_REQUEST_BYTES', '1024'))
+    
+    # 相邻同音色的行合并为一次请求（不超过字节上限），行间插入停顿（毫秒，0表示只换行）
+    TTS_PACK_LINES = os.getenv('TTS_PACK_LINES', 'false').lower() in ('1', 'true', 'yes')
+    TTS_PACK_PAUSE_MS = int(os.getenv('TTS_PACK_PAUSE_MS', '300'))
+    
+    # 片段之间的停顿（毫秒，按帧插入预先编码的静音）：同一行切分出的各段之间、段落（剧本的一行）结束、
+    # 换人说话、旁白与对话切换，同时满足多条时取最长
+    PAUSE_CHUNK_MS = int(os.getenv('PAUSE_CHUNK_MS', '150'))
+    PAUSE_PARAGRAPH_MS = int(os.getenv('PAUSE_PARAGRAPH_MS', '300'))
+    PAUSE_SPEAKER_CHANGE_MS = int(os.getenv('PAUSE_SPEAKER_CHANGE_MS', '500'))
+    PAUSE_NARRATION_DIALOGUE_MS = int(os.getenv('PAUSE_NARRATION_DIALOGUE_MS', '700'))
+    
+    # 边生成边收听：同时输出HLS分段（<输出文件名>_hls/index.m3u8），媒体片段的期望时长（秒）
+    HLS_OUTPUT = os.getenv('HLS_OUTPUT', 'false').lower() in ('1', 'true', 'yes')
+    HLS_SEGMENT_SECONDS = float(os.getenv('HLS_SEGMENT_SECONDS', '6'))
+    
+    # 响度归一化：每个（音色, 语速）测量前几段音频的响度并缓存增益，合并时统一调整到目标响度（dBFS）；
+    # 测量需要numpy和ffmpeg，已缓存的音色不需要；增益绝对值不超过上限（dB）
+    LOUDNESS_NORMALIZE = os.getenv('LOUDNESS_NORMALIZE', 'false').lower() in ('1', 'true', 'yes')
+    LOUDNESS_TARGET_DB = float(os.getenv('LOUDNESS_TARGET_DB', '-20'))
+    LOUDNESS_PROFILE_CLIPS = int(os.getenv('LOUDNESS_PROFILE_CLIPS', '3'))
+    LOUDNESS_MAX_GAIN_DB = float(os.getenv('LOUDNESS_MAX_GAIN_DB', '12'))
+    
+    # PCM流水线：向服务端请求WAV（采样率见PCM_SAMPLE_RATE），采样写入章节缓冲区，
+    # 停顿和增益在缓冲区中处理，整章只编码一次到OUTPUT_FORMAT（mp3/ogg_opus需要ffmpeg）
+    TTS_PCM_PIPELINE = os.getenv('TTS_PCM_PIPELINE', 'false').lower() in ('1', 'true', 'yes')
+    PCM_SAMPLE_RATE = int(os.getenv('PCM_SAMPLE_RATE', '24000'))
+    PCM_ENCODE_BITRATE = os.getenv('PCM_ENCODE_BITRATE', '64k')
+    
+    # 拼接前预处理音频片段的进程数（与合成并行，0表示在主进程中处理），默认等于CPU核数
+    AUDIO_WORKERS = int(os.getenv('AUDIO_WORKERS', str(os.cpu_count() or 1)))
+    
+    # 合成守护进程：同时执行的任务数、每个任务最多尝试次数、心跳超时（秒，超时的运行中任务重新排队）
+    DAEMON_WORKERS = int(os.getenv('DAEMON_WORKERS', '2'))
+    JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+    JOB_STALE_SECONDS = float(os.getenv('JOB_STALE_SECONDS', '60'))
+    
     # 兼容旧参数（已弃用）
     TTS_SPEED = float(os.getenv('TTS_SPEED', '1.0'))
     TTS_VOLUME = float(os.getenv('TTS_VOLUME', '1.0'))
@@ -33,6 +101,11 @@ class Config:
     DATA_DIR = BASE_DIR / 'data'
     INPUT_DIR = DATA_DIR / 'input'
     OUTPUT_DIR = DATA_DIR / 'output'
+    CACHE_DIR = DATA_DIR / 'cache'
+    TTS_CACHE_DIR = os.getenv('TTS_CACHE_DIR', str(CACHE_DIR / 'tts'))
+    LOUDNESS_PROFILE_FILE = os.getenv('LOUDNESS_PROFILE_FILE', str(CACHE_DIR / 'loudness.json'))
+    SYNTHESIS_MODEL_FILE = os.getenv('SYNTHESIS_MODEL_FILE', str(CACHE_DIR / 'synthesis_model.json'))
+    JOB_QUEUE_DB = os.getenv('JOB_QUEUE_DB', str(DATA_DIR / 'jobs.db'))
     
     @classmethod
     def validate(cls):
@@ -0,0 +1,171 @@
+"""
+边生成边收听的分段输出（HLS）
+按剧本顺序写出的音频被切成编号的MP3媒体片段，每写出一个片段就更新一次m3u8播放列表，
+播放器打开播放列表即可在章节合成过程中开始播放；全部完成后写入结束标记
+"""
+
+import os
+import math
+import struct
+import tempfile
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+try:
+    from loguru import logger
+except ImportError:
+    import logging
+    logger = logging.getLogger(__name__)
+
+from config import config
+from mp3_frames import FrameHeader, Mp3FormatError, iter_frames, silence_frame_count, silent_frame
+
+PLAYLIST_NAME = 'index.m3u8'
+SEGMENT_PATTERN = 'seg{:05d}.mp3'
+
+# 打包音频（packed audio）片段开头的ID3时间戳：PRIV帧，负载为33位的90kHz PTS
+_TIMESTAMP_OWNER = b'com.apple.streaming.transportStreamTimestamp\x00'
+
+
+def playlist_dir_for(output_path) -> Path:
+    """输出文件对应的分段目录：<输出文件名>_hls/"""
+    output_path = Path(output_path)
+    return output_path.with_name(output_path.stem + '_hls')
+
+
+def _syncsafe(value: int) -> bytes:
+    return bytes(((value >> 21) & 0x7F, (value >> 14) & 0x7F, (value >> 7) & 0x7F, value & 0x7F))
+
+
+def _timestamp_tag(seconds: float) -> bytes:
+    """生成携带片段起始时间的ID3v2.4标签"""
+    pts = int(round(seconds * 90000)) & ((1 << 33) - 1)
+    body = _TIMESTAMP_OWNER + struct.pack('>Q', pts)
+    frame = b'PRIV' + _syncsafe(len(body)) + b'\x00\x00' + body
+    return b'ID3\x04\x00\x00' + _syncsafe(len(frame)) + frame
+
+
+class HlsSegmenter:
+    """
+    把按顺序到达的MP3片段切成HLS媒体片段
+
+    优先在两个音频片段之间切分（每个TTS片段的第一帧不引用前面的比特池）；
+    单个片段过长时在帧边界强制切分，保证每个媒体片段都不超过播放列表声明的目标时长
+    """
+
+    def __init__(self, playlist_dir: str, segment_seconds: Optional[float] = None):
+        """
+        初始化分段器
+
+        Args:
+            playlist_dir: 媒体片段和播放列表所在目录（已有的旧片段会被清理）
+            segment_seconds: 媒体片段的期望时长（秒），默认读取配置HLS_SEGMENT_SECONDS
+        """
+        self.playlist_dir = Path(playlist_dir)
+        self.segment_seconds = segment_seconds or config.HLS_SEGMENT_SECONDS
+        # 强制切分的上限，同时作为播放列表的目标时长
+        self.target_duration = math.ceil(self.segment_seconds * 2)
+
+        self.header: Optional[FrameHeader] = None
+        self.duration = 0.0
+        self._frames = bytearray()
+        self._frame_count = 0
+        self._entries: List[Tuple[str, float]] = []
+        self._finished = False
+
+        self.playlist_dir.mkdir(parents=True, exist_ok=True)
+        for old in self.playlist_dir.glob('seg*.mp3'):
+            old.unlink()
+        self._write_playlist()
+
+    @property
+    def segment_count(self) -> int:
+        return len(self._entries)
+
+    @property
+    def playlist_path(self) -> Path:
+        return self.playlist_dir / PLAYLIST_NAME
+
+    def _buffered_duration(self) -> float:
+        return self._frame_count * self.header.duration if self.header else 0.0
+
+    def _append_frame(self, header: FrameHeader, frame):
+        if self.header is None:
+            self.header = header
+        elif header.stream_format != self.header.stream_format:
+            raise Mp3FormatError(f"片段格式不一致: {header.sample_rate}Hz，期望 {self.header.sample_rate}Hz")
+        self._frames += frame
+        self._frame_count += 1
+        if self._buffered_duration() >= self.target_duration - self.header.duration:
+            self._cut()
+
+    def add(self, data: bytes):
+        """
+        追加一个完整的MP3片段
+
+        Args:
+            data: 单个MP3文件的完整数据
+        """
+        for header, frame in iter_frames(data):
+            self._append_frame(header, frame)
+        if self._buffered_duration() >= self.segment_seconds:
+            self._cut()
+
+    def add_silence(self, duration_ms: int):
+        """追加静音（尚未写入任何片段时忽略）"""
+        if self.header is None or duration_ms <= 0:
+            return
+        frame = silent_frame(self.header)
+        for _ in range(silence_frame_count(self.header, duration_ms)):
+            self._append_frame(self.header, frame)
+
+    def _cut(self):
+        """把缓冲的帧写成一个媒体片段并更新播放列表"""
+        if not self._frame_count:
+            return
+        seg_duration = self._buffered_duration()
+        name = SEGMENT_PATTERN.format(len(self._entries))
+        self._atomic_write(self.playlist_dir / name, _timestamp_tag(self.duration) + bytes(self._frames))
+
+        self._entries.append((name, seg_duration))
+        self.duration += seg_duration
+        self._frames.clear()
+        self._frame_count = 0
+        self._write_playlist()
+        logger.debug(f"HLS片段 {name}: {seg_duration:.2f} 秒，累计 {self.duration:.1f} 秒")
+
+    def finish(self):
+        """写出剩余的帧并在播放列表中标记结束"""
+        if self._finished:
+            return
+        self._cut()
+        self._finished = True
+        self._write_playlist()
+        logger.info(f"HLS播放列表完成: {self.playlist_path}（{self.segment_count} 个片段，{self.duration:.1f} 秒）")
+
+    def _write_playlist(self):
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            f'#EXT-X-TARGETDURATION:{self.target_duration}',
+            '#EXT-X-MEDIA-SEQUENCE:0',
+            '#EXT-X-PLAYLIST-TYPE:EVENT',
+        ]
+        for name, seg_duration in self._entries:
+            lines.append(f'#EXTINF:{seg_duration:.3f},')
+            lines.append(name)
+        if self._finished:
+            lines.append('#EXT-X-ENDLIST')
+        self._atomic_write(self.playlist_path, ('\n'.join(lines) + '\n').encode('utf-8'))
+
+    def _atomic_write(self, path: Path, data: bytes):
+        """先写临时文件再替换，播放器不会读到写了一半的文件"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.playlist_dir, prefix=f".{path.name}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
@@ -0,0 +1,416 @@
+"""
+持久化的合成任务队列
+任务保存在SQLite数据库中（状态、优先级、重试次数和结果），常驻的守护进程（见synthesis_daemon）
+按优先级领取执行；命令行工具提交任务后等待结果即可，不必每次重新导入模块、加载角色配置和建立连接。
+数据库使用WAL模式，多个进程可以同时提交和查询
+"""
+
+import os
+import json
+import time
+import socket
+import sqlite3
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+try:
+    from loguru import logger
+except ImportError:
+    import logging
+    logger = logging.getLogger(__name__)
+
+from config import config
+
+# 任务类型：单个剧本章节（script_to_audio）、整个故事目录（story_tts）、纯文本文件（main）
+KIND_CHAPTER = 'chapter'
+KIND_STORY = 'story'
+KIND_TEXT = 'text'
+JOB_KINDS = (KIND_CHAPTER, KIND_STORY, KIND_TEXT)
+
+# 任务状态
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_CANCELLED = 'cancelled'
+FINISHED_STATUSES = (STATUS_DONE, STATUS_FAILED, STATUS_CANCELLED)
+
+# 失败后重新排队的等待时间（秒）：基数按尝试次数翻倍，不超过上限
+RETRY_BACKOFF_BASE = 5.0
+RETRY_BACKOFF_MAX = 300.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    priority INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 1,
+    result TEXT,
+    error TEXT,
+    worker TEXT,
+    created_at REAL NOT NULL,
+    available_at REAL NOT NULL,
+    started_at REAL,
+    heartbeat_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, priority DESC, id);
+CREATE TABLE IF NOT EXISTS workers (
+    name TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    heartbeat_at REAL NOT NULL
+);
+"""
+
+
+@dataclass
+class Job:
+    """队列中的一个任务"""
+    id: int
+    kind: str
+    payload: Dict[str, Any]
+    status: str
+    priority: int
+    attempts: int
+    max_attempts: int
+    result: Optional[Dict[str, Any]]
+    error: Optional[str]
+    worker: Optional[str]
+    created_at: float
+    started_at: Optional[float]
+    finished_at: Optional[float]
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> 'Job':
+        return cls(
+            id=row['id'],
+            kind=row['kind'],
+            payload=json.loads(row['payload']),
+            status=row['status'],
+            priority=row['priority'],
+            attempts=row['attempts'],
+            max_attempts=row['max_attempts'],
+            result=json.loads(row['result']) if row['result'] else None,
+            error=row['error'],
+            worker=row['worker'],
+            created_at=row['created_at'],
+            started_at=row['started_at'],
+            finished_at=row['finished_at']
+        )
+
+
+def worker_name() -> str:
+    """当前进程作为守护进程时的名称：主机名:进程号"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    """
+    SQLite任务队列
+
+    每次操作使用独立的短连接，可以在多个线程和进程中同时使用；
+    领取任务在写事务中完成，同一个任务不会被两个守护进程同时领取
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        初始化队列（数据库不存在时创建）
+
+        Args:
+            path: 数据库文件路径，默认读取配置JOB_QUEUE_DB
+        """
+        self.path = Path(path or config.JOB_QUEUE_DB)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # journal_mode不能在事务中修改，建表前单独设置
+        conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """打开连接，正常结束时提交，异常时回滚"""
+        conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def submit(self, kind: str, payload: Dict[str, Any], priority: int = 0,
+               max_attempts: Optional[int] = None) -> int:
+        """
+        提交一个任务
+
+        Args:
+            kind: 任务类型（chapter、story或text）
+            payload: 任务参数（可序列化为JSON），文件路径应为绝对路径
+            priority: 优先级，数值大的先执行，相同时按提交顺序
+            max_attempts: 最多尝试次数，默认读取配置JOB_MAX_ATTEMPTS
+
+        Returns:
+            int: 任务ID
+
+        Raises:
+            ValueError: 未知的任务类型
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f"未知的任务类型: {kind}，可选 {', '.join(JOB_KINDS)}")
+        attempts = max(1, config.JOB_MAX_ATTEMPTS if max_attempts is None else max_attempts)
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                'INSERT INTO jobs (kind, payload, priority, max_attempts, created_at, available_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (kind, json.dumps(payload, ensure_ascii=False), priority, attempts, now, now))
+            return cursor.lastrowid
+
+    def claim(self, worker: str) -> Optional[Job]:
+        """
+        领取优先级最高的可执行任务，并标记为运行中
+
+        Args:
+            worker: 守护进程名称
+
+        Returns:
+            Optional[Job]: 领取到的任务，没有可执行的任务时返回None
+        """
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT id FROM jobs WHERE status = ? AND available_at <= ? ORDER BY priority DESC, id LIMIT 1',
+                (STATUS_QUEUED, now)).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                'UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, started_at = ?, heartbeat_at = ? '
+                'WHERE id = ?',
+                (STATUS_RUNNING, worker, now, now, row['id']))
+            return Job.from_row(conn.execute('SELECT * FROM jobs WHERE id = ?', (row['id'],)).fetchone())
+
+    def complete(self, job_id: int, result: Dict[str, Any]):
+        """标记任务成功完成并保存结果"""
+        with self._connect() as conn:
+            conn.execute('UPDATE jobs SET status = ?, result = ?, error = NULL, finished_at = ? WHERE id = ?',
+                         (STATUS_DONE, json.dumps(result, ensure_ascii=False), time.time(), job_id))
+
+    def fail(self, job_id: int, error: str, result: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        记录一次失败：还有尝试次数时延迟后重新排队，否则标记为失败
+
+        Args:
+            job_id: 任务ID
+            error: 错误信息
+            result: 部分结果（可选）
+
+        Returns:
+            bool: 是否已重新排队
+        """
+        now = time.time()
+        payload = json.dumps(result, ensure_ascii=False) if result is not None else None
+        with self._connect() as conn:
+            row = conn.execute('SELECT attempts, max_attempts, status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None or row['status'] != STATUS_RUNNING:
+                return False
+            if row['attempts'] < row['max_attempts']:
+                delay = min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** (row['attempts'] - 1))
+                conn.execute('UPDATE jobs SET status = ?, error = ?, result = ?, worker = NULL, available_at = ? '
+                             'WHERE id = ?', (STATUS_QUEUED, error, payload, now + delay, job_id))
+                return True
+            conn.execute('UPDATE jobs SET status = ?, error = ?, result = ?, finished_at = ? WHERE id = ?',
+                         (STATUS_FAILED, error, payload, now, job_id))
+            return False
+
+    def cancel(self, job_id: int) -> bool:
+        """
+        取消一个尚未开始的任务（运行中的任务不能取消）
+
+        Returns:
+            bool: 是否已取消
+        """
+        with self._connect() as conn:
+            cursor = conn.execute('UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?',
+                                  (STATUS_CANCELLED, time.time(), job_id, STATUS_QUEUED))
+            return cursor.rowcount > 0
+
+    def get(self, job_id: int) -> Optional[Job]:
+        """按ID查询任务"""
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return Job.from_row(row) if row is not None else None
+
+    def list(self, status: Optional[str] = None, limit: int = 50) -> List[Job]:
+        """
+        列出最近的任务
+
+        Args:
+            status: 只列出该状态的任务（可选）
+            limit: 最多列出的数量
+
+        Returns:
+            List[Job]: 按ID从新到旧排列的任务
+        """
+        with self._connect() as conn:
+            if status is None:
+                rows = conn.execute('SELECT * FROM jobs ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+            else:
+                rows = conn.execute('SELECT * FROM jobs WHERE status = ? ORDER BY id DESC LIMIT ?',
+                                    (status, limit)).fetchall()
+        return [Job.from_row(row) for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        """各状态的任务数"""
+        with self._connect() as conn:
+            rows = conn.execute('SELECT status, COUNT(*) AS n FROM jobs GROUP BY status').fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+    def heartbeat(self, worker: str, job_ids: Iterable[int] = ()):
+        """
+        守护进程的心跳：更新自身和正在执行的任务的时间戳
+
+        Args:
+            worker: 守护进程名称
+            job_ids: 正在执行的任务ID
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('INSERT INTO workers (name, pid, started_at, heartbeat_at) VALUES (?, ?, ?, ?) '
+                         'ON CONFLICT(name) DO UPDATE SET heartbeat_at = excluded.heartbeat_at',
+                         (worker, os.getpid(), now, now))
+            conn.executemany('UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND worker = ?',
+                             [(now, job_id, worker) for job_id in job_ids])
+
+    def unregister(self, worker: str):
+        """守护进程退出时注销"""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM workers WHERE name = ?', (worker,))
+
+    def active_workers(self, stale_seconds: Optional[float] = None) -> List[str]:
+        """
+        最近有心跳的守护进程
+
+        Args:
+            stale_seconds: 超过该秒数没有心跳视为已退出，默认读取配置JOB_STALE_SECONDS
+        """
+        stale = config.JOB_STALE_SECONDS if stale_seconds is None else stale_seconds
+        with self._connect() as conn:
+            rows = conn.execute('SELECT name FROM workers WHERE heartbeat_at >= ?', (time.time() - stale,)).fetchall()
+        return [row['name'] for row in rows]
+
+    def requeue_stale(self, stale_seconds: Optional[float] = None) -> int:
+        """
+        处理心跳超时的运行中任务（守护进程崩溃或被终止）：中断计为一次尝试，
+        还有尝试次数时重新排队，否则标记为失败（避免一个会拖垮守护进程的任务在每次重启后反复执行）
+
+        Args:
+            stale_seconds: 超过该秒数没有心跳视为中断，默认读取配置JOB_STALE_SECONDS
+
+        Returns:
+            int: 重新排队的任务数
+        """
+        stale = config.JOB_STALE_SECONDS if stale_seconds is None else stale_seconds
+        now = time.time()
+        error = "守护进程中断（心跳超时）"
+        with self._connect() as conn:
+            cursor = conn.execute(
+                'UPDATE jobs SET status = ?, worker = NULL, error = ?, available_at = ? '
+                'WHERE status = ? AND heartbeat_at < ? AND attempts < max_attempts',
+                (STATUS_QUEUED, error, now, STATUS_RUNNING, now - stale))
+            count = cursor.rowcount
+            cursor = conn.execute(
+                'UPDATE jobs SET status = ?, error = ?, finished_at = ? '
+                'WHERE status = ? AND heartbeat_at < ? AND attempts >= max_attempts',
+                (STATUS_FAILED, error, now, STATUS_RUNNING, now - stale))
+            failed = cursor.rowcount
+            conn.execute('DELETE FROM workers WHERE heartbeat_at < ?', (now - stale,))
+        if count:
+            logger.warning(f"{count} 个任务的守护进程已无心跳，重新排队")
+        if failed:
+            logger.error(f"{failed} 个任务的守护进程已无心跳且已用完尝试次数，标记为失败")
+        return count
+
+    def wait(self, job_ids: Iterable[int], timeout: Optional[float] = None, poll_interval: float = 0.5,
+             on_finish: Optional[Callable[[Job], None]] = None) -> List[Job]:
+        """
+        等待任务结束（成功、失败或取消）
+
+        Args:
+            job_ids: 任务ID
+            timeout: 最长等待秒数，None表示一直等待
+            poll_interval: 查询间隔（秒）
+            on_finish: 每个任务结束时的回调（可选）
+
+        Returns:
+            List[Job]: 与job_ids顺序一致的任务最新状态（超时时可能仍未结束）
+        """
+        job_ids = list(job_ids)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        pending = set(job_ids)
+        jobs: Dict[int, Job] = {}
+        while True:
+            for job_id in list(pending):
+                job = self.get(job_id)
+                if job is None:
+                    raise KeyError(f"任务不存在: {job_id}")
+                jobs[job_id] = job
+                if job.finished:
+                    pending.discard(job_id)
+                    if on_finish is not None:
+                        on_finish(job)
+            if not pending or (deadline is not None and time.monotonic() >= deadline):
+                return [jobs[job_id] for job_id in job_ids]
+            time.sleep(poll_interval)
+
+
+def submit_and_wait(queue: JobQueue, kind: str, payloads: List[Dict[str, Any]], priority: int = 0,
+                    wait: bool = True, timeout: Optional[float] = None) -> List[Job]:
+    """
+    命令行工具使用：提交一批任务，并等待守护进程执行完成
+
+    Args:
+        queue: 任务队列
+        kind: 任务类型
+        payloads: 每个任务的参数
+        priority: 优先级
+        wait: 是否等待任务结束
+        timeout: 最长等待秒数，None表示一直等待
+
+    Returns:
+        List[Job]: 各任务的最新状态；不等待、超时或等待被中断（Ctrl+C）时任务仍留在队列中
+    """
+    job_ids = [queue.submit(kind, payload, priority) for payload in payloads]
+    logger.info(f"已提交 {len(job_ids)} 个任务到 {queue.path}: {', '.join(f'#{job_id}' for job_id in job_ids)}")
+    if not queue.active_workers():
+        logger.warning("没有运行中的合成守护进程，任务将在守护进程启动后执行（python src/synthesis_daemon.py run）")
+    if not wait:
+        return [queue.get(job_id) for job_id in job_ids]
+
+    def report(job: Job):
+        if job.status == STATUS_DONE:
+            logger.info(f"任务 #{job.id} 完成: {job.payload.get('output_file') or job.payload.get('story_dir')}")
+        else:
+            logger.error(f"任务 #{job.id} {job.status}: {job.error}")
+
+    try:
+        return queue.wait(job_ids, timeout, on_finish=report)
+    except KeyboardInterrupt:
+        logger.warning("停止等待，任务仍在队列中（python src/synthesis_daemon.py list 查看）")
+        return [queue.get(job_id) for job_id in job_ids]
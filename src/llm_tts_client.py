@@ -1,15 +1,20 @@
 """
 大模型语音合成API客户端
-使用HTTP方式进行语音合成
+使用HTTP方式进行语音合成，或通过WebSocket二进制协议流式接收音频
 """
 
-import json
-import base64
 import uuid
+import time
+import queue
+import random
+import struct
 import asyncio
+import threading
 import aiohttp
-from typing import Optional, Dict, Any
-import concurrent.futures
+from pathlib import Path
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, Iterable, Iterator, AsyncIterator, List, Tuple, Union
 
 try:
     from loguru import logger
@@ -23,18 +28,122 @@ except ImportError:
     logger.addHandler(handler)
 
 from config import config
+from tts_cache import TTSCache
+from concurrency import AdaptiveConcurrencyLimiter, get_shared_limiter
+from segment_packer import is_ssml
+from text_chunker import split_text
+from mp3_frames import Mp3Muxer
+from pcm_audio import PCM_ENCODINGS
+from tts_ws_protocol import ProtocolError, encode_request, decode_message
+from tts_response import AudioBuffer, AudioResponseDecoder
+from synthesis_model import SynthesisEstimate, SynthesisTimeModel, audio_duration, get_synthesis_model
+from tts_metrics import (TTSMetrics, RequestTiming, get_metrics, create_trace_config, OUTCOME_OK,
+                         OUTCOME_THROTTLED, OUTCOME_SERVER_ERROR, OUTCOME_NETWORK, OUTCOME_CLIENT_ERROR)
+
+
+class TTSError(Exception):
+    """TTS合成失败"""
+
+
+class TTSRetryableError(TTSError):
+    """可重试的TTS错误（服务器错误、限流、网络异常等）"""
+
+
+class TTSThrottledError(TTSRetryableError):
+    """限流错误（HTTP 429或并发超限），会触发并发控制器降低上限"""
+
+
+@dataclass
+class SynthesisResult:
+    """批量合成中单个条目的结果"""
+    index: int
+    audio: Optional[AudioBuffer] = None
+    error: Optional[str] = None
+    
+    @property
+    def ok(self) -> bool:
+        return self.audio is not None
 
 
 class LLMTTSClient:
     """大模型语音合成API客户端"""
     
     # API端点
-    HTTP_URL = "https://openspeech.bytedance.com/api/v1/tts"
+    HTTP_URL = config.TTS_HTTP_URL
+    WS_URL = config.TTS_WS_URL
+    
+    # HTTP响应体分块读取的大小（字节），音频边接收边解码
+    RESPONSE_CHUNK_SIZE = 64 * 1024
+    
+    # WebSocket流式合成时等待单条服务端消息的超时（秒）
+    WS_RECEIVE_TIMEOUT = 60
+    
+    # 限流重试的指数退避（秒）：基数和上限，实际等待时间带随机抖动
+    THROTTLE_BACKOFF_BASE = 0.5
+    THROTTLE_BACKOFF_MAX = 8.0
     
-    def __init__(self):
-        """初始化客户端"""
+    def __init__(self, cache: Optional[TTSCache] = None,
+                 limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+                 metrics: Optional[TTSMetrics] = None,
+                 synthesis_model: Optional[SynthesisTimeModel] = None):
+        """
+        初始化客户端
+        
+        Args:
+            cache: 音频缓存，默认在配置TTS_CACHE_ENABLED开启时使用磁盘缓存
+            limiter: 并发控制器，默认使用进程内共享的AIMD控制器
+            metrics: 请求计时指标，默认使用进程内共享的实例
+            synthesis_model: 合成耗时模型，默认使用进程内共享的实例；每次成功的HTTP请求都会记入
+        """
         self._validate_config()
         
+        if cache is None and config.TTS_CACHE_ENABLED:
+            cache = TTSCache()
+        self.cache = cache
+        self.limiter = limiter or get_shared_limiter()
+        self.metrics = metrics or get_metrics()
+        self.synthesis_model = synthesis_model or get_synthesis_model()
+        
+        # 在途请求合并：相同请求键的并发调用共享同一个任务（只在客户端事件循环中访问）
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.coalesced_requests = 0
+        
+        # 请求统计（只在客户端事件循环中更新）：每次尝试的耗时（秒，不含排队）和重试次数
+        self.request_latencies: List[float] = []
+        self.retry_count = 0
+        
+        # 客户端独占的事件循环（在后台线程中运行）和长连接会话
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._lock = threading.Lock()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+    
+    def close(self):
+        """关闭HTTP会话并停止后台事件循环，之后再次调用会重新创建"""
+        self.synthesis_model.save()
+        with self._lock:
+            loop, thread = self._loop, self._loop_thread
+            self._loop, self._loop_thread = None, None
+        
+        if loop is None:
+            return
+        
+        try:
+            asyncio.run_coroutine_threadsafe(self._close_session(), loop).result(timeout=10)
+        except Exception as e:
+            logger.warning(f"关闭HTTP会话失败: {str(e)}")
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout=10)
+            loop.close()
+            logger.debug("TTS客户端已关闭")
+    
     def _validate_config(self):
         """验证配置"""
         required_vars = ['TTS_TOKEN', 'TTS_APP_ID']
@@ -51,9 +160,9 @@ class LLMTTSClient:
                       voice_type: Optional[str] = None,
                       speed_ratio: Optional[float] = None,
                       encoding: Optional[str] = None,
-                      max_retries: int = 3) -> Optional[bytes]:
+                      max_retries: int = 3) -> Optional[AudioBuffer]:
         """
-        将文本转换为语音
+        将文本转换为语音（同步接口，内部调用synthesize）
         
         Args:
             text: 要转换的文本
@@ -63,132 +172,637 @@ class LLMTTSClient:
             max_retries: 最大重试次数，默认3次
             
         Returns:
-            Optional[bytes]: 音频字节数据，失败返回None
+            Optional[AudioBuffer]: 音频字节数据，失败返回None
+        """
+        try:
+            return self._run_async_task(self.synthesize(text, voice_type, speed_ratio, encoding, max_retries))
+        except TTSError as e:
+            logger.error(f"TTS转换失败: {str(e)}")
+            return None
+        except Exception as e:
+            # 同步接口保持失败返回None的约定（缓存、解码、网络或超时等异常都不向调用方抛出）
+            logger.error(f"TTS转换异常: {type(e).__name__}: {e}")
+            return None
+    
+    async def synthesize(self, text: str,
+                         voice_type: Optional[str] = None,
+                         speed_ratio: Optional[float] = None,
+                         encoding: Optional[str] = None,
+                         max_retries: int = 3) -> AudioBuffer:
+        """
+        将文本转换为语音（异步接口，可在任意事件循环中await）
+        
+        Args:
+            text: 要转换的文本
+            voice_type: 音色类型
+            speed_ratio: 语速比例
+            encoding: 音频编码格式
+            max_retries: 最大重试次数，默认3次
+            
+        Returns:
+            bytes: 音频字节数据
+            
+        Raises:
+            TTSError: 合成失败（重试耗尽或不可重试的错误）
+        """
+        return await self._submit(self._synthesize(text, voice_type, speed_ratio, encoding, max_retries))
+    
+    async def synthesize_many(self, items: Iterable[Union[str, Dict[str, Any]]],
+                              concurrency: int = 4,
+                              max_retries: int = 3) -> List[SynthesisResult]:
         """
+        批量将文本转换为语音，最多同时进行concurrency个请求
+        
+        Args:
+            items: 文本列表，每项为字符串或包含text/voice_type/speed_ratio/encoding的字典
+            concurrency: 同时进行的最大请求数
+            max_retries: 每个条目的最大重试次数
+            
+        Returns:
+            List[SynthesisResult]: 与输入顺序一致的结果列表，失败条目的error字段为错误信息
+        """
+        return await self._submit(self._synthesize_many(list(items), concurrency, max_retries))
+    
+    async def _submit(self, coro):
+        """在客户端事件循环中执行协程；调用方在其他事件循环时跨线程等待结果"""
+        loop = self._ensure_loop()
+        if asyncio.get_running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+    
+    def request_key(self, text: str, voice_type: Optional[str] = None,
+                    speed_ratio: Optional[float] = None, encoding: Optional[str] = None) -> str:
+        """
+        计算请求键：音色、规范化文本和参数都相同的请求会得到相同的音频
+        
+        Returns:
+            str: 请求键（同时用作缓存键）
+        """
+        voice_type, speed_ratio, encoding = self._resolve_audio_params(voice_type, speed_ratio, encoding)
+        if encoding in PCM_ENCODINGS:
+            # 不同采样率的结果不能混用
+            encoding = f"{encoding}@{config.PCM_SAMPLE_RATE}"
+        return TTSCache.make_key(text, voice_type, speed_ratio, encoding, config.TTS_CLUSTER)
+    
+    def estimate(self, text: str, voice_type: Optional[str] = None,
+                 speed_ratio: Optional[float] = None) -> SynthesisEstimate:
+        """
+        按合成耗时模型估计一次请求的耗时和音频时长
+        
+        Returns:
+            SynthesisEstimate: 预计的请求耗时和音频时长（秒）
+        """
+        return self.synthesis_model.estimate(voice_type, speed_ratio, len(text.encode('utf-8')))
+    
+    async def _synthesize(self, text: str, voice_type: Optional[str], speed_ratio: Optional[float],
+                          encoding: Optional[str], max_retries: int) -> AudioBuffer:
+        """合并相同的在途请求（只在客户端事件循环中调用）"""
+        key = self.request_key(text, voice_type, speed_ratio, encoding)
+        
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced_requests += 1
+            logger.debug(f"复用在途请求 {key[:12]}")
+        else:
+            task = asyncio.ensure_future(
+                self._synthesize_cached(key, text, voice_type, speed_ratio, encoding, max_retries))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        
+        # shield：某个调用方取消时不影响共享同一任务的其他调用方
+        return await asyncio.shield(task)
+    
+    async def _synthesize_cached(self, key: str, text: str, voice_type: Optional[str],
+                                 speed_ratio: Optional[float], encoding: Optional[str],
+                                 max_retries: int) -> AudioBuffer:
+        """先查缓存，未命中时请求API并写入缓存"""
+        if self.cache is None:
+            return await self._request_with_retry(text, voice_type, speed_ratio, encoding, max_retries)
+        
+        loop = asyncio.get_running_loop()
+        
+        # 缓存读写是磁盘IO，放到线程池中避免阻塞事件循环
+        cached = await loop.run_in_executor(None, self.cache.get, key)
+        if cached is not None:
+            return cached
+        
+        audio_bytes = await self._request_with_retry(text, voice_type, speed_ratio, encoding, max_retries)
+        await loop.run_in_executor(None, self.cache.put, key, audio_bytes)
+        return audio_bytes
+    
+    async def _request_with_retry(self, text: str, voice_type: Optional[str], speed_ratio: Optional[float],
+                                  encoding: Optional[str], max_retries: int) -> AudioBuffer:
+        """带重试的单条合成请求"""
         # 确保至少尝试一次
         actual_retries = max(1, max_retries)
         
         for attempt in range(actual_retries):
+            epoch = self.limiter.epoch
             try:
                 logger.info(f"TTS请求第 {attempt + 1}/{actual_retries} 次尝试")
-                result = self._run_async_task(self._http_tts(text, voice_type, speed_ratio, encoding))
-                if result:
-                    return result
-                else:
-                    logger.warning(f"第 {attempt + 1} 次尝试失败，返回结果为空")
-            except Exception as e:
+                queued = time.perf_counter()
+                async with self.limiter.slot() as epoch:
+                    timing = RequestTiming(queue_wait=time.perf_counter() - queued)
+                    with self._timed(timing):
+                        audio_bytes = await self._http_tts(text, voice_type, speed_ratio, encoding, timing)
+                    self.limiter.on_success()
+                self._record_synthesis(voice_type, speed_ratio, timing, audio_bytes)
+                return audio_bytes
+            except TTSRetryableError as e:
                 logger.error(f"第 {attempt + 1} 次尝试失败: {str(e)}")
-                if attempt < actual_retries - 1:
-                    wait_time = (attempt + 1) * 2  # 递增等待时间：2秒、4秒、6秒...
-                    logger.info(f"等待 {wait_time} 秒后重试...")
-                    import time
-                    time.sleep(wait_time)
-                else:
-                    logger.error(f"已达到最大重试次数 {actual_retries}，TTS转换失败")
+                if isinstance(e, TTSThrottledError):
+                    # 包括最后一次尝试在内，每次限流都报告给并发控制器
+                    self.limiter.on_throttle(epoch)
+                if attempt >= actual_retries - 1:
+                    raise TTSError(f"已达到最大重试次数 {actual_retries}: {str(e)}") from e
+                
+                wait_time = self._retry_delay(e, attempt)
+                self.retry_count += 1
+                logger.info(f"等待 {wait_time:.1f} 秒后重试...")
+                await asyncio.sleep(wait_time)
+    
+    def _record_synthesis(self, voice_type: Optional[str], speed_ratio: Optional[float],
+                          timing: RequestTiming, audio_bytes: AudioBuffer):
+        """
+        把一次成功的请求记入合成耗时模型
+
+        优先使用服务端报告的音频时长；没有时逐帧解析音频计算时长，放到线程池中执行，
+        不占用事件循环（不阻塞其他在途请求），也不推迟结果返回
+        """
+        if timing.audio_seconds is not None:
+            self.synthesis_model.record(voice_type, speed_ratio, timing.text_bytes, timing.total,
+                                        timing.audio_seconds)
+            return
+
+        def record():
+            self.synthesis_model.record(voice_type, speed_ratio, timing.text_bytes, timing.total,
+                                        audio_duration(audio_bytes))
+
+        asyncio.get_running_loop().run_in_executor(None, record)
+    
+    @contextmanager
+    def _timed(self, timing: RequestTiming):
+        """计时一次请求尝试，结束时按结果分类记入指标"""
+        started = time.perf_counter()
+        try:
+            yield timing
+            timing.outcome = OUTCOME_OK
+        except TTSError as e:
+            timing.outcome = self._outcome(e, timing.status)
+            raise
+        finally:
+            timing.total = time.perf_counter() - started
+            self.request_latencies.append(timing.total)
+            self.metrics.record(timing)
+    
+    @staticmethod
+    def _outcome(error: TTSError, status: Optional[int]) -> str:
+        """请求失败的结果分类：限流、服务端错误、网络错误（没有收到响应）或客户端错误"""
+        if isinstance(error, TTSThrottledError):
+            return OUTCOME_THROTTLED
+        if isinstance(error, TTSRetryableError):
+            return OUTCOME_NETWORK if status is None else OUTCOME_SERVER_ERROR
+        return OUTCOME_CLIENT_ERROR
+    
+    def _retry_delay(self, error: TTSRetryableError, attempt: int) -> float:
+        """计算重试前的等待时间（秒）"""
+        if isinstance(error, TTSThrottledError):
+            # 限流由并发控制器降低上限，这里只做短暂的指数退避
+            wait_time = min(self.THROTTLE_BACKOFF_MAX, self.THROTTLE_BACKOFF_BASE * 2 ** attempt)
+            return wait_time * random.uniform(0.5, 1.0)
+        return (attempt + 1) * 2  # 递增等待时间：2秒、4秒、6秒...
+    
+    async def _synthesize_many(self, items: List[Union[str, Dict[str, Any]]],
+                               concurrency: int, max_retries: int) -> List[SynthesisResult]:
+        """批量合成（只在客户端事件循环中调用）"""
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        
+        async def run_one(index: int, item: Union[str, Dict[str, Any]]) -> SynthesisResult:
+            params = {'text': item} if isinstance(item, str) else item
+            async with semaphore:
+                try:
+                    audio = await self._synthesize(params['text'], params.get('voice_type'),
+                                                   params.get('speed_ratio'), params.get('encoding'),
+                                                   max_retries)
+                    return SynthesisResult(index=index, audio=audio)
+                except TTSError as e:
+                    return SynthesisResult(index=index, error=str(e))
         
-        return None
+        return await asyncio.gather(*(run_one(i, item) for i, item in enumerate(items)))
+    
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        """获取客户端的后台事件循环，不存在时创建"""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever,
+                                                     name="llm-tts-loop", daemon=True)
+                self._loop_thread.start()
+                logger.debug("TTS客户端事件循环已启动")
+            return self._loop
     
     def _run_async_task(self, coro):
-        """运行异步任务，处理事件循环冲突"""
+        """在客户端的后台事件循环中运行异步任务并等待结果（线程安全）"""
+        loop = self._ensure_loop()
+        
         try:
-            # 尝试获取当前事件循环
-            loop = asyncio.get_running_loop()
-            # 如果已经在事件循环中，使用线程池运行
-            import concurrent.futures
-            
-            def run_in_thread():
-                new_loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(new_loop)
-                try:
-                    return new_loop.run_until_complete(coro)
-                finally:
-                    new_loop.close()
-            
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                future = executor.submit(run_in_thread)
-                return future.result()
-                
+            running_loop = asyncio.get_running_loop()
         except RuntimeError:
-            # 没有事件循环，直接运行
-            return asyncio.run(coro)
+            running_loop = None
+        
+        if running_loop is loop:
+            coro.close()
+            raise RuntimeError("不能在客户端事件循环内部同步调用，请直接await协程")
+        
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+    
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """获取长连接HTTP会话（只在客户端事件循环中调用）"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=config.TTS_POOL_SIZE,
+                limit_per_host=config.TTS_POOL_SIZE,
+                keepalive_timeout=config.TTS_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=300,
+                enable_cleanup_closed=True
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                trace_configs=[create_trace_config()],
+                headers={
+                    "Authorization": f"Bearer;{config.TTS_TOKEN}",
+                    "Content-Type": "application/json"
+                }
+            )
+            logger.debug(f"创建HTTP连接池，最大连接数: {config.TTS_POOL_SIZE}")
+        return self._session
+    
+    async def _close_session(self):
+        """关闭HTTP会话"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
     
     async def _http_tts(self, text: str, voice_type: Optional[str], 
-                       speed_ratio: Optional[float], encoding: Optional[str]) -> Optional[bytes]:
-        """HTTP语音合成"""
+                       speed_ratio: Optional[float], encoding: Optional[str],
+                       timing: Optional[RequestTiming] = None) -> AudioBuffer:
+        """
+        HTTP语音合成（单次请求，不重试）
+        
+        Args:
+            timing: 请求计时（可选），记录连接、首字节、下载、解析和解码各阶段的耗时
+        
+        Raises:
+            TTSRetryableError: 服务器错误、限流、并发超限或网络异常
+            TTSError: 客户端错误、认证失败等不可重试的错误
+        """
+        # 构建请求
+        request_data = self._build_request(text, voice_type, speed_ratio, encoding)
+        if timing is None:
+            timing = RequestTiming()
+        timing.voice = request_data["audio"]["voice_type"]
+        timing.text_bytes = len(text.encode('utf-8'))
+        
+        # 设置10分钟超时
+        timeout = aiohttp.ClientTimeout(total=600)
+        
+        session = await self._get_session()
+        logger.info("发送HTTP TTS请求...")
+        logger.debug(f"请求URL: {self.HTTP_URL}")
+        logger.debug(f"文本长度: {len(text)} 字符")
+        
         try:
-            # 构建请求
-            request_data = self._build_request(text, voice_type, speed_ratio, encoding)
-            
-            # 发送HTTP请求
-            headers = {
-                "Authorization": f"Bearer;{config.TTS_TOKEN}",
-                "Content-Type": "application/json"
-            }
+            async with session.post(self.HTTP_URL, 
+                                  json=request_data, 
+                                  timeout=timeout,
+                                  trace_request_ctx=timing) as response:
+                timing.status = response.status
+                
+                if response.status != 200:
+                    error_text = await response.text()
+                    logger.error(f"HTTP请求失败: {response.status}")
+                    logger.error(f"响应头: {dict(response.headers)}")
+                    logger.error(f"错误内容: {error_text}")
+                    
+                    # 根据状态码判断是否应该重试
+                    if response.status in [500, 502, 503, 504]:  # 服务器错误，可重试
+                        raise TTSRetryableError(f"服务器错误 {response.status}，可重试")
+                    elif response.status == 429:  # 限流，可重试
+                        raise TTSThrottledError("请求过于频繁，可重试")
+                    else:  # 客户端错误等，不应重试
+                        raise TTSError(f"客户端错误或认证失败 {response.status}，不再重试")
+                
+                # 边接收边把data字段的base64解码到预分配的缓冲区，
+                # 不在内存中同时保留完整的响应体、JSON字符串和音频
+                decoder = AudioResponseDecoder(response.content_length)
+                started = time.perf_counter()
+                async for chunk in response.content.iter_chunked(self.RESPONSE_CHUNK_SIZE):
+                    decode_started = time.perf_counter()
+                    decoder.feed(chunk)
+                    timing.decode += time.perf_counter() - decode_started
+                timing.download = time.perf_counter() - started - timing.decode
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise TTSRetryableError(f"HTTP请求异常: {type(e).__name__} {str(e)}") from e
+        
+        started = time.perf_counter()
+        try:
+            result, audio_bytes = decoder.close()
+        except ValueError as e:
+            raise TTSRetryableError(f"响应不是有效的JSON: {str(e)}") from e
+        timing.parse = time.perf_counter() - started
+        
+        if result.get("code") != 3000:
+            logger.error(f"TTS API返回错误: {result}")
+            raise self._api_error(result.get("code"), result.get("message", ""))
+        
+        # 获取音频数据
+        if decoder.error is not None:
+            raise TTSError(decoder.error)
+        if not audio_bytes:
+            raise TTSError("未获取到音频数据")
+        
+        timing.audio_bytes = len(audio_bytes)
+        timing.audio_seconds = self._reported_duration(result)
+        logger.info(f"成功生成音频，大小: {len(audio_bytes)} bytes")
+        return audio_bytes
+    
+    @staticmethod
+    def _reported_duration(result: Dict[str, Any]) -> Optional[float]:
+        """响应addition.duration中的音频时长（毫秒字符串）换算为秒，缺失或无效时返回None"""
+        addition = result.get("addition")
+        if not isinstance(addition, dict):
+            return None
+        try:
+            duration = float(addition.get("duration"))
+        except (TypeError, ValueError):
+            return None
+        return duration / 1000 if duration > 0 else None
+    
+    @staticmethod
+    def _api_error(error_code: Optional[int], error_msg: str) -> TTSError:
+        """根据API错误码和错误信息判断是否应该重试"""
+        if ("quota exceeded" in error_msg.lower() and "concurrency" in error_msg.lower()) or error_code == 3003:
+            return TTSThrottledError("并发超限，可重试")
+        elif error_code in [3005, 3030, 3031, 3032, 3040, 5000, 5001, 5002]:  # 服务繁忙、超时、服务器错误
+            return TTSRetryableError(f"服务器内部错误 {error_code}，可重试")
+        else:
+            return TTSError(f"业务错误 {error_code}: {error_msg}，不再重试")
+    
+    def stream_speech(self, text: str,
+                      voice_type: Optional[str] = None,
+                      speed_ratio: Optional[float] = None,
+                      encoding: Optional[str] = None,
+                      max_retries: int = 3) -> Iterator[bytes]:
+        """
+        通过WebSocket流式合成（同步生成器），音频分片一到达就产出
+        
+        Args:
+            text: 要转换的文本
+            voice_type: 音色类型
+            speed_ratio: 语速比例
+            encoding: 音频编码格式
+            max_retries: 最大重试次数（只在尚未收到音频时重试）
             
-            # 设置10分钟超时
-            timeout = aiohttp.ClientTimeout(total=600)
+        Yields:
+            bytes: 按顺序到达的音频分片，拼接后即完整音频
             
-            async with aiohttp.ClientSession() as session:
-                logger.info("发送HTTP TTS请求...")
-                logger.debug(f"请求URL: {self.HTTP_URL}")
-                logger.debug(f"文本长度: {len(text)} 字符")
+        Raises:
+            TTSError: 合成失败
+        """
+        loop = self._ensure_loop()
+        chunks: queue.Queue = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(
+            self._pump_stream(chunks, text, voice_type, speed_ratio, encoding, max_retries), loop)
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                yield chunk
+            future.result()
+        finally:
+            # 调用方提前停止迭代时取消请求
+            future.cancel()
+    
+    async def _pump_stream(self, chunks: queue.Queue, text: str, voice_type: Optional[str],
+                           speed_ratio: Optional[float], encoding: Optional[str], max_retries: int):
+        """在客户端事件循环中执行流式合成，把分片放入队列，结束时放入None"""
+        stream = self._stream_cached(text, voice_type, speed_ratio, encoding, max_retries)
+        try:
+            async for chunk in stream:
+                chunks.put(chunk)
+        finally:
+            await stream.aclose()
+            chunks.put(None)
+    
+    async def _stream_cached(self, text: str, voice_type: Optional[str], speed_ratio: Optional[float],
+                             encoding: Optional[str], max_retries: int) -> AsyncIterator[bytes]:
+        """先查缓存，未命中时流式请求，完整收到后写入缓存"""
+        key = self.request_key(text, voice_type, speed_ratio, encoding)
+        loop = asyncio.get_running_loop()
+        
+        if self.cache is not None:
+            cached = await loop.run_in_executor(None, self.cache.get, key)
+            if cached is not None:
+                yield cached
+                return
+        
+        received = []
+        stream = self._stream_with_retry(text, voice_type, speed_ratio, encoding, max_retries)
+        try:
+            async for chunk in stream:
+                received.append(chunk)
+                yield chunk
+        finally:
+            await stream.aclose()
+        
+        if self.cache is not None:
+            await loop.run_in_executor(None, self.cache.put, key, b''.join(received))
+    
+    async def _stream_with_retry(self, text: str, voice_type: Optional[str], speed_ratio: Optional[float],
+                                 encoding: Optional[str], max_retries: int) -> AsyncIterator[bytes]:
+        """带重试的流式合成；已经产出音频后出错不再重试（避免重复的音频）"""
+        actual_retries = max(1, max_retries)
+        
+        for attempt in range(actual_retries):
+            epoch = self.limiter.epoch
+            started = False
+            try:
+                logger.info(f"WebSocket TTS请求第 {attempt + 1}/{actual_retries} 次尝试")
+                queued = time.perf_counter()
+                async with self.limiter.slot() as epoch:
+                    timing = RequestTiming(queue_wait=time.perf_counter() - queued)
+                    stream = self._ws_tts(text, voice_type, speed_ratio, encoding, timing)
+                    try:
+                        with self._timed(timing):
+                            async for chunk in stream:
+                                started = True
+                                yield chunk
+                    finally:
+                        await stream.aclose()
+                    self.limiter.on_success()
+                return
+            except TTSRetryableError as e:
+                logger.error(f"第 {attempt + 1} 次尝试失败: {str(e)}")
+                if isinstance(e, TTSThrottledError):
+                    # 包括最后一次尝试在内，每次限流都报告给并发控制器
+                    self.limiter.on_throttle(epoch)
+                if started:
+                    raise TTSError(f"流式合成中断: {str(e)}") from e
+                if attempt >= actual_retries - 1:
+                    raise TTSError(f"已达到最大重试次数 {actual_retries}: {str(e)}") from e
                 
-                async with session.post(self.HTTP_URL, 
-                                      json=request_data, 
-                                      headers=headers,
-                                      timeout=timeout) as response:
-                    
-                    if response.status != 200:
-                        error_text = await response.text()
-                        logger.error(f"HTTP请求失败: {response.status}")
-                        logger.error(f"响应头: {dict(response.headers)}")
-                        logger.error(f"错误内容: {error_text}")
-                        
-                        # 根据状态码判断是否应该重试
-                        if response.status in [500, 502, 503, 504]:  # 服务器错误，可重试
-                            raise Exception(f"服务器错误 {response.status}，可重试")
-                        elif response.status == 429:  # 限流，可重试
-                            raise Exception("请求过于频繁，可重试")
-                        else:  # 客户端错误等，不应重试
-                            logger.error("客户端错误或认证失败，不再重试")
-                            return None
+                wait_time = self._retry_delay(e, attempt)
+                self.retry_count += 1
+                logger.info(f"等待 {wait_time:.1f} 秒后重试...")
+                await asyncio.sleep(wait_time)
+    
+    async def _ws_tts(self, text: str, voice_type: Optional[str],
+                      speed_ratio: Optional[float], encoding: Optional[str],
+                      timing: Optional[RequestTiming] = None) -> AsyncIterator[bytes]:
+        """
+        WebSocket流式合成（单次请求，不重试），按到达顺序产出音频分片
+        
+        Args:
+            timing: 请求计时（可选），记录握手、首个音频分片和接收其余分片的耗时
+        
+        Raises:
+            TTSRetryableError: 服务器错误、限流、连接中断或超时
+            TTSError: 认证失败、请求无效等不可重试的错误
+        """
+        request_data = self._build_request(text, voice_type, speed_ratio, encoding, operation="submit")
+        if timing is None:
+            timing = RequestTiming()
+        timing.voice = request_data["audio"]["voice_type"]
+        timing.text_bytes = len(text.encode('utf-8'))
+        
+        session = await self._get_session()
+        logger.debug(f"WebSocket URL: {self.WS_URL}")
+        
+        started = time.perf_counter()
+        try:
+            async with session.ws_connect(self.WS_URL,
+                                          headers={"Authorization": f"Bearer; {config.TTS_TOKEN}"},
+                                          max_msg_size=0) as ws:
+                # 每次请求都新建WebSocket连接，握手时间计入连接阶段
+                timing.connect = time.perf_counter() - started
+                timing.connection_reused = False
+                timing.status = 101
+                await ws.send_bytes(encode_request(request_data))
+                started = time.perf_counter()
+                
+                while True:
+                    msg = await ws.receive(timeout=self.WS_RECEIVE_TIMEOUT)
+                    if msg.type != aiohttp.WSMsgType.BINARY:
+                        raise TTSRetryableError(f"WebSocket连接提前结束: {msg.type.name}")
                     
-                    result = await response.json()
+                    try:
+                        message = decode_message(msg.data)
+                    except (ProtocolError, struct.error) as e:
+                        raise TTSError(f"无法解析服务端消息: {str(e)}") from e
                     
-                    if result.get("code") != 3000:
-                        logger.error(f"TTS API返回错误: {result}")
-                        error_code = result.get("code")
-                        error_msg = result.get("message", "")
-                        
-                        # 根据错误码判断是否应该重试
-                        if "quota exceeded" in error_msg.lower() and "concurrency" in error_msg.lower():
-                            raise Exception("并发超限，可重试")
-                        elif error_code in [5000, 5001, 5002]:  # 假设5xxx是服务器错误
-                            raise Exception(f"服务器内部错误 {error_code}，可重试")
+                    if message.is_error:
+                        logger.error(f"TTS API返回错误: {message.error_code} {message.error_message}")
+                        raise self._api_error(message.error_code, message.error_message)
+                    if message.audio:
+                        if not timing.audio_bytes:
+                            timing.ttfb = time.perf_counter() - started
+                            started = time.perf_counter()
+                        timing.audio_bytes += len(message.audio)
+                        yield message.audio
+                    if message.last:
+                        timing.download = time.perf_counter() - started
+                        return
+        except aiohttp.WSServerHandshakeError as e:
+            timing.status = e.status
+            if e.status == 429:
+                raise TTSThrottledError("请求过于频繁，可重试") from e
+            elif e.status >= 500:
+                raise TTSRetryableError(f"服务器错误 {e.status}，可重试") from e
+            raise TTSError(f"WebSocket握手失败 {e.status}，不再重试") from e
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise TTSRetryableError(f"WebSocket请求异常: {type(e).__name__} {str(e)}") from e
+    
+    def synthesize_to_file(self, text: str, output_file: str,
+                           voice_type: Optional[str] = None,
+                           speed_ratio: Optional[float] = None,
+                           use_websocket: bool = False) -> bool:
+        """
+        合成任意长度的文本并写入文件：按请求字节上限切分后依次合成
+        
+        WebSocket模式下音频分片一到达就写入输出文件，不必等整段合成完成
+        
+        Args:
+            text: 要转换的文本
+            output_file: 输出音频文件路径
+            voice_type: 音色类型
+            speed_ratio: 语速比例
+            use_websocket: 是否使用WebSocket流式合成
+            
+        Returns:
+            bool: 是否成功
+        """
+        chunks = split_text(text, config.TTS_MAX_REQUEST_BYTES)
+        if not chunks:
+            logger.warning("文本为空，无需合成")
+            return False
+        
+        output_path = Path(output_file)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        encoding = self._resolve_audio_params(voice_type, speed_ratio, None)[2]
+        logger.info(f"合成 {len(chunks)} 段文本 -> {output_path}（{'WebSocket流式' if use_websocket else 'HTTP'}）")
+        
+        start = time.perf_counter()
+        try:
+            with open(output_path, 'w+b') as f:
+                # MP3按帧拼接，最后回填整体的Info头
+                muxer = Mp3Muxer(f) if encoding == 'mp3' else None
+                if use_websocket:
+                    first_audio = None
+                    for chunk in chunks:
+                        for audio in self.stream_speech(chunk, voice_type, speed_ratio, encoding):
+                            if first_audio is None:
+                                first_audio = time.perf_counter() - start
+                                logger.info(f"首个音频分片到达，用时 {first_audio:.2f} 秒")
+                            if muxer is not None:
+                                muxer.feed(audio)
+                            else:
+                                f.write(audio)
+                            f.flush()
+                        if muxer is not None:
+                            muxer.end_segment()
+                else:
+                    for chunk in chunks:
+                        audio = self._run_async_task(self.synthesize(chunk, voice_type, speed_ratio, encoding))
+                        if muxer is not None:
+                            muxer.add(audio)
                         else:
-                            logger.error("业务错误，不再重试")
-                            return None
-                    
-                    # 获取音频数据
-                    audio_data = result.get("data")
-                    if not audio_data:
-                        logger.error("未获取到音频数据")
-                        return None
-                    
-                    # 解码音频
-                    audio_bytes = base64.b64decode(audio_data)
-                    logger.info(f"成功生成音频，大小: {len(audio_bytes)} bytes")
-                    return audio_bytes
-                    
+                            f.write(audio)
+                if muxer is not None:
+                    muxer.finalize()
         except Exception as e:
-            logger.error(f"HTTP TTS请求失败: {str(e)}")
-            return None
+            logger.error(f"TTS转换失败: {str(e)}")
+            output_path.unlink(missing_ok=True)
+            return False
+        
+        logger.info(f"音频已保存: {output_path}，用时 {time.perf_counter() - start:.2f} 秒")
+        return True
     
+    def _resolve_audio_params(self, voice_type: Optional[str], speed_ratio: Optional[float],
+                              encoding: Optional[str]) -> Tuple[str, float, str]:
+        """补全音色、语速、编码的默认值"""
+        return (
+            voice_type or getattr(config, 'TTS_VOICE_TYPE', 'zh_male_M392_conversation_wvae_bigtts'),
+            speed_ratio or getattr(config, 'TTS_SPEED_RATIO', 1.0),
+            encoding or getattr(config, 'OUTPUT_FORMAT', 'mp3')
+        )
     
     def _build_request(self, text: str, voice_type: Optional[str], 
-                      speed_ratio: Optional[float], encoding: Optional[str]) -> Dict[str, Any]:
-        """构建TTS请求"""
-        return {
+                      speed_ratio: Optional[float], encoding: Optional[str],
+                      operation: str = "query") -> Dict[str, Any]:
+        """构建TTS请求（HTTP一次性返回为query，WebSocket流式返回为submit）"""
+        voice_type, speed_ratio, encoding = self._resolve_audio_params(voice_type, speed_ratio, encoding)
+        request = {
             "app": {
                 "appid": config.TTS_APP_ID,
                 "token": config.TTS_TOKEN,
@@ -198,16 +812,22 @@ class LLMTTSClient:
                 "uid": "default_user"
             },
             "audio": {
-                "voice_type": voice_type or getattr(config, 'TTS_VOICE_TYPE', 'zh_male_M392_conversation_wvae_bigtts'),
-                "encoding": encoding or getattr(config, 'OUTPUT_FORMAT', 'mp3'),
-                "speed_ratio": speed_ratio or getattr(config, 'TTS_SPEED_RATIO', 1.0)
+                "voice_type": voice_type,
+                "encoding": encoding,
+                "speed_ratio": speed_ratio
             },
             "request": {
                 "reqid": str(uuid.uuid4()),
                 "text": text,
-                "operation": "query"
+                "operation": operation
             }
         }
+        if encoding in PCM_ENCODINGS:
+            request["audio"]["rate"] = config.PCM_SAMPLE_RATE
+        if is_ssml(text):
+            # 合并多行时用SSML标记行间停顿
+            request["request"]["text_type"] = "ssml"
+        return request
     
     
     def test_connection(self) -> bool:
@@ -223,19 +843,14 @@ class LLMTTSClient:
         """测试HTTP连接"""
         try:
             test_request = self._build_request("测试", None, None, None)
-            headers = {
-                "Authorization": f"Bearer;{config.TTS_TOKEN}",
-                "Content-Type": "application/json"
-            }
             
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.HTTP_URL, 
-                                      json=test_request, 
-                                      headers=headers,
-                                      timeout=aiohttp.ClientTimeout(total=10)) as response:
-                    
-                    logger.info(f"HTTP连接测试响应状态: {response.status}")
-                    return response.status == 200
+            session = await self._get_session()
+            async with session.post(self.HTTP_URL, 
+                                  json=test_request, 
+                                  timeout=aiohttp.ClientTimeout(total=10)) as response:
+                
+                logger.info(f"HTTP连接测试响应状态: {response.status}")
+                return response.status == 200
                     
         except Exception as e:
             logger.error(f"HTTP连接测试失败: {str(e)}")
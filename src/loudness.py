@@ -0,0 +1,308 @@
+"""
+响度归一化
+不同音色合成的音频响度差别明显，合并后的章节在换人说话时音量忽大忽小。
+这里在解码后的PCM上用NumPy测量门限RMS响度（按400ms窗口计算，与BS.1770相同的绝对/相对门限，不含K加权），
+每个（音色, 语速）测够几段后缓存增益，之后的片段不再分析；
+MP3的增益通过修改global_gain实现（见mp3_frames.apply_gain），不需要重新编码，
+WAV（PCM流水线）的增益直接作用在采样上（见pcm_audio.scale_pcm）
+"""
+
+import os
+import json
+import math
+import shutil
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from loguru import logger
+except ImportError:
+    import logging
+    logger = logging.getLogger(__name__)
+
+from config import config
+from mp3_frames import GAIN_STEP_DB, apply_gain
+from pcm_audio import PcmFormatError, is_wav, parse_wav, scale_pcm
+from tts_response import AudioBuffer
+
+# 测量时解码为单声道16kHz，足够估计语音响度
+MEASURE_SAMPLE_RATE = 16000
+# 提高音量时保证峰值不超过该电平（dBFS）
+PEAK_CEILING_DB = -1.0
+# BS.1770的绝对门限和相对门限
+ABSOLUTE_GATE_DB = -70.0
+RELATIVE_GATE_DB = -10.0
+
+
+def decode_pcm(audio: AudioBuffer, sample_rate: int = MEASURE_SAMPLE_RATE) -> Optional[Tuple['np.ndarray', int]]:
+    """
+    把音频解码为单声道16位PCM：WAV直接读取采样，其他格式用ffmpeg解码
+
+    Args:
+        audio: 音频数据（WAV或任意ffmpeg支持的格式）
+        sample_rate: ffmpeg解码时的输出采样率
+
+    Returns:
+        Optional[Tuple[np.ndarray, int]]: int16采样和采样率；没有numpy或ffmpeg、或解码失败时返回None
+    """
+    if np is None:
+        return None
+    if is_wav(audio):
+        try:
+            fmt, offset, length = parse_wav(audio)
+        except PcmFormatError as e:
+            logger.warning(f"解析WAV失败: {e}")
+            return None
+        samples = np.frombuffer(audio, dtype='<i2', count=length // 2, offset=offset)
+        if fmt.channels > 1:
+            samples = samples.reshape(-1, fmt.channels).mean(axis=1).astype(np.int16)
+        return samples, fmt.sample_rate
+
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        return None
+    try:
+        result = subprocess.run(
+            [ffmpeg, '-v', 'error', '-i', 'pipe:0', '-f', 's16le', '-ac', '1', '-ar', str(sample_rate), 'pipe:1'],
+            input=bytes(audio), capture_output=True, timeout=60)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"解码音频失败: {e}")
+        return None
+    if result.returncode != 0:
+        logger.warning(f"解码音频失败: {result.stderr.decode('utf-8', 'replace').strip()[:200]}")
+        return None
+    return np.frombuffer(result.stdout, dtype='<i2'), sample_rate
+
+
+def measure_loudness(samples: 'np.ndarray', sample_rate: int) -> Optional[Tuple[float, float]]:
+    """
+    测量PCM的门限响度和峰值
+
+    Args:
+        samples: int16单声道采样
+        sample_rate: 采样率
+
+    Returns:
+        Optional[Tuple[float, float]]: (响度dBFS, 峰值dBFS)；静音或过短时返回None
+    """
+    if samples.size == 0:
+        return None
+    x = samples.astype(np.float32) / 32768.0
+    peak = float(np.max(np.abs(x)))
+    if peak == 0.0:
+        return None
+
+    # 100ms子块的均方值，相邻4块组成75%重叠的400ms窗口
+    block = sample_rate // 10
+    count = x.size // block
+    if count >= 4:
+        squares = np.square(x[:count * block]).reshape(count, block).mean(axis=1)
+        energies = np.convolve(squares, np.full(4, 0.25), mode='valid')
+    else:
+        energies = np.array([np.mean(np.square(x))])
+
+    gated = energies[energies > 10 ** (ABSOLUTE_GATE_DB / 10)]
+    if gated.size == 0:
+        return None
+    threshold = gated.mean() * 10 ** (RELATIVE_GATE_DB / 10)
+    gated = gated[gated > threshold]
+    return 10 * math.log10(float(gated.mean())), 20 * math.log10(peak)
+
+
+class LoudnessNormalizer:
+    """
+    按音色缓存增益的响度归一化器
+
+    每个（音色, 语速）测量前几段音频的响度和峰值，保存在磁盘上（跨运行复用）；
+    测够之后直接使用缓存的增益。按片段格式判断能否测量：MP3需要numpy和ffmpeg，WAV只需要numpy。线程安全
+    """
+
+    def __init__(self, profile_path: Optional[str] = None, target_db: Optional[float] = None,
+                 profile_clips: Optional[int] = None, max_gain_db: Optional[float] = None):
+        """
+        初始化归一化器
+
+        Args:
+            profile_path: 增益配置文件路径，默认读取配置LOUDNESS_PROFILE_FILE
+            target_db: 目标响度（dBFS），默认读取配置LOUDNESS_TARGET_DB
+            profile_clips: 每个音色测量的片段数，默认读取配置LOUDNESS_PROFILE_CLIPS
+            max_gain_db: 增益绝对值上限（dB），默认读取配置LOUDNESS_MAX_GAIN_DB
+        """
+        self.profile_path = Path(profile_path or config.LOUDNESS_PROFILE_FILE)
+        self.target_db = config.LOUDNESS_TARGET_DB if target_db is None else target_db
+        self.profile_clips = max(1, config.LOUDNESS_PROFILE_CLIPS if profile_clips is None else profile_clips)
+        self.max_gain_db = config.LOUDNESS_MAX_GAIN_DB if max_gain_db is None else max_gain_db
+        # WAV片段（PCM流水线）只需要numpy，MP3片段还需要ffmpeg解码；按片段格式分别判断
+        self.can_measure_wav = np is not None
+        self.can_measure_mp3 = self.can_measure_wav and shutil.which('ffmpeg') is not None
+        self.measured_clips = 0
+
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._profiles: Dict[str, Dict[str, List[float]]] = self._load()
+
+        if not self.can_measure_wav:
+            logger.warning("未安装numpy，无法测量响度，只使用已缓存的音色增益")
+        elif not self.can_measure_mp3:
+            logger.warning("找不到ffmpeg，只能测量WAV片段的响度，MP3片段只使用已缓存的音色增益")
+
+    @staticmethod
+    def profile_key(voice_type: str, speed_ratio: Optional[float] = None) -> str:
+        """增益配置的键：音色@语速"""
+        speed = config.TTS_SPEED_RATIO if speed_ratio is None else speed_ratio
+        return f"{voice_type}@{float(speed):g}"
+
+    def _load(self) -> Dict[str, Dict[str, List[float]]]:
+        try:
+            with open(self.profile_path, 'r', encoding='utf-8') as f:
+                profiles = json.load(f)
+            return profiles if isinstance(profiles, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取响度配置失败，重新测量: {e}")
+            return {}
+
+    def _save(self):
+        with self._lock:
+            payload = json.dumps(self._profiles, ensure_ascii=False, indent=1)
+        with self._save_lock:
+            try:
+                self.profile_path.parent.mkdir(parents=True, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=self.profile_path.parent,
+                                                prefix=f".{self.profile_path.name}.", suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                        f.write(payload)
+                    os.replace(tmp_path, self.profile_path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.unlink(tmp_path)
+            except OSError as e:
+                logger.warning(f"保存响度配置失败: {e}")
+
+    def needs_sample(self, voice_type: str, speed_ratio: Optional[float] = None, wav: bool = False) -> bool:
+        """该音色是否还需要测量（尚未测够且可以测量该格式的片段；wav表示片段为WAV，否则为MP3）"""
+        if not (self.can_measure_wav if wav else self.can_measure_mp3):
+            return False
+        with self._lock:
+            profile = self._profiles.get(self.profile_key(voice_type, speed_ratio))
+            return profile is None or len(profile['loudness']) < self.profile_clips
+
+    def gain_db(self, voice_type: str, speed_ratio: Optional[float] = None,
+                audio: Optional[AudioBuffer] = None) -> float:
+        """
+        获取音色的增益
+
+        Args:
+            voice_type: 音色
+            speed_ratio: 语速（None表示默认语速）
+            audio: 该音色的一段音频；音色尚未测够时用于测量
+
+        Returns:
+            float: 增益（dB），没有任何测量结果时为0
+        """
+        key = self.profile_key(voice_type, speed_ratio)
+        if audio is not None and self.needs_sample(voice_type, speed_ratio, is_wav(audio)):
+            self._measure(key, audio)
+        with self._lock:
+            return self._gain(self._profiles.get(key))
+
+    def gain_steps(self, voice_type: str, speed_ratio: Optional[float] = None,
+                   audio: Optional[AudioBuffer] = None) -> int:
+        """获取音色的MP3增益步数（见mp3_frames.GAIN_STEP_DB），参数同gain_db"""
+        return int(round(self.gain_db(voice_type, speed_ratio, audio) / GAIN_STEP_DB))
+
+    def normalize(self, audio: AudioBuffer, voice_type: str, speed_ratio: Optional[float] = None) -> AudioBuffer:
+        """
+        把一段MP3或WAV调整到目标响度
+
+        Args:
+            audio: MP3或WAV数据
+            voice_type: 音色
+            speed_ratio: 语速
+
+        Returns:
+            AudioBuffer: 调整后的音频，总是只读的（bytes或memoryview，与合成结果相同）；增益为0时原样返回
+        """
+        if not is_wav(audio):
+            return apply_gain(audio, self.gain_steps(voice_type, speed_ratio, audio))
+        gain = self.gain_db(voice_type, speed_ratio, audio)
+        if not gain:
+            return audio
+        try:
+            _, offset, length = parse_wav(audio)
+        except PcmFormatError:
+            return audio
+        adjusted = bytearray(audio)
+        scale_pcm(memoryview(adjusted)[offset:offset + length], gain)
+        return memoryview(adjusted).toreadonly()
+
+    def _measure(self, key: str, audio: AudioBuffer):
+        """测量一段音频并记入该音色的配置，测够时输出增益"""
+        decoded = decode_pcm(audio)
+        result = measure_loudness(*decoded) if decoded is not None else None
+        if result is None:
+            return
+        with self._lock:
+            profile = self._profiles.setdefault(key, {'loudness': [], 'peak': []})
+            if len(profile['loudness']) >= self.profile_clips:
+                # 其他线程已经测够
+                return
+            profile['loudness'].append(round(result[0], 2))
+            profile['peak'].append(round(result[1], 2))
+            self.measured_clips += 1
+            complete = len(profile['loudness']) == self.profile_clips
+            gain = self._gain(profile)
+        self._save()
+        if complete:
+            logger.info(f"音色 {key} 响度 {self._mean_loudness(profile):.1f}dB，增益 {gain:+.1f}dB")
+
+    @staticmethod
+    def _mean_loudness(profile: Dict[str, List[float]]) -> float:
+        """按能量平均各段响度"""
+        values = profile['loudness']
+        return 10 * math.log10(sum(10 ** (value / 10) for value in values) / len(values))
+
+    def _gain(self, profile: Optional[Dict[str, List[float]]]) -> float:
+        if not profile or not profile['loudness']:
+            return 0.0
+        gain = self.target_db - self._mean_loudness(profile)
+        gain = min(gain, PEAK_CEILING_DB - max(profile['peak']))
+        return max(-self.max_gain_db, min(self.max_gain_db, gain))
+
+    def stats(self) -> Dict[str, float]:
+        """
+        各音色当前的增益
+
+        Returns:
+            Dict[str, float]: 音色@语速 -> 增益（dB）
+        """
+        with self._lock:
+            return {key: round(self._gain(profile), 1) for key, profile in self._profiles.items()}
+
+
+_shared_normalizer: Optional[LoudnessNormalizer] = None
+_shared_lock = threading.Lock()
+
+
+def get_normalizer() -> LoudnessNormalizer:
+    """
+    获取进程内共享的响度归一化器（按配置创建）
+
+    Returns:
+        LoudnessNormalizer: 共享实例
+    """
+    global _shared_normalizer
+    with _shared_lock:
+        if _shared_normalizer is None:
+            _shared_normalizer = LoudnessNormalizer()
+        return _shared_normalizer
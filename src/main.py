@@ -7,17 +7,26 @@ from tqdm import tqdm
 
 from config import config
 from llm_tts_client import LLMTTSClient
+from job_queue import KIND_TEXT, STATUS_DONE, JobQueue, submit_and_wait
 
 
 class StoryToSpeech:
     """童话故事转语音主类"""
     
-    def __init__(self, use_websocket: bool = False):
+    def __init__(self, use_websocket: bool = False, voice_type: Optional[str] = None,
+                 speed_ratio: Optional[float] = None):
         # 验证配置
         config.validate()
         self.tts_client = LLMTTSClient()
         self.use_websocket = use_websocket
+        self.voice_type = voice_type
+        self.speed_ratio = speed_ratio
         
+    @staticmethod
+    def default_output(input_file: str) -> Path:
+        """未指定输出文件时的默认路径：输出目录下的同名音频文件"""
+        return config.OUTPUT_DIR / f"{Path(input_file).stem}.{config.OUTPUT_FORMAT}"
+    
     def process_file(self, input_file: str, output_file: Optional[str] = None) -> bool:
         """
         处理单个文件
@@ -41,15 +50,15 @@ class StoryToSpeech:
                 
             # 生成输出文件名
             if not output_file:
-                input_path = Path(input_file)
-                output_name = f"{input_path.stem}.{config.OUTPUT_FORMAT}"
-                output_file = config.OUTPUT_DIR / output_name
+                output_file = self.default_output(input_file)
                 
             # 转换为语音
             logger.info(f"开始转换: {Path(input_file).name}")
-            success = self.tts_client.text_to_speech(
+            success = self.tts_client.synthesize_to_file(
                 text, 
                 str(output_file), 
+                voice_type=self.voice_type,
+                speed_ratio=self.speed_ratio,
                 use_websocket=self.use_websocket
             )
             
@@ -103,7 +112,36 @@ class StoryToSpeech:
         Returns:
             bool: 是否成功
         """
-        return self.tts_client.text_to_speech(text, output_file, use_websocket=self.use_websocket)
+        return self.tts_client.synthesize_to_file(text, output_file, voice_type=self.voice_type,
+                                                  speed_ratio=self.speed_ratio,
+                                                  use_websocket=self.use_websocket)
+
+
+def submit_to_daemon(files: List[Path], output_file: Optional[str], voice_type: Optional[str],
+                     speed_ratio: Optional[float], use_websocket: bool) -> bool:
+    """
+    把文本文件作为任务提交给合成守护进程（见 synthesis_daemon.py），并等待完成
+    
+    Args:
+        files: 输入文本文件
+        output_file: 输出文件路径（仅对单文件有效）
+        voice_type: 音色类型
+        speed_ratio: 语速比例
+        use_websocket: 是否使用WebSocket流式合成
+        
+    Returns:
+        bool: 是否全部成功
+    """
+    payloads = [{
+        'input_file': str(file.resolve()),
+        'output_file': str(Path(output_file if output_file and len(files) == 1
+                                else StoryToSpeech.default_output(str(file))).resolve()),
+        'voice_type': voice_type,
+        'speed_ratio': speed_ratio,
+        'use_websocket': use_websocket
+    } for file in files]
+    jobs = submit_and_wait(JobQueue(), KIND_TEXT, payloads)
+    return bool(jobs) and all(job.status == STATUS_DONE for job in jobs)
 
 
 def main():
@@ -117,6 +155,7 @@ def main():
     parser.add_argument('-v', '--voice', help='音色类型')
     parser.add_argument('-s', '--speed', type=float, help='语速比例（0.5-2.0）')
     parser.add_argument('--websocket', action='store_true', help='使用WebSocket流式合成')
+    parser.add_argument('--daemon', action='store_true', help='提交给合成守护进程执行并等待结果')
     
     args = parser.parse_args()
     
@@ -124,8 +163,17 @@ def main():
     logger.remove()
     logger.add(sys.stderr, level="INFO")
     
+    if args.daemon:
+        input_path = Path(args.input)
+        files = [input_path] if input_path.is_file() else sorted(input_path.glob(args.pattern))
+        if not files:
+            logger.error(f"输入路径不存在或没有匹配的文件: {args.input}")
+            sys.exit(1)
+        success = submit_to_daemon(files, args.output, args.voice, args.speed, args.websocket)
+        sys.exit(0 if success else 1)
+    
     # 创建处理器
-    processor = StoryToSpeech(use_websocket=args.websocket)
+    processor = StoryToSpeech(use_websocket=args.websocket, voice_type=args.voice, speed_ratio=args.speed)
     
     # 判断是文件还是目录
     input_path = Path(args.input)
@@ -133,10 +181,12 @@ def main():
     if input_path.is_file():
         # 处理单个文件
         success = processor.process_file(args.input, args.output)
+        processor.tts_client.close()
         sys.exit(0 if success else 1)
     elif input_path.is_dir():
         # 批量处理目录
         success_files = processor.process_directory(args.input, args.pattern)
+        processor.tts_client.close()
         sys.exit(0 if success_files else 1)
     else:
         logger.error(f"输入路径不存在: {args.input}")
@@ -0,0 +1,70 @@
+"""
+片段之间的停顿规则
+根据相邻两段的关系决定插入多长的静音：同一行切分出的各段之间、段落（剧本的一行）结束、
+换人说话、旁白与对话切换。静音由mp3_frames中预先编码的静音帧按帧拼接，不需要解码和重新编码
+"""
+
+from dataclasses import dataclass
+from typing import List, Sequence, Tuple
+
+from config import config
+from script_parser import NARRATOR
+
+# 停顿规则的输入：(角色, 行类型, 行号)，同一行切分出的各段行号相同
+Cue = Tuple[str, str, int]
+
+
+def is_narration(cue: Cue) -> bool:
+    """旁白行：无角色的叙述行，或写成（旁白）：...的行"""
+    return cue[1] == 'narration' or cue[0] == NARRATOR
+
+
+@dataclass(frozen=True)
+class PauseRules:
+    """相邻片段之间的停顿时长（毫秒），多条规则同时满足时取最长的一条"""
+    chunk_ms: int = 150
+    paragraph_ms: int = 300
+    speaker_change_ms: int = 500
+    narration_dialogue_ms: int = 700
+
+    @classmethod
+    def from_config(cls) -> 'PauseRules':
+        """按配置PAUSE_*创建"""
+        return cls(
+            chunk_ms=config.PAUSE_CHUNK_MS,
+            paragraph_ms=config.PAUSE_PARAGRAPH_MS,
+            speaker_change_ms=config.PAUSE_SPEAKER_CHANGE_MS,
+            narration_dialogue_ms=config.PAUSE_NARRATION_DIALOGUE_MS
+        )
+
+    def between(self, previous: Cue, current: Cue) -> int:
+        """
+        两段之间的停顿
+
+        Args:
+            previous: 前一段的(角色, 行类型, 行号)
+            current: 后一段的(角色, 行类型, 行号)
+
+        Returns:
+            int: 停顿时长（毫秒）
+        """
+        if current[2] == previous[2]:
+            return self.chunk_ms
+        pause = self.paragraph_ms
+        if current[0] != previous[0]:
+            pause = max(pause, self.speaker_change_ms)
+        if is_narration(current) != is_narration(previous):
+            pause = max(pause, self.narration_dialogue_ms)
+        return pause
+
+    def plan(self, cues: Sequence[Cue]) -> List[int]:
+        """
+        每段之前插入的停顿
+
+        Args:
+            cues: 按顺序排列的各段(角色, 行类型, 行号)
+
+        Returns:
+            List[int]: 与cues一一对应的停顿时长（毫秒），第一段为0
+        """
+        return [0] + [self.between(previous, current) for previous, current in zip(cues, cues[1:])]
@@ -0,0 +1,296 @@
+"""
+PCM音频流水线
+服务端直接返回WAV（16位PCM）时，各片段的采样按顺序写入一个内存映射的章节缓冲区：
+停顿就是跳过的全零区域，增益在缓冲区中原地调整，整章完成后只编码一次到目标格式。
+没有逐段的有损编码，章节时长精确到采样
+"""
+
+import os
+import mmap
+import shutil
+import struct
+import tempfile
+import subprocess
+from array import array
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from loguru import logger
+except ImportError:
+    import logging
+    logger = logging.getLogger(__name__)
+
+# 向服务端请求PCM时使用的编码（带文件头，采样率和声道数可以校验）
+PCM_ENCODINGS = ('wav', 'pcm')
+WAV_HEADER_SIZE = 44
+SAMPLE_WIDTH = 2
+
+# 整章编码时ffmpeg的输出参数
+FFMPEG_FORMATS = {
+    'mp3': ['-f', 'mp3', '-c:a', 'libmp3lame'],
+    'ogg_opus': ['-f', 'ogg', '-c:a', 'libopus'],
+}
+
+
+class PcmFormatError(ValueError):
+    """WAV数据无法解析、不是16位PCM，或片段之间的格式不一致"""
+
+
+@dataclass(frozen=True)
+class PcmFormat:
+    """16位PCM的格式"""
+    sample_rate: int
+    channels: int
+
+    @property
+    def block_align(self) -> int:
+        """一个采样帧（所有声道）的字节数"""
+        return self.channels * SAMPLE_WIDTH
+
+    def frames_for(self, duration_ms: int) -> int:
+        """给定时长对应的采样帧数"""
+        return max(0, round(duration_ms * self.sample_rate / 1000))
+
+
+def is_wav(data) -> bool:
+    """数据是否为RIFF/WAVE"""
+    return len(data) >= 12 and data[:4] == b'RIFF' and data[8:12] == b'WAVE'
+
+
+def parse_wav(data) -> Tuple[PcmFormat, int, int]:
+    """
+    解析WAV文件头
+
+    流式生成的WAV中RIFF和data的长度字段常常不准确（为0或0xFFFFFFFF），
+    因此data块的长度按实际数据截断
+
+    Args:
+        data: 完整的WAV数据
+
+    Returns:
+        Tuple[PcmFormat, int, int]: 格式、采样数据的偏移和字节数（按采样帧对齐）
+
+    Raises:
+        PcmFormatError: 不是WAV、缺少fmt/data块，或不是16位PCM
+    """
+    if not is_wav(data):
+        raise PcmFormatError("不是WAV数据")
+    fmt: Optional[PcmFormat] = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id = bytes(data[offset:offset + 4])
+        chunk_size = struct.unpack_from('<I', data, offset + 4)[0]
+        body = offset + 8
+        if chunk_id == b'fmt ':
+            tag, channels, sample_rate, _, _, bits = struct.unpack_from('<HHIIHH', data, body)
+            # 0xFFFE为WAVE_FORMAT_EXTENSIBLE，子格式按PCM处理
+            if tag not in (1, 0xFFFE) or bits != SAMPLE_WIDTH * 8 or not channels or not sample_rate:
+                raise PcmFormatError(f"只支持16位PCM（格式 {tag}，{bits}位）")
+            fmt = PcmFormat(sample_rate, channels)
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise PcmFormatError("WAV的data块在fmt块之前")
+            length = min(chunk_size, len(data) - body)
+            return fmt, body, length - length % fmt.block_align
+        offset = body + chunk_size + (chunk_size & 1)
+    raise PcmFormatError("WAV中没有找到fmt或data块")
+
+
+def wav_header(fmt: PcmFormat, data_length: int) -> bytes:
+    """生成44字节的标准WAV文件头"""
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', 36 + data_length, b'WAVE', b'fmt ', 16, 1,
+                       fmt.channels, fmt.sample_rate, fmt.sample_rate * fmt.block_align, fmt.block_align,
+                       SAMPLE_WIDTH * 8, b'data', data_length)
+
+
+def decode_to_wav(data, sample_rate: int) -> bytes:
+    """
+    用ffmpeg把任意格式的音频解码为16位单声道WAV（用于无法按帧拼接的格式）
+
+    Args:
+        data: 完整的音频数据
+        sample_rate: 输出采样率
+
+    Returns:
+        bytes: WAV数据（流式输出的文件头长度字段可能不准确，parse_wav按实际数据处理）
+
+    Raises:
+        OSError: 找不到ffmpeg或解码失败
+    """
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        raise OSError("解码音频需要ffmpeg")
+    result = subprocess.run([ffmpeg, '-v', 'error', '-i', 'pipe:0', '-f', 'wav', '-c:a', 'pcm_s16le',
+                             '-ac', '1', '-ar', str(sample_rate), 'pipe:1'], input=bytes(data), capture_output=True)
+    if result.returncode != 0:
+        raise OSError(f"ffmpeg解码失败: {result.stderr.decode('utf-8', 'replace').strip()[:200]}")
+    return result.stdout
+
+
+def scale_pcm(buffer, gain_db: float):
+    """
+    原地调整16位PCM的音量（超出范围的采样截断）
+
+    Args:
+        buffer: 可写的采样缓冲区（bytearray、mmap或它们的memoryview）
+        gain_db: 增益（dB），0时不做任何事
+    """
+    if not gain_db or not len(buffer):
+        return
+    factor = 10 ** (gain_db / 20)
+    if np is not None:
+        samples = np.frombuffer(buffer, dtype='<i2')
+        scaled = np.rint(samples * np.float32(factor))
+        np.clip(scaled, -32768, 32767, out=scaled)
+        samples[:] = scaled
+        del samples
+        return
+    samples = array('h', bytes(buffer))
+    for i, value in enumerate(samples):
+        samples[i] = max(-32768, min(32767, round(value * factor)))
+    memoryview(buffer).cast('B')[:] = samples.tobytes()
+
+
+class PcmChapterBuffer:
+    """
+    章节的PCM缓冲区
+
+    临时文件开头预留WAV文件头，之后按顺序追加采样；文件通过内存映射写入，
+    容量不足时按倍数扩展（稀疏文件，未写入的区域即为静音）
+    """
+
+    def __init__(self, directory: str, capacity_seconds: float = 600.0, prefix: str = '.pcm.'):
+        """
+        初始化缓冲区
+
+        Args:
+            directory: 临时文件所在目录（与输出文件相同，编码后可直接改名）
+            capacity_seconds: 初始容量（按24kHz单声道估算的秒数），不足时按倍数扩展
+            prefix: 临时文件名前缀
+        """
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=directory, prefix=prefix, suffix='.wav')
+        self._file = os.fdopen(fd, 'r+b')
+        self._capacity = WAV_HEADER_SIZE + int(capacity_seconds * 24000) * SAMPLE_WIDTH
+        self._file.truncate(self._capacity)
+        self._map: Optional[mmap.mmap] = mmap.mmap(self._file.fileno(), self._capacity)
+        self.format: Optional[PcmFormat] = None
+        self.data_length = 0
+        self.segment_count = 0
+
+    @property
+    def duration(self) -> float:
+        """已写入音频（含停顿）的时长（秒）"""
+        if self.format is None:
+            return 0.0
+        return self.data_length / self.format.block_align / self.format.sample_rate
+
+    def _reserve(self, length: int):
+        """保证还能再写入length字节"""
+        needed = WAV_HEADER_SIZE + self.data_length + length
+        if needed <= self._capacity:
+            return
+        capacity = self._capacity
+        while capacity < needed:
+            capacity *= 2
+        self._map.close()
+        self._file.truncate(capacity)
+        self._map = mmap.mmap(self._file.fileno(), capacity)
+        self._capacity = capacity
+
+    def add(self, data, pause_ms: int = 0, gain_db: float = 0.0) -> int:
+        """
+        追加一个WAV片段
+
+        Args:
+            data: 单个WAV文件的完整数据
+            pause_ms: 片段之前的停顿（毫秒），第一个片段之前不插入
+            gain_db: 片段的增益（dB），在缓冲区中原地调整
+
+        Returns:
+            int: 写入的采样帧数
+
+        Raises:
+            PcmFormatError: 无法解析，或采样率/声道数与已写入的片段不一致
+        """
+        fmt, offset, length = parse_wav(data)
+        if self.format is None:
+            self.format = fmt
+        elif fmt != self.format:
+            raise PcmFormatError(f"片段格式不一致: {fmt.sample_rate}Hz/{fmt.channels}声道，"
+                                 f"期望 {self.format.sample_rate}Hz/{self.format.channels}声道")
+
+        silence = fmt.frames_for(pause_ms) * fmt.block_align if self.segment_count else 0
+        self._reserve(silence + length)
+        # 停顿区域从未写入过，本来就是0
+        start = WAV_HEADER_SIZE + self.data_length + silence
+        view = memoryview(data)
+        self._map[start:start + length] = view[offset:offset + length]
+        if gain_db:
+            region = memoryview(self._map)[start:start + length]
+            scale_pcm(region, gain_db)
+            region.release()
+        self.data_length += silence + length
+        self.segment_count += 1
+        return length // fmt.block_align
+
+    def encode(self, output_path: str, audio_format: str = 'mp3', bitrate: str = '64k') -> bool:
+        """
+        把整章编码一次，写到输出路径（先写临时文件再原子替换）
+
+        Args:
+            output_path: 输出文件路径
+            audio_format: 目标格式（wav直接改名，mp3/ogg_opus需要ffmpeg）
+            bitrate: 有损编码的比特率
+
+        Returns:
+            bool: 是否写出了音频
+
+        Raises:
+            OSError: 找不到ffmpeg、格式不支持或编码失败
+        """
+        if self.format is None or not self.data_length:
+            return False
+        self._map[:WAV_HEADER_SIZE] = wav_header(self.format, self.data_length)
+        self._map.close()
+        self._map = None
+        self._file.truncate(WAV_HEADER_SIZE + self.data_length)
+        self._file.close()
+
+        output_path = Path(output_path)
+        if audio_format == 'wav':
+            os.replace(self.path, output_path)
+            return True
+
+        ffmpeg = shutil.which('ffmpeg')
+        if ffmpeg is None or audio_format not in FFMPEG_FORMATS:
+            raise OSError(f"无法编码为 {audio_format}：需要ffmpeg，支持 wav、{'、'.join(FFMPEG_FORMATS)}")
+        fd, tmp_path = tempfile.mkstemp(dir=output_path.parent, prefix=f".{output_path.name}.", suffix='.part')
+        os.close(fd)
+        try:
+            result = subprocess.run([ffmpeg, '-v', 'error', '-y', '-i', self.path, *FFMPEG_FORMATS[audio_format],
+                                     '-b:a', bitrate, tmp_path], capture_output=True)
+            if result.returncode != 0:
+                raise OSError(f"ffmpeg编码失败: {result.stderr.decode('utf-8', 'replace').strip()[:200]}")
+            os.replace(tmp_path, output_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        return True
+
+    def close(self):
+        """释放映射并删除临时文件（编码为wav后临时文件已改名，不受影响）"""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
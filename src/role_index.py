@@ -0,0 +1,245 @@
+"""
+角色音色索引
+roles.yml只解析一次并建立 角色名 -> 语音配置 的索引；解析结果按文件修改时间和哈希
+保存为快照，短时间运行的命令行工具不必每次都重新解析YAML
+"""
+
+import os
+import re
+import json
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import yaml
+
+try:
+    from loguru import logger
+except ImportError:
+    import logging
+    logger = logging.getLogger(__name__)
+
+from config import config
+
+
+# roles.yml中未配置默认音色时使用
+FALLBACK_VOICE = 'zh_female_shaoergushi_mars_bigtts'
+
+# 合称（"孔子和牛顿"、"大宝、二宝"）按第一个能识别的成员取音色
+_GROUP_SEPARATORS = re.compile(r'[和与及、,，/]')
+# 复数（"学生们"）和编号（"士兵甲"、"村民乙"）去掉后缀再查找
+_PLURAL_SUFFIX = '们'
+_ORDINAL_SUFFIX = re.compile(r'[甲乙丙丁戊己庚辛壬癸]$')
+
+
+class RoleIndex:
+    """
+    角色音色索引
+
+    所有分类中的角色（含name字段和aliases别名）合并为一个字典，查找为O(1)；
+    同名角色以配置文件中先出现的为准。返回的语音配置在所有调用方之间共享，只读。
+    """
+
+    def __init__(self, roles_config: Dict[str, Any]):
+        """
+        根据解析后的roles.yml建立索引
+
+        Args:
+            roles_config: 角色配置
+        """
+        self.config = roles_config or {}
+        tts_config = self.config.get('tts_config') or {}
+
+        self.default_voice = tts_config.get('default_voice') or FALLBACK_VOICE
+        self.defaults = {
+            'speed': tts_config.get('default_speed', 1.0),
+            'volume': tts_config.get('default_volume', 1.0),
+            'pitch': tts_config.get('default_pitch', 1.0),
+            'output_format': tts_config.get('output_format', 'mp3')
+        }
+        self.default_profile = {
+            'name': '未知角色',
+            'tts_voice': self.default_voice,
+            **self.defaults
+        }
+
+        self._profiles: Dict[str, Dict[str, Any]] = {}
+        for category, characters in self.config.items():
+            if category == 'tts_config' or not isinstance(characters, dict):
+                continue
+            for char_name, char_info in characters.items():
+                if not isinstance(char_info, dict) or 'tts_voice' not in char_info:
+                    continue
+                profile = {**self.defaults, **char_info}
+                for name in (char_name, char_info.get('name'), *(char_info.get('aliases') or ())):
+                    if name:
+                        self._profiles.setdefault(str(name), profile)
+
+        # 解析结果（包括回退到默认配置的角色），每个名字只解析一次
+        self._resolved: Dict[str, Dict[str, Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._profiles)
+
+    def __contains__(self, name: str) -> bool:
+        return self._lookup(name) is not None
+
+    def _lookup(self, name: str) -> Optional[Dict[str, Any]]:
+        """按精确名、合称、复数和编号后缀依次查找"""
+        name = name.strip()
+        profile = self._profiles.get(name)
+        if profile is not None:
+            return profile
+
+        members = [m.strip() for m in _GROUP_SEPARATORS.split(name) if m.strip()]
+        if len(members) > 1:
+            for member in members:
+                profile = self._lookup(member)
+                if profile is not None:
+                    return profile
+            return None
+
+        if len(name) > 1 and name.endswith(_PLURAL_SUFFIX):
+            return self._lookup(name[:-1])
+        if len(name) > 1 and _ORDINAL_SUFFIX.search(name):
+            return self._lookup(name[:-1])
+        return None
+
+    def profile(self, name: str) -> Dict[str, Any]:
+        """
+        获取角色的语音配置
+
+        Args:
+            name: 角色名（可以是别名、合称、复数或带编号的名字）
+
+        Returns:
+            Dict[str, Any]: 语音配置（含tts_voice、speed、volume、pitch、output_format），
+                未找到时返回默认配置
+        """
+        profile = self._resolved.get(name)
+        if profile is None:
+            profile = self._lookup(name)
+            if profile is None:
+                logger.warning(f"未找到角色 '{name}' 的配置，使用默认音色: {self.default_voice}")
+                profile = self.default_profile
+            elif profile.get('name') != name:
+                logger.debug(f"角色 '{name}' 按 '{profile.get('name')}' 的配置处理")
+            self._resolved[name] = profile
+        return profile
+
+    def voice(self, name: str) -> str:
+        """
+        获取角色的音色
+
+        Args:
+            name: 角色名
+
+        Returns:
+            str: 音色类型
+        """
+        return self.profile(name).get('tts_voice') or self.default_voice
+
+
+def _snapshot_path(path: Path) -> Path:
+    """快照文件路径（按配置文件的绝对路径区分）"""
+    digest = hashlib.sha1(str(path).encode('utf-8')).hexdigest()[:16]
+    return Path(config.CACHE_DIR) / 'roles' / f"{path.stem}-{digest}.json"
+
+
+def _read_snapshot(snapshot: Path) -> Optional[Dict[str, Any]]:
+    try:
+        with open(snapshot, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_snapshot(snapshot: Path, record: Dict[str, Any]):
+    """原子写入快照，失败时只记录日志（快照只是加速手段）"""
+    try:
+        snapshot.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=snapshot.parent, prefix=f".{snapshot.name}.", suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(record, f, ensure_ascii=False)
+            os.replace(tmp_path, snapshot)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+    except (OSError, TypeError, ValueError) as e:
+        logger.debug(f"写入角色配置快照失败: {e}")
+
+
+def load_roles_config(config_path: str) -> Dict[str, Any]:
+    """
+    读取roles.yml，优先使用快照
+
+    修改时间和大小都未变时直接使用快照；否则计算文件哈希，内容未变时更新快照的修改时间，
+    内容变化时重新解析YAML并写入新快照
+
+    Args:
+        config_path: 角色配置文件路径
+
+    Returns:
+        Dict[str, Any]: 角色配置
+
+    Raises:
+        OSError: 配置文件无法读取
+        yaml.YAMLError: 配置文件格式错误
+    """
+    path = Path(config_path).resolve()
+    stat = path.stat()
+    snapshot = _snapshot_path(path)
+    record = _read_snapshot(snapshot)
+
+    if record and record.get('mtime_ns') == stat.st_mtime_ns and record.get('size') == stat.st_size:
+        logger.debug(f"使用角色配置快照: {snapshot}")
+        return record['data']
+
+    raw = path.read_bytes()
+    digest = hashlib.sha256(raw).hexdigest()
+    if record and record.get('sha256') == digest:
+        data = record['data']
+    else:
+        data = yaml.safe_load(raw) or {}
+        logger.debug(f"解析角色配置: {path}")
+
+    _write_snapshot(snapshot, {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+                               'sha256': digest, 'data': data})
+    return data
+
+
+_indexes: Dict[Path, Tuple[int, RoleIndex]] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_role_index(config_path: str = "config/roles.yml") -> RoleIndex:
+    """
+    获取角色索引（进程内按配置文件共享，文件修改后自动重建）
+
+    Args:
+        config_path: 角色配置文件路径
+
+    Returns:
+        RoleIndex: 角色索引
+
+    Raises:
+        OSError: 配置文件无法读取
+        yaml.YAMLError: 配置文件格式错误
+    """
+    path = Path(config_path).resolve()
+    mtime_ns = path.stat().st_mtime_ns
+
+    with _indexes_lock:
+        cached = _indexes.get(path)
+        if cached is not None and cached[0] == mtime_ns:
+            return cached[1]
+
+        index = RoleIndex(load_roles_config(str(path)))
+        _indexes[path] = (mtime_ns, index)
+
+    logger.info(f"成功加载角色配置: {config_path}（{len(index)} 个角色名）")
+    return index
@@ -1,128 +1,130 @@
 import re
-import yaml
+import sys
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional
 from loguru import logger
-from dataclasses import dataclass
 
+from config import config
+from role_index import RoleIndex, get_role_index
+from text_chunker import split_text
 
-@dataclass
-class DialogueLine:
-    """对话行数据结构"""
-    character: str
-    text: str
-    line_number: int
-    voice_config: Dict = None
+
+# 匹配格式：（角色名）：对话内容
+DIALOGUE_PATTERN = re.compile(r'^（([^）]+)）：(.+)$')
+# 包含中文的非对话行视为旁白
+NARRATION_PATTERN = re.compile(r'[\u4e00-\u9fff]')
+# 分隔线（如正文与后记之间）跳过，继续解析
+SEPARATOR_PREFIX = '---'
+# 章节末尾的角色信息，之后的内容不再解析
+FOOTER_PREFIXES = ('*该小节涉及的角色',)
+NARRATOR = '旁白'
+
+
+class ScriptSegment:
+    """
+    剧本中的一行（对话或旁白）
+
+    使用__slots__保持每行的内存占用很小；角色名被驻留，
+    voice_config引用角色索引中共享的语音配置（只读），不为每行复制
+    """
+    __slots__ = ('character', 'text', 'line_number', 'voice_config', 'line_type')
+
+    def __init__(self, character: str, text: str, line_number: int,
+                 voice_config: Optional[Dict[str, Any]] = None, line_type: str = 'dialogue'):
+        self.character = character
+        self.text = text
+        self.line_number = line_number
+        self.voice_config = voice_config
+        self.line_type = line_type
+
+    def __repr__(self) -> str:
+        return f"ScriptSegment({self.line_number}, {self.character!r}, {self.text[:20]!r})"
+
+
+# 兼容旧名称
+DialogueLine = ScriptSegment
+
+
+def iter_script(lines: Iterable[str], role_index: Optional[RoleIndex] = None,
+                include_narration: bool = True) -> Iterator[ScriptSegment]:
+    """
+    逐行解析剧本（生成器），可以直接传入打开的文件，边读边产出
+
+    Args:
+        lines: 剧本文本行
+        role_index: 角色索引，提供时为每行附上角色的语音配置
+        include_narration: 是否产出旁白行（包含中文的非对话行）
+
+    Yields:
+        ScriptSegment: 对话或旁白行，遇到章节末尾的角色信息时停止
+    """
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line[0] in '#>' or line.startswith(SEPARATOR_PREFIX):
+            continue
+
+        if line.startswith(FOOTER_PREFIXES):
+            logger.debug(f"第{line_number}行 - 遇到角色信息行，停止解析")
+            return
+
+        match = DIALOGUE_PATTERN.match(line)
+        if match:
+            character = sys.intern(match.group(1))
+            line_type = 'dialogue'
+            text = match.group(2)
+        elif include_narration and NARRATION_PATTERN.search(line):
+            character = NARRATOR
+            line_type = 'narration'
+            text = line
+        else:
+            continue
+
+        voice_config = role_index.profile(character) if role_index is not None else None
+        yield ScriptSegment(character, text, line_number, voice_config, line_type)
 
 
 class ScriptParser:
     """剧本解析器，解析（角色）：对话格式的剧本"""
     
-    def __init__(self, roles_config_path: str):
+    def __init__(self, roles_config_path: str, include_narration: bool = False):
+        """
+        初始化解析器
+        
+        Args:
+            roles_config_path: 角色配置文件路径
+            include_narration: 是否把包含中文的非对话行作为旁白朗读
+        """
         self.roles_config_path = Path(roles_config_path)
-        self.roles_config = self._load_roles_config()
-        
-        # 匹配格式：（角色名）：对话内容
-        self.dialogue_pattern = re.compile(r'^（([^）]+)）：(.+)$')
-        
-    def _load_roles_config(self) -> Dict:
-        """加载角色配置文件"""
-        try:
-            with open(self.roles_config_path, 'r', encoding='utf-8') as f:
-                config = yaml.safe_load(f)
-            logger.info(f"成功加载角色配置: {self.roles_config_path}")
-            return config
-        except Exception as e:
-            logger.error(f"加载角色配置失败: {e}")
-            raise
+        self.role_index = get_role_index(roles_config_path)
+        self.roles_config = self.role_index.config
+        self.include_narration = include_narration
     
-    def parse_script_file(self, script_path: str) -> List[DialogueLine]:
-        """解析剧本文件，返回对话行列表"""
+    def iter_script_file(self, script_path: str) -> Iterator[ScriptSegment]:
+        """逐行解析剧本文件（生成器），不把整个文件读入内存"""
         script_path = Path(script_path)
         
         if not script_path.exists():
             raise FileNotFoundError(f"剧本文件不存在: {script_path}")
-            
-        logger.info(f"开始解析剧本文件: {script_path}")
         
         with open(script_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        
-        dialogue_lines = []
-        
-        for line_no, line in enumerate(lines, 1):
-            line = line.strip()
-            
-            # 跳过空行和元数据行
-            if not line or line.startswith('#') or line.startswith('>') or line.startswith('---'):
-                continue
-                
-            # 匹配对话格式
-            match = self.dialogue_pattern.match(line)
-            if match:
-                character = match.group(1)
-                text = match.group(2)
-                
-                # 获取角色的语音配置
-                voice_config = self._get_voice_config(character)
-                
-                dialogue_line = DialogueLine(
-                    character=character,
-                    text=text,
-                    line_number=line_no,
-                    voice_config=voice_config
-                )
-                
-                dialogue_lines.append(dialogue_line)
-                logger.debug(f"第{line_no}行 - {character}: {text[:50]}...")
+            yield from iter_script(f, self.role_index, self.include_narration)
         
+    def parse_script_file(self, script_path: str) -> List[ScriptSegment]:
+        """解析剧本文件，返回对话行列表"""
+        logger.info(f"开始解析剧本文件: {script_path}")
+        dialogue_lines = list(self.iter_script_file(script_path))
         logger.success(f"解析完成，共找到 {len(dialogue_lines)} 行对话")
         return dialogue_lines
     
     def _get_voice_config(self, character: str) -> Dict:
-        """获取角色的语音配置"""
-        # 首先在各个角色分类中查找
-        all_characters = {}
-        
-        # 合并所有分类的角色
-        for category in ['pig_family', 'work_characters', 'mythical_characters', 
-                        'musicians', 'group_characters', 'narrator', 'other_stories']:
-            if category in self.roles_config:
-                all_characters.update(self.roles_config[category])
-        
-        # 查找角色配置
-        if character in all_characters:
-            char_config = all_characters[character].copy()
-            
-            # 添加TTS默认配置
-            if 'tts_config' in self.roles_config:
-                tts_defaults = self.roles_config['tts_config']
-                char_config.update({
-                    'speed': tts_defaults.get('default_speed', 1.0),
-                    'volume': tts_defaults.get('default_volume', 1.0),
-                    'pitch': tts_defaults.get('default_pitch', 1.0),
-                    'output_format': tts_defaults.get('output_format', 'mp3')
-                })
-            
-            return char_config
-        else:
-            # 未找到角色，使用默认配置
-            logger.warning(f"未找到角色 '{character}' 的配置，使用默认设置")
-            return self._get_default_voice_config()
+        """获取角色的语音配置（同一角色的所有行共享同一个只读配置）"""
+        return self.role_index.profile(character)
     
     def _get_default_voice_config(self) -> Dict:
         """获取默认语音配置"""
-        tts_config = self.roles_config.get('tts_config', {})
-        return {
-            'name': '未知角色',
-            'tts_voice': 'BV001_streaming',
-            'speed': tts_config.get('default_speed', 1.0),
-            'volume': tts_config.get('default_volume', 1.0),
-            'pitch': tts_config.get('default_pitch', 1.0),
-            'output_format': tts_config.get('output_format', 'mp3')
-        }
+        return self.role_index.default_profile
     
-    def get_character_stats(self, dialogue_lines: List[DialogueLine]) -> Dict:
+    def get_character_stats(self, dialogue_lines: List[ScriptSegment]) -> Dict:
         """获取角色统计信息"""
         stats = {}
         for line in dialogue_lines:
@@ -138,41 +140,11 @@ class ScriptParser:
         
         return stats
     
-    def split_long_text(self, text: str, max_length: int = 500) -> List[str]:
-        """将过长的文本分割成多个片段"""
-        if len(text) <= max_length:
-            return [text]
-        
-        # 按句号、问号、感叹号分割
-        sentences = re.split(r'[。！？]', text)
-        
-        chunks = []
-        current_chunk = ""
-        
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
-                continue
-                
-            # 如果添加这个句子不会超长，就添加
-            if len(current_chunk + sentence) <= max_length:
-                if current_chunk:
-                    current_chunk += sentence + "。"
-                else:
-                    current_chunk = sentence + "。"
-            else:
-                # 保存当前chunk，开始新的chunk
-                if current_chunk:
-                    chunks.append(current_chunk.rstrip("。"))
-                current_chunk = sentence + "。"
-        
-        # 添加最后一个chunk
-        if current_chunk:
-            chunks.append(current_chunk.rstrip("。"))
-        
-        return chunks
+    def split_long_text(self, text: str, max_bytes: Optional[int] = None) -> List[str]:
+        """将过长的文本按句子分割成多个片段（按UTF-8字节计算，保留原标点）"""
+        return split_text(text, max_bytes or config.TTS_MAX_REQUEST_BYTES)
     
-    def prepare_tts_tasks(self, dialogue_lines: List[DialogueLine]) -> List[Dict]:
+    def prepare_tts_tasks(self, dialogue_lines: Iterable[ScriptSegment]) -> List[Dict]:
         """准备TTS任务列表"""
         tasks = []
         
@@ -186,6 +158,7 @@ class ScriptParser:
                     'character': line.character,
                     'text': chunk,
                     'voice_config': line.voice_config,
+                    'line_type': line.line_type,
                     'line_number': line.line_number,
                     'chunk_index': j,
                     'total_chunks': len(text_chunks)
@@ -4,13 +4,14 @@
 解析markdown剧本，根据角色配置选择音色，生成并合并音频
 """
 
-import re
 import os
-import yaml
 import io
+import threading
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional
-import time
+from typing import Dict, Iterable, List, Tuple, Optional, Union
+from itertools import islice
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 
 try:
     from loguru import logger
@@ -18,101 +19,114 @@ except ImportError:
     import logging
     logger = logging.getLogger(__name__)
 
+from config import config
 from llm_tts_client import LLMTTSClient
-
-# 音频处理 - 使用简单的二进制合并方式
-# 对于MP3文件，简单的二进制拼接通常是有效的
+from audio_writer import OrderedAudioWriter
+from checkpoint import ChapterCheckpoint
+from hls_writer import playlist_dir_for
+from loudness import LoudnessNormalizer, get_normalizer
+from mp3_frames import Mp3FormatError
+from pauses import PauseRules
+from role_index import RoleIndex, get_role_index
+from segment_packer import pack_texts
+from synthesis_model import WorkEstimate, longest_first
+from text_chunker import split_text, utf8_len
+from script_parser import iter_script
+from tts_response import AudioBuffer
 
 
 class ScriptToAudioConverter:
     """剧本转语音转换器"""
     
-    def __init__(self, roles_config_path: str = "config/roles.yml"):
+    # 重排窗口 = 并发数 × 该系数，限制已派发但尚未写出的片段数（即内存峰值）
+    REORDER_WINDOW_FACTOR = 4
+    
+    def __init__(self, roles_config_path: str = "config/roles.yml",
+                 request_workers: Optional[int] = None,
+                 pcm_pipeline: Optional[bool] = None):
         """
         初始化转换器
         
         Args:
             roles_config_path: 角色配置文件路径
+            request_workers: 全局请求线程数；指定时所有章节（包括同时转换的多个章节）
+                共用这一个线程池，作为整个运行的请求预算
+            pcm_pipeline: 是否向服务端请求WAV片段、整章只编码一次，默认读取配置TTS_PCM_PIPELINE
         """
+        if pcm_pipeline is None:
+            pcm_pipeline = config.TTS_PCM_PIPELINE
+        # 片段的请求编码，None表示使用配置TTS_ENCODING
+        self.segment_encoding: Optional[str] = 'wav' if pcm_pipeline else None
         self.tts_client = LLMTTSClient()
-        self.roles_config = self._load_roles_config(roles_config_path)
+        self.role_index = self._load_role_index(roles_config_path)
+        self.roles_config = self.role_index.config
+        self._executor = ThreadPoolExecutor(max_workers=request_workers,
+                                            thread_name_prefix="tts-request") if request_workers else None
         
-    def _load_roles_config(self, config_path: str) -> Dict:
-        """加载角色配置"""
+        # 整个运行期间的去重统计（转换器在多个章节间复用时累计）
+        self._stats_lock = threading.Lock()
+        self.total_segments = 0
+        self.deduplicated_segments = 0
+        self.resumed_segments = 0
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+    
+    def close(self):
+        """释放请求线程池和TTS客户端持有的连接"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.tts_client.close()
+        
+    def _load_role_index(self, config_path: str) -> RoleIndex:
+        """加载角色索引，失败时所有角色使用默认音色"""
         try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                config = yaml.safe_load(f)
-            logger.info(f"成功加载角色配置: {config_path}")
-            return config
+            return get_role_index(config_path)
         except Exception as e:
             logger.error(f"加载角色配置失败: {e}")
-            return {}
+            return RoleIndex({})
     
     def _get_character_voice(self, character_name: str) -> str:
         """
         根据角色名获取对应的音色
         
         Args:
-            character_name: 角色名称
+            character_name: 角色名称（支持别名、合称、复数和带编号的名字）
             
         Returns:
             str: 音色类型
         """
-        # 在所有角色分类中查找
-        for category in self.roles_config.values():
-            if isinstance(category, dict):
-                for char_name, char_info in category.items():
-                    if char_name == character_name and isinstance(char_info, dict):
-                        voice = char_info.get('tts_voice', 'zh_female_shaoergushi_mars_bigtts')
-                        logger.debug(f"角色 '{character_name}' 使用音色: {voice}")
-                        return voice
-        
-        # 如果没找到，使用默认音色
-        default_voice = 'zh_female_shaoergushi_mars_bigtts'
-        logger.warning(f"未找到角色 '{character_name}' 的配置，使用默认音色: {default_voice}")
-        return default_voice
+        return self.role_index.voice(character_name)
     
-    def _parse_script(self, script_content: str) -> List[Tuple[str, str, str]]:
+    def _parse_script(self, script: Union[str, Iterable[str]],
+                      limit: int = 0) -> List[Tuple[str, str, str, int]]:
         """
         解析markdown剧本内容
         
         Args:
-            script_content: 剧本文本内容
+            script: 剧本文本内容，或逐行读取的文件对象
+            limit: 最多解析的段数，0表示不限制（达到后不再读取剩余内容）
             
         Returns:
-            List[Tuple[str, str, str]]: [(角色名, 对话内容, 行类型)]
+            List[Tuple[str, str, str, int]]: [(角色名, 对话内容, 行类型, 行号)]
         """
-        lines = []
-        
-        for line_num, line in enumerate(script_content.split('\n'), 1):
-            line = line.strip()
-            if not line or line.startswith('#') or line.startswith('>'):
-                continue
-            
-            # 忽略末尾的角色信息行
-            if line.startswith('---') or line.startswith('*该小节涉及的角色'):
-                logger.debug(f"第{line_num}行 - 忽略角色信息行: {line[:30]}...")
-                break  # 遇到角色信息行就停止解析
-            
-            # 匹配角色对话: （角色名）：对话内容
-            dialogue_match = re.match(r'（(.+?)）：(.+)', line)
-            if dialogue_match:
-                character = dialogue_match.group(1)
-                content = dialogue_match.group(2)
-                lines.append((character, content, 'dialogue'))
-                logger.debug(f"第{line_num}行 - 对话: {character}: {content[:30]}...")
-                continue
-            
-            # 如果包含中文内容，视为旁白
-            if re.search(r'[\u4e00-\u9fff]', line):
-                lines.append(('旁白', line, 'narration'))
-                logger.debug(f"第{line_num}行 - 旁白: {line[:30]}...")
+        if isinstance(script, str):
+            script = script.split('\n')
+        segments = iter_script(script)
+        if limit > 0:
+            segments = islice(segments, limit)
         
+        lines = [(segment.character, segment.text, segment.line_type, segment.line_number)
+                 for segment in segments]
         logger.info(f"解析完成，共提取 {len(lines)} 行对话和旁白")
         return lines
     
     def _generate_audio_segment(self, character: str, content: str, 
-                              segment_id: int, max_retries: int = 3) -> Optional[bytes]:
+                              segment_id: int, max_retries: int = 3) -> Optional[AudioBuffer]:
         """
         生成单个音频片段
         
@@ -123,7 +137,7 @@ class ScriptToAudioConverter:
             max_retries: 最大重试次数
             
         Returns:
-            Optional[bytes]: 音频字节数据
+            Optional[AudioBuffer]: 音频字节数据
         """
         voice_type = self._get_character_voice(character)
         
@@ -133,6 +147,7 @@ class ScriptToAudioConverter:
             audio_bytes = self.tts_client.text_to_speech(
                 text=content,
                 voice_type=voice_type,
+                encoding=self.segment_encoding,
                 max_retries=max_retries
             )
             
@@ -147,120 +162,438 @@ class ScriptToAudioConverter:
             logger.error(f"片段 {segment_id} 生成异常: {e}")
             return None
     
-    def _merge_audio_files(self, audio_segments: List[bytes], output_path: str) -> bool:
+    def _generate_or_resume(self, character: str, content: str, segment_id: int, key: str,
+                            line_num: int, checkpoint: Optional[ChapterCheckpoint] = None,
+                            normalizer: Optional[LoudnessNormalizer] = None) -> Optional[AudioBuffer]:
         """
-        使用简单的二进制拼接合并MP3音频片段
+        生成单个音频片段：断点中已有时直接读取，生成成功后立即保存到断点
         
         Args:
-            audio_segments: 音频字节数据列表
-            output_path: 输出文件路径
+            character: 角色名
+            content: 对话内容
+            segment_id: 片段ID
+            key: 请求键
+            line_num: 片段在剧本中的行号
+            checkpoint: 章节断点（可选）
+            normalizer: 响度归一化器（可选），断点中保存的是调整前的音频
             
         Returns:
-            bool: 是否成功
+            Optional[AudioBuffer]: 音频字节数据
         """
+        if checkpoint is not None:
+            audio_bytes = checkpoint.get(key)
+            if audio_bytes:
+                logger.debug(f"片段 {segment_id} 从断点恢复（第{line_num}行）")
+                with self._stats_lock:
+                    self.resumed_segments += 1
+                return self._normalize(character, audio_bytes, normalizer)
         
+        audio_bytes = self._generate_audio_segment(character, content, segment_id)
+        if audio_bytes and checkpoint is not None:
+            try:
+                checkpoint.put(key, audio_bytes, line_num)
+            except OSError as e:
+                logger.warning(f"保存断点失败（第{line_num}行）: {e}")
+        return self._normalize(character, audio_bytes, normalizer)
+    
+    def _generate_segment_task(self, character: str, content: str, segment_id: int, key: str,
+                               line_num: int, checkpoint: Optional[ChapterCheckpoint] = None,
+                               normalizer: Optional[LoudnessNormalizer] = None) -> Optional[AudioBuffer]:
+        """
+        片段任务（参数同_generate_or_resume）：任何异常都记为该段失败并返回None，
+        保证每一段都会交给写入器，重排窗口不会因为一个异常的片段而卡住
+        """
         try:
-            # 创建输出目录
-            Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+            return self._generate_or_resume(character, content, segment_id, key, line_num, checkpoint, normalizer)
+        except Exception as e:
+            logger.error(f"片段 {segment_id} 处理异常（第{line_num}行）: {e}")
+            return None
+    
+    def _normalize(self, character: str, audio_bytes: Optional[AudioBuffer],
+                   normalizer: Optional[LoudnessNormalizer]) -> Optional[AudioBuffer]:
+        """按角色音色的增益调整片段响度，无法解析时原样返回（由写入器跳过）"""
+        if normalizer is None or not audio_bytes:
+            return audio_bytes
+        try:
+            return normalizer.normalize(audio_bytes, self._get_character_voice(character))
+        except Mp3FormatError:
+            return audio_bytes
+    
+    def _split_long_lines(self, parsed_lines: List[Tuple[str, str, str, int]]
+                          ) -> List[Tuple[str, str, str, int]]:
+        """把超过单次请求字节上限的行按句子切成多段（各段保留原行号）"""
+        max_bytes = config.TTS_MAX_REQUEST_BYTES
+        result = []
+        for character, content, line_type, line_num in parsed_lines:
+            if utf8_len(content) <= max_bytes:
+                result.append((character, content, line_type, line_num))
+                continue
+            chunks = split_text(content, max_bytes)
+            logger.debug(f"第{line_num}行超过 {max_bytes} 字节，切分为 {len(chunks)} 段")
+            result.extend((character, chunk, line_type, line_num) for chunk in chunks)
+        return result
+    
+    def _pack_lines(self, parsed_lines: List[Tuple[str, str, str, int]]
+                    ) -> Tuple[List[Tuple[str, str, str, int]], List[List[int]]]:
+        """
+        合并相邻的同音色行，行间插入停顿，每次请求不超过字节上限
+        
+        Args:
+            parsed_lines: 解析后的剧本行
             
-            logger.info(f"开始合并 {len(audio_segments)} 个音频片段...")
+        Returns:
+            Tuple: 合并后的片段（角色、行类型和行号取自第一行），以及每个片段包含的行号
+        """
+        entries = [(self._get_character_voice(character), content)
+                   for character, content, line_type, line_num in parsed_lines]
+        groups = pack_texts(entries, config.TTS_MAX_REQUEST_BYTES, config.TTS_PACK_PAUSE_MS)
+        
+        packed = []
+        line_map = []
+        for start, end, text in groups:
+            character, _, line_type, line_num = parsed_lines[start]
+            packed.append((character, text, line_type, line_num))
+            line_map.append(sorted({line[3] for line in parsed_lines[start:end]}))
+        
+        if len(packed) < len(parsed_lines):
+            logger.info(f"合并相邻同音色的行: {len(parsed_lines)} 行 -> {len(packed)} 段")
+        return packed, line_map
+    
+    def _plan_segments(self, parsed_lines: List[Tuple[str, str, str, int]]) -> List[str]:
+        """
+        合成计划：为每段计算请求键，音色、规范化文本和参数相同的段只请求一次
+
+        Args:
+            parsed_lines: 解析后的剧本行
+
+        Returns:
+            List[str]: 与parsed_lines一一对应的请求键
+        """
+        keys = self._segment_keys(parsed_lines)
+        
+        duplicates = len(keys) - len(set(keys))
+        with self._stats_lock:
+            self.total_segments += len(keys)
+            self.deduplicated_segments += duplicates
+        if duplicates:
+            logger.info(f"合成计划: {len(keys)} 段，其中 {duplicates} 段与前文重复，只需 {len(keys) - duplicates} 次请求")
+        return keys
+    
+    def _segment_keys(self, parsed_lines: List[Tuple[str, str, str, int]]) -> List[str]:
+        """每段的请求键"""
+        return [self.tts_client.request_key(content, self._get_character_voice(character),
+                                            encoding=self.segment_encoding)
+                for character, content, line_type, line_num in parsed_lines]
+    
+    def _estimate_segments(self, parsed_lines: List[Tuple[str, str, str, int]], keys: List[str],
+                           checkpoint: Optional[ChapterCheckpoint] = None) -> Tuple[List[float], WorkEstimate]:
+        """
+        按合成耗时模型估计每段的请求耗时和整章的工作量
+        
+        Args:
+            parsed_lines: 解析后的剧本行
+            keys: 每段的请求键
+            checkpoint: 章节断点（可选），已完成的段不需要请求
+            
+        Returns:
+            Tuple[List[float], WorkEstimate]: 每段的预计耗时（已完成或与前文重复的段为0）和整章的工作量
+        """
+        costs = []
+        seen = set()
+        audio_seconds = 0.0
+        for (character, content, _, _), key in zip(parsed_lines, keys):
+            estimate = self.tts_client.estimate(content, self._get_character_voice(character))
+            audio_seconds += estimate.audio_seconds
+            if key in seen or (checkpoint is not None and checkpoint.has(key)):
+                costs.append(0.0)
+                continue
+            seen.add(key)
+            costs.append(estimate.latency)
+        pending = [cost for cost in costs if cost]
+        return costs, WorkEstimate(len(pending), sum(pending), max(pending, default=0.0), audio_seconds)
+    
+    def estimate_chapter(self, input_file: str, max_conversations: int = 0, pack: Optional[bool] = None,
+                         output_file: Optional[str] = None) -> WorkEstimate:
+        """
+        估计一个章节的工作量（用于章节的最长优先调度和整批的预计时间）
+        
+        Args:
+            input_file: 输入的markdown剧本文件路径
+            max_conversations: 最多处理的对话数量（0表示不限制）
+            pack: 是否合并相邻的同音色行，默认读取配置TTS_PACK_LINES
+            output_file: 输出文件路径（可选），指定时不计入断点中已完成的片段
             
-            if not audio_segments:
-                logger.error("没有音频片段可合并")
-                return False
+        Returns:
+            WorkEstimate: 预计的请求数、合成耗时和音频时长
             
-            # 简单的二进制拼接方式
-            # 对于MP3文件，这种方式通常是有效的
-            combined_data = b''
+        Raises:
+            OSError: 无法读取剧本文件
+        """
+        with open(input_file, 'r', encoding='utf-8') as f:
+            parsed_lines = self._parse_script(f, max_conversations)
+        parsed_lines = self._split_long_lines(parsed_lines)
+        if config.TTS_PACK_LINES if pack is None else pack:
+            parsed_lines, _ = self._pack_lines(parsed_lines)
+        checkpoint = ChapterCheckpoint(output_file) if output_file and ChapterCheckpoint.exists_for(output_file) else None
+        return self._estimate_segments(parsed_lines, self._segment_keys(parsed_lines), checkpoint)[1]
+    
+    @staticmethod
+    def _finish_segment(writer: OrderedAudioWriter, index: int, audio_bytes: Optional[AudioBuffer], progress=None):
+        """把完成的片段交给写入器，并更新进度"""
+        writer.submit(index, audio_bytes)
+        if progress is not None:
+            progress.advance(1)
+    
+    def _generate_segments_serial(self, parsed_lines: List[Tuple[str, str, str, int]],
+                                  keys: List[str], writer: OrderedAudioWriter, progress=None,
+                                  checkpoint: Optional[ChapterCheckpoint] = None,
+                                  normalizer: Optional[LoudnessNormalizer] = None):
+        """
+        逐段串行生成音频片段，生成后立即写出
+
+        Args:
+            parsed_lines: 解析后的剧本行
+            keys: 每段的请求键，重复的段复用第一次的结果
+            writer: 按序写入器
+            progress: 进度对象（可选）
+            checkpoint: 章节断点（可选），已完成的片段直接读取
+            normalizer: 响度归一化器（可选）
+        """
+        remaining = Counter(keys)
+        reusable: Dict[str, Optional[AudioBuffer]] = {}
+        
+        for i, ((character, content, line_type, line_num), key) in enumerate(zip(parsed_lines, keys), 1):
+            logger.info(f"处理第 {i}/{len(parsed_lines)} 段: {character}")
             
-            for i, audio_bytes in enumerate(audio_segments, 1):
-                if audio_bytes:
-                    combined_data += audio_bytes
-                    logger.debug(f"已合并片段 {i}/{len(audio_segments)}，当前大小: {len(combined_data)} bytes")
-                else:
-                    logger.warning(f"跳过空的音频片段 {i}")
+            if key in reusable:
+                audio_bytes = reusable[key]
+                logger.debug(f"第 {i} 段与前文重复，复用结果")
+            else:
+                audio_bytes = self._generate_segment_task(character, content, i, key, line_num, checkpoint,
+                                                          normalizer)
             
-            if not combined_data:
-                logger.error("没有有效的音频数据可合并")
-                return False
+            # 只保留后面还会用到的结果
+            remaining[key] -= 1
+            if remaining[key]:
+                reusable[key] = audio_bytes
+            else:
+                reusable.pop(key, None)
             
-            # 写入合并后的文件
-            with open(output_path, 'wb') as f:
-                f.write(combined_data)
+            writer.reserve()
+            self._finish_segment(writer, i - 1, audio_bytes, progress)
+            if not audio_bytes:
+                logger.warning(f"跳过第 {i} 段（生成失败）")
+    
+    def _generate_segments_concurrently(self, parsed_lines: List[Tuple[str, str, str, int]],
+                                        keys: List[str], concurrency: int,
+                                        writer: OrderedAudioWriter, progress=None,
+                                        checkpoint: Optional[ChapterCheckpoint] = None,
+                                        normalizer: Optional[LoudnessNormalizer] = None,
+                                        order: Optional[List[int]] = None):
+        """
+        并发生成音频片段，完成后交给写入器按剧本顺序写出
+
+        Args:
+            parsed_lines: 解析后的剧本行
+            keys: 每段的请求键，重复的段共享同一个请求
+            concurrency: 同时进行的最大请求数（使用全局线程池时由全局线程数决定）
+            writer: 按序写入器（其重排窗口限制了已派发未写出的片段数）
+            progress: 进度对象（可选）
+            checkpoint: 章节断点（可选），已完成的片段直接读取
+            normalizer: 响度归一化器（可选）
+            order: 派发顺序（段的下标），默认按剧本顺序；乱序派发时每连续window段内不能跨组
+                （见synthesis_model.longest_first），否则重排窗口会被未派发的前序片段卡住
+        """
+        remaining = Counter(keys)
+        shared: Dict[str, Future] = {}
+        if order is None:
+            order = range(len(parsed_lines))
+        
+        own_executor = self._executor is None
+        if own_executor:
+            logger.info(f"并发模式：最多同时处理 {concurrency} 段")
+            executor = ThreadPoolExecutor(max_workers=concurrency)
+        else:
+            executor = self._executor
+        
+        try:
+            futures = {}
+            for index in order:
+                character, content, line_type, line_num = parsed_lines[index]
+                key = keys[index]
+                i = index + 1
+                writer.reserve()
+                
+                future = shared.get(key)
+                if future is None:
+                    future = executor.submit(self._generate_segment_task, character, content, i, key,
+                                             line_num, checkpoint, normalizer)
+                    futures[future] = i
+                    shared[key] = future
+                else:
+                    logger.debug(f"第 {i} 段与前文重复，复用请求")
+                future.add_done_callback(
+                    lambda f, index=i - 1: self._finish_segment(writer, index, f.result(), progress))
+                
+                # 最后一次引用之后释放，避免结果一直留在内存中
+                remaining[key] -= 1
+                if not remaining[key]:
+                    del shared[key]
             
-            logger.info(f"音频合并完成: {output_path}")
-            logger.info(f"合并后文件大小: {len(combined_data)} bytes")
-            return True
+            for done, future in enumerate(as_completed(futures), 1):
+                i = futures[future]
+                if not future.result():
+                    logger.warning(f"跳过第 {i} 段（生成失败）")
+                logger.info(f"已完成 {done}/{len(futures)} 个请求（第 {i} 段）")
             
-        except Exception as e:
-            logger.error(f"音频合并失败: {e}")
-            return False
+            # 完成回调可能晚于as_completed返回，等待所有片段交给写入器
+            writer.join(len(parsed_lines))
+        finally:
+            if own_executor:
+                executor.shutdown(wait=True)
+    
+    def run_summary(self) -> Dict:
+        """
+        获取本次运行的统计汇总
+
+        Returns:
+            Dict: 总段数、去重节省的请求数、在途合并次数、断点恢复段数以及缓存和并发控制统计
+        """
+        return {
+            'segments': self.total_segments,
+            'deduplicated': self.deduplicated_segments,
+            'resumed': self.resumed_segments,
+            'coalesced': self.tts_client.coalesced_requests,
+            'saved_requests': self.deduplicated_segments + self.tts_client.coalesced_requests,
+            'cache': self.tts_client.cache.stats() if self.tts_client.cache is not None else None,
+            'limiter': self.tts_client.limiter.stats()
+        }
     
     def convert_script_to_audio(self, input_file: str, output_file: str, 
-                              max_conversations: int = 100) -> bool:
+                              max_conversations: int = 100,
+                              concurrency: Optional[int] = None,
+                              progress=None, resume: bool = True,
+                              pack: Optional[bool] = None,
+                              hls: Optional[bool] = None,
+                              normalize: Optional[bool] = None) -> bool:
         """
         将剧本转换为音频
         
+        片段按剧本顺序流式追加到临时文件，全部完成后原子替换为输出文件。
+        每个片段完成后保存到断点目录（<输出文件>.parts/），中断或部分失败后重新运行
+        只合成缺失的片段；全部成功后断点目录被删除
+        
         Args:
             input_file: 输入的markdown剧本文件路径
             output_file: 输出的mp3文件路径
             max_conversations: 最多处理的对话数量（用于测试）
+            concurrency: 同时进行的最大TTS请求数，默认读取配置TTS_CONCURRENCY，1表示串行
+            progress: 进度对象（可选），需提供add_total(n)和advance(n)方法，
+                用于汇总多个同时进行的转换任务的进度
+            resume: 是否使用断点（读取已完成的片段并保存新完成的片段）
+            pack: 是否合并相邻的同音色行，默认读取配置TTS_PACK_LINES
+            hls: 是否同时输出HLS分段和播放列表（<输出文件名>_hls/index.m3u8），
+                合成过程中即可开始播放，默认读取配置HLS_OUTPUT
+            normalize: 是否把各音色调整到同一响度（mp3或PCM流水线），默认读取配置LOUDNESS_NORMALIZE
             
         Returns:
             bool: 是否成功
         """
+        if concurrency is None:
+            concurrency = config.TTS_CONCURRENCY
+        concurrency = max(1, concurrency)
+        
         logger.info(f"开始转换剧本: {input_file} -> {output_file}")
         logger.info(f"最多处理 {max_conversations} 段对话")
         
-        # 读取剧本文件
+        # 边读边解析剧本文件，限制处理数量时（用于测试）读到足够的段数即停止
         try:
             with open(input_file, 'r', encoding='utf-8') as f:
-                script_content = f.read()
+                parsed_lines = self._parse_script(f, max_conversations)
         except Exception as e:
             logger.error(f"读取剧本文件失败: {e}")
             return False
         
-        # 解析剧本
-        parsed_lines = self._parse_script(script_content)
         if not parsed_lines:
             logger.error("剧本解析失败，没有提取到有效内容")
             return False
         
-        # 限制处理数量（用于测试）
         if max_conversations > 0:
-            parsed_lines = parsed_lines[:max_conversations]
             logger.info(f"限制处理前 {max_conversations} 段内容")
         
-        # 生成音频片段
-        audio_segments = []
-        success_count = 0
+        parsed_lines = self._split_long_lines(parsed_lines)
+        if pack is None:
+            pack = config.TTS_PACK_LINES
+        if pack:
+            parsed_lines, line_map = self._pack_lines(parsed_lines)
+        else:
+            line_map = [[line_num] for _, _, _, line_num in parsed_lines]
         
-        for i, (character, content, line_type) in enumerate(parsed_lines, 1):
-            logger.info(f"处理第 {i}/{len(parsed_lines)} 段: {character}")
-            
-            audio_bytes = self._generate_audio_segment(character, content, i)
-            
-            if audio_bytes:
-                audio_segments.append(audio_bytes)
-                success_count += 1
-            else:
-                logger.warning(f"跳过第 {i} 段（生成失败）")
-            
-            # 添加小延迟避免请求过快
-            time.sleep(0.5)
-        
-        logger.info(f"音频生成完成: {success_count}/{len(parsed_lines)} 段成功")
-        
-        if not audio_segments:
-            logger.error("没有成功生成任何音频片段")
+        # 生成音频片段并按顺序流式写出
+        keys = self._plan_segments(parsed_lines)
+        checkpoint = ChapterCheckpoint(output_file) if resume else None
+        if checkpoint is not None and checkpoint.load():
+            previous = checkpoint.missing_lines()
+            if previous:
+                logger.info(f"上次运行缺失的行号: {previous}，本次只重新合成未完成的片段")
+        costs, work = self._estimate_segments(parsed_lines, keys, checkpoint)
+        logger.info(f"预计音频时长 {work.audio_seconds / 60:.1f} 分钟，"
+                    f"{work.requests} 次请求预计需要 {work.eta(concurrency):.0f} 秒（并发 {concurrency}）")
+        if progress is not None:
+            progress.add_total(len(parsed_lines))
+        if hls is None:
+            hls = config.HLS_OUTPUT
+        if normalize is None:
+            normalize = config.LOUDNESS_NORMALIZE
+        pcm = self.segment_encoding is not None
+        normalizer = get_normalizer() if normalize and (pcm or config.OUTPUT_FORMAT == 'mp3') else None
+        # 按相邻两段的关系（换人、旁白与对话切换等）决定段间停顿
+        pauses = PauseRules.from_config().plan([(character, line_type, line_num)
+                                                for character, _, line_type, line_num in parsed_lines])
+        try:
+            with OrderedAudioWriter(output_file, window=concurrency * self.REORDER_WINDOW_FACTOR,
+                                    audio_format='pcm' if pcm else config.OUTPUT_FORMAT,
+                                    playlist_dir=playlist_dir_for(output_file) if hls else None,
+                                    pauses=pauses) as writer:
+                if concurrency > 1:
+                    # 先派发预计最长的段，避免长段排在最后拖长整章的时间
+                    order = longest_first(costs, writer.window) if config.TTS_LONGEST_FIRST else None
+                    self._generate_segments_concurrently(parsed_lines, keys, concurrency, writer, progress,
+                                                         checkpoint, normalizer, order)
+                else:
+                    self._generate_segments_serial(parsed_lines, keys, writer, progress, checkpoint, normalizer)
+                
+                logger.info(f"音频生成完成: {writer.written_segments}/{len(parsed_lines)} 段成功")
+                if self.tts_client.cache is not None:
+                    logger.info(f"缓存统计: {self.tts_client.cache.stats()}")
+                logger.info(f"并发控制统计: {self.tts_client.limiter.stats()}")
+                if normalizer is not None:
+                    logger.info(f"音色增益(dB): {normalizer.stats()}")
+                
+                missing = sorted({line_num for index in writer.skipped_indices for line_num in line_map[index]})
+                if missing:
+                    logger.warning(f"仍有 {len(missing)} 行缺失，行号: {missing}")
+                    if checkpoint is not None:
+                        checkpoint.record_missing(missing)
+                        logger.warning(f"已完成的片段保存在 {checkpoint.dir}，重新运行将只合成缺失的片段")
+                
+                if not writer.written_segments:
+                    logger.error("没有成功生成任何音频片段")
+                    writer.abort()
+                    return False
+                
+                committed = writer.commit()
+                if committed and not missing and checkpoint is not None:
+                    checkpoint.remove()
+                return committed
+        except Exception as e:
+            logger.error(f"音频写出失败: {e}")
             return False
-        
-        # 合并音频文件
-        return self._merge_audio_files(audio_segments, output_file)
 
 
 # 辅助函数
-def convert_story_script(input_file: str, output_file: str, max_conversations: int = 100) -> bool:
+def convert_story_script(input_file: str, output_file: str, max_conversations: int = 100,
+                         concurrency: Optional[int] = None) -> bool:
     """
     便捷函数：转换故事剧本为音频
     
@@ -268,27 +601,39 @@ def convert_story_script(input_file: str, output_file: str, max_conversations: i
         input_file: 输入的markdown剧本文件路径  
         output_file: 输出的mp3文件路径
         max_conversations: 最多处理的对话数量
+        concurrency: 同时进行的最大TTS请求数（None表示使用配置默认值）
         
     Returns:
         bool: 是否成功
     """
-    converter = ScriptToAudioConverter()
-    return converter.convert_script_to_audio(input_file, output_file, max_conversations)
+    with ScriptToAudioConverter() as converter:
+        return converter.convert_script_to_audio(input_file, output_file, max_conversations, concurrency)
 
 
 if __name__ == "__main__":
     # 示例用法
     import sys
     
-    if len(sys.argv) < 3:
-        print("用法: python script_to_audio.py <输入文件> <输出文件> [最大对话数]")
+    # --daemon：提交给合成守护进程执行并等待结果
+    use_daemon = '--daemon' in sys.argv
+    argv = [arg for arg in sys.argv if arg != '--daemon']
+    
+    if len(argv) < 3:
+        print("用法: python script_to_audio.py <输入文件> <输出文件> [最大对话数] [并发数] [--daemon]")
         sys.exit(1)
     
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
-    max_conv = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+    input_file = argv[1]
+    output_file = argv[2]
+    max_conv = int(argv[3]) if len(argv) > 3 else 100
+    concurrency = int(argv[4]) if len(argv) > 4 else None
     
-    success = convert_story_script(input_file, output_file, max_conv)
+    if use_daemon:
+        from job_queue import KIND_CHAPTER, STATUS_DONE, JobQueue, submit_and_wait
+        payload = {'input_file': str(Path(input_file).resolve()), 'output_file': str(Path(output_file).resolve()),
+                   'max_conversations': max_conv, 'concurrency': concurrency}
+        success = submit_and_wait(JobQueue(), KIND_CHAPTER, [payload])[0].status == STATUS_DONE
+    else:
+        success = convert_story_script(input_file, output_file, max_conv, concurrency)
     if success:
         print(f"✅ 转换成功: {output_file}")
     else:
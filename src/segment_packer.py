@@ -0,0 +1,78 @@
+"""
+合并相邻的同音色片段
+连续多行旁白（或同一音色的多行）合并为一次TTS请求，行间用SSML停顿隔开，
+合并后的文本不超过单次请求的字节上限
+"""
+
+from typing import Hashable, List, Sequence, Tuple
+from xml.sax.saxutils import escape
+
+SSML_PREFIX = '<speak>'
+SSML_SUFFIX = '</speak>'
+
+
+def is_ssml(text: str) -> bool:
+    """文本是否为SSML（需要以ssml类型提交）"""
+    return text.startswith(SSML_PREFIX)
+
+
+def _break_tag(pause_ms: int) -> str:
+    return f'<break time="{pause_ms}ms"/>'
+
+
+def join_texts(texts: Sequence[str], pause_ms: int) -> str:
+    """
+    把多行文本合并为一次请求的文本
+
+    Args:
+        texts: 各行文本
+        pause_ms: 行间停顿（毫秒），大于0时生成SSML，否则按换行拼接
+
+    Returns:
+        str: 合并后的文本；只有一行时原样返回
+    """
+    if len(texts) == 1:
+        return texts[0]
+    if pause_ms <= 0:
+        return '\n'.join(texts)
+    return SSML_PREFIX + _break_tag(pause_ms).join(escape(t) for t in texts) + SSML_SUFFIX
+
+
+def pack_texts(entries: Sequence[Tuple[Hashable, str]], max_bytes: int,
+               pause_ms: int = 0) -> List[Tuple[int, int, str]]:
+    """
+    贪心合并相邻的同组文本
+
+    Args:
+        entries: [(分组键, 文本)]，分组键相同（音色和参数都相同）的相邻行才会合并
+        max_bytes: 合并后文本的UTF-8字节上限
+        pause_ms: 行间停顿（毫秒）
+
+    Returns:
+        List[Tuple[int, int, str]]: [(起始下标, 结束下标(不含), 合并后的文本)]，
+            按顺序覆盖全部输入；超过上限的单行保持原样单独成组
+    """
+    if pause_ms > 0:
+        overhead = len((SSML_PREFIX + SSML_SUFFIX).encode('utf-8'))
+        separator = len(_break_tag(pause_ms).encode('utf-8'))
+    else:
+        overhead = 0
+        separator = 1
+
+    def cost(text: str) -> int:
+        return len((escape(text) if pause_ms > 0 else text).encode('utf-8'))
+
+    groups = []
+    start = 0
+    while start < len(entries):
+        key, text = entries[start]
+        size = overhead + cost(text)
+        end = start + 1
+        while end < len(entries) and entries[end][0] == key:
+            size += separator + cost(entries[end][1])
+            if size > max_bytes:
+                break
+            end += 1
+        groups.append((start, end, join_texts([t for _, t in entries[start:end]], pause_ms)))
+        start = end
+    return groups
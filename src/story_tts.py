@@ -1,40 +1,106 @@
 import os
-import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, NamedTuple, Optional, Tuple
 from loguru import logger
 from tqdm import tqdm
 import tempfile
 
 from config import config
-from tts_client_context7 import TTSClientContext7
+from llm_tts_client import LLMTTSClient
 from script_parser import ScriptParser
+from mp3_frames import GAIN_STEP_DB, Mp3Muxer, Mp3FormatError, PreparedSegment, apply_gain, prepare_segment_file
+from pcm_audio import PcmChapterBuffer, PcmFormatError, decode_to_wav, is_wav
+from checkpoint import ChapterCheckpoint
+from segment_packer import pack_texts
+from hls_writer import HlsSegmenter, playlist_dir_for
+from loudness import LoudnessNormalizer, get_normalizer
+from pauses import PauseRules
+from tts_response import AudioBuffer
+
+
+class SegmentFile(NamedTuple):
+    """已生成的片段文件，及其之前的停顿、增益（dB）和预处理结果（未提交到进程池时为None）"""
+    path: Path
+    pause_ms: int
+    gain_db: float
+    future: Optional[Future]
+
+
+def _gain_steps(gain_db: float) -> int:
+    """MP3按global_gain步长调整，增益取最接近的步数"""
+    return int(round(gain_db / GAIN_STEP_DB))
 
 
 class StoryTTSProcessor:
     """故事TTS处理器，负责将剧本转换为语音"""
     
-    def __init__(self, roles_config_path: str = "config/roles.yml"):
+    def __init__(self, roles_config_path: str = "config/roles.yml", audio_workers: Optional[int] = None,
+                 pcm_pipeline: Optional[bool] = None):
+        """
+        初始化处理器
+        
+        Args:
+            roles_config_path: 角色配置文件路径
+            audio_workers: 预处理音频片段的进程数（0表示在主进程中处理），默认读取配置AUDIO_WORKERS
+            pcm_pipeline: 是否向服务端请求WAV片段、整章只编码一次，默认读取配置TTS_PCM_PIPELINE
+                （PCM片段直接拷贝采样，不需要预处理进程池）
+        """
+        if pcm_pipeline is None:
+            pcm_pipeline = config.TTS_PCM_PIPELINE
+        # 片段的请求编码，None表示使用配置TTS_ENCODING
+        self.segment_encoding: Optional[str] = 'wav' if pcm_pipeline else None
+        # 只有MP3片段能按帧拼接；其他输出格式的片段解码后写入PCM缓冲区，整章编码一次
+        self.mp3_segments = not pcm_pipeline and config.OUTPUT_FORMAT == 'mp3'
         self.script_parser = ScriptParser(roles_config_path)
-        self.tts_client = TTSClientContext7()
+        self.tts_client = LLMTTSClient()
+        self.audio_workers = config.AUDIO_WORKERS if audio_workers is None else max(0, audio_workers)
+        if not self.mp3_segments:
+            self.audio_workers = 0
+        # 进程池在第一个片段需要预处理时创建，同一处理器的所有章节共用
+        self._pool: Optional[ProcessPoolExecutor] = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+    
+    def close(self):
+        """释放TTS客户端持有的连接和预处理进程池"""
+        self.tts_client.close()
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
         
     def process_script_to_audio(self, script_path: str, output_path: str, 
-                               story_name: str = None, chapter_name: str = None) -> bool:
+                               story_name: str = None, chapter_name: str = None,
+                               hls: Optional[bool] = None, normalize: Optional[bool] = None) -> bool:
         """
         将剧本文件转换为完整的音频文件
         
+        音频片段保存在断点目录（<输出文件>.parts/）中，中断或部分失败后重新运行
+        只合成缺失的片段；全部成功后断点目录被删除
+        
         Args:
             script_path: 剧本文件路径
             output_path: 输出音频文件路径
-            story_name: 故事名称（用于临时文件命名）
-            chapter_name: 章节名称（用于临时文件命名）
+            story_name: 故事名称（用于日志）
+            chapter_name: 章节名称（用于日志）
+            hls: 是否同时输出HLS分段和播放列表（<输出文件名>_hls/index.m3u8），
+                合成过程中即可开始播放，默认读取配置HLS_OUTPUT
+            normalize: 是否把各音色调整到同一响度，默认读取配置LOUDNESS_NORMALIZE
             
         Returns:
             bool: 是否成功
         """
         try:
             # 解析剧本
-            logger.info(f"开始处理剧本: {script_path}")
+            if story_name and chapter_name:
+                logger.info(f"开始处理剧本: {story_name}/{chapter_name} ({script_path})")
+            else:
+                logger.info(f"开始处理剧本: {script_path}")
             dialogue_lines = self.script_parser.parse_script_file(script_path)
             
             if not dialogue_lines:
@@ -43,6 +109,8 @@ class StoryTTSProcessor:
             
             # 准备TTS任务
             tasks = self.script_parser.prepare_tts_tasks(dialogue_lines)
+            if config.TTS_PACK_LINES:
+                tasks = self._pack_tasks(tasks)
             
             # 显示角色统计
             stats = self.script_parser.get_character_stats(dialogue_lines)
@@ -50,21 +118,49 @@ class StoryTTSProcessor:
             for char, stat in stats.items():
                 logger.info(f"  {char}: {stat['line_count']} 行, {stat['total_chars']} 字符")
             
-            # 创建临时目录存放音频片段
-            temp_dir = self._create_temp_dir(story_name, chapter_name)
+            # 音频片段存放在断点目录，上次运行已完成的片段直接复用
+            checkpoint = ChapterCheckpoint(output_path)
+            if checkpoint.load():
+                previous = checkpoint.missing_lines()
+                if previous:
+                    logger.info(f"上次运行缺失的行号: {previous}，本次只重新合成未完成的片段")
             
-            # 生成各个音频片段
-            audio_files = self._generate_audio_segments(tasks, temp_dir)
+            if hls is None:
+                hls = config.HLS_OUTPUT
+            segmenter = None
+            if hls and self.segment_encoding is not None:
+                logger.warning("PCM流水线在整章完成后才编码，不输出HLS分段")
+            elif hls and not self.mp3_segments:
+                logger.warning(f"HLS分段只支持mp3，当前格式 {config.OUTPUT_FORMAT}，不输出分段")
+            elif hls:
+                segmenter = HlsSegmenter(playlist_dir_for(output_path))
+                logger.info(f"边生成边收听: {segmenter.playlist_path}")
             
-            if not audio_files:
+            if normalize is None:
+                normalize = config.LOUDNESS_NORMALIZE
+            normalizer = get_normalizer() if normalize else None
+            
+            # 生成各个音频片段（同时在进程池中预处理已完成的片段）
+            segments, missing = self._generate_audio_segments(tasks, checkpoint, segmenter, normalizer)
+            
+            if missing:
+                checkpoint.record_missing(missing)
+                logger.warning(f"仍有 {len(missing)} 行缺失，行号: {missing}；"
+                               f"已完成的片段保存在 {checkpoint.dir}，重新运行将只合成缺失的片段")
+            
+            if not segments:
                 logger.error("没有成功生成音频片段")
                 return False
             
             # 合并音频文件
-            success = self._merge_audio_files(audio_files, output_path)
+            if self.mp3_segments:
+                success = self._merge_audio_files(segments, output_path)
+            else:
+                success = self._merge_pcm_files(segments, output_path)
             
-            # 清理临时文件
-            self._cleanup_temp_files(temp_dir)
+            # 全部完成后清理断点
+            if success and not missing:
+                checkpoint.remove()
             
             return success
             
@@ -72,115 +168,242 @@ class StoryTTSProcessor:
             logger.error(f"处理剧本失败: {e}")
             return False
     
-    def _create_temp_dir(self, story_name: str = None, chapter_name: str = None) -> Path:
-        """创建临时目录"""
-        if story_name and chapter_name:
-            temp_name = f"tts_{story_name}_{chapter_name}_{int(time.time())}"
-        else:
-            temp_name = f"tts_{int(time.time())}"
-        
-        temp_dir = Path(tempfile.gettempdir()) / temp_name
-        temp_dir.mkdir(parents=True, exist_ok=True)
-        
-        logger.info(f"创建临时目录: {temp_dir}")
-        return temp_dir
+    def _pack_tasks(self, tasks: List[Dict]) -> List[Dict]:
+        """合并相邻的同音色、同语速任务，每次请求不超过字节上限"""
+        entries = [((task['voice_config'].get('tts_voice'), task['voice_config'].get('speed')), task['text'])
+                   for task in tasks]
+        groups = pack_texts(entries, config.TTS_MAX_REQUEST_BYTES, config.TTS_PACK_PAUSE_MS)
+        
+        packed = []
+        for start, end, text in groups:
+            task = dict(tasks[start], text=text)
+            task['line_numbers'] = sorted({t['line_number'] for t in tasks[start:end]})
+            packed.append(task)
+        
+        logger.info(f"合并相邻同音色的任务: {len(tasks)} -> {len(packed)}")
+        return packed
     
-    def _generate_audio_segments(self, tasks: List[Dict], temp_dir: Path) -> List[Path]:
-        """生成音频片段"""
+    def _generate_audio_segments(self, tasks: List[Dict], checkpoint: ChapterCheckpoint,
+                                 segmenter: Optional[HlsSegmenter] = None,
+                                 normalizer: Optional[LoudnessNormalizer] = None
+                                 ) -> Tuple[List[SegmentFile], List[int]]:
+        """
+        生成音频片段，每个片段完成后立即保存到断点，并提交到进程池预处理
+        
+        Args:
+            tasks: TTS任务列表
+            checkpoint: 章节断点，已完成的片段直接复用
+            segmenter: HLS分段器（可选），每个片段完成后按顺序追加，与合并结果一致
+            normalizer: 响度归一化器（可选），增益在预处理时应用，断点中保存的是调整前的音频
+            
+        Returns:
+            Tuple[List[SegmentFile], List[int]]: 按顺序排列的片段文件，以及生成失败的行号
+        """
         audio_files = []
+        missing = []
+        resumed = 0
+        # 按相邻两段的关系（换人、旁白与对话切换等）决定段间停顿
+        pauses = PauseRules.from_config().plan([
+            (task['character'], task.get('line_type', 'dialogue'), task['line_number']) for task in tasks])
         
-        logger.info(f"开始生成 {len(tasks)} 个音频片段")
+        # 串行生成，预计耗时为各个待合成请求之和
+        eta = 0.0
+        for task in tasks:
+            params = (task['text'], task['voice_config'].get('tts_voice'), task['voice_config'].get('speed'))
+            if not checkpoint.has(self.tts_client.request_key(*params, self.segment_encoding)):
+                eta += self.tts_client.estimate(*params).latency
+        logger.info(f"开始生成 {len(tasks)} 个音频片段，预计需要 {eta:.0f} 秒")
         
-        for task in tqdm(tasks, desc="生成音频片段"):
+        for task, pause_ms in zip(tqdm(tasks, desc="生成音频片段"), pauses):
             try:
-                # 准备输出文件名
-                filename = f"{task['task_id']}_{task['character']}.mp3"
-                output_file = temp_dir / filename
-                
                 # 获取语音配置
                 voice_config = task['voice_config']
+                voice_type = voice_config.get('tts_voice')
+                speed_ratio = voice_config.get('speed')
+                key = self.tts_client.request_key(task['text'], voice_type, speed_ratio, self.segment_encoding)
                 
-                # 调用TTS生成音频
-                success = self.tts_client.text_to_speech(
+                if checkpoint.has(key):
+                    audio_file = checkpoint.path(key)
+                    gain_db = 0.0
+                    if normalizer is not None:
+                        sample = audio_file.read_bytes() if normalizer.needs_sample(
+                            voice_type, speed_ratio, self.segment_encoding == 'wav') else None
+                        gain_db = normalizer.gain_db(voice_type, speed_ratio, sample)
+                    audio_files.append(self._prepare(audio_file, pause_ms, gain_db))
+                    if segmenter is not None:
+                        segmenter = self._add_to_playlist(segmenter, audio_file.read_bytes(), pause_ms, gain_db)
+                    resumed += 1
+                    continue
+                
+                # 调用TTS生成音频（相同文本和参数会命中客户端缓存）
+                audio_bytes = self.tts_client.text_to_speech(
                     text=task['text'],
-                    output_file=str(output_file),
-                    voice_type=voice_config.get('tts_voice'),
-                    speed=voice_config.get('speed'),
-                    volume=voice_config.get('volume'),
-                    pitch=voice_config.get('pitch')
+                    voice_type=voice_type,
+                    speed_ratio=speed_ratio,
+                    encoding=self.segment_encoding
                 )
                 
-                if success and output_file.exists():
-                    audio_files.append(output_file)
+                if audio_bytes:
+                    checkpoint.put(key, audio_bytes, task['line_number'])
+                    gain_db = normalizer.gain_db(voice_type, speed_ratio, audio_bytes) if normalizer else 0.0
+                    audio_files.append(self._prepare(checkpoint.path(key), pause_ms, gain_db))
+                    segmenter = self._add_to_playlist(segmenter, audio_bytes, pause_ms, gain_db)
                     logger.debug(f"生成音频: {task['character']} - {task['text'][:30]}...")
                 else:
-                    logger.warning(f"音频生成失败: {task['task_id']}")
-                    
-                # 添加小间隔，避免请求过快
-                time.sleep(0.1)
+                    logger.warning(f"音频生成失败: {task['task_id']}（第{task['line_number']}行）")
+                    missing.extend(task.get('line_numbers', [task['line_number']]))
                 
             except Exception as e:
                 logger.error(f"生成音频片段失败 {task['task_id']}: {e}")
+                missing.extend(task.get('line_numbers', [task['line_number']]))
                 continue
         
+        if segmenter is not None:
+            try:
+                segmenter.finish()
+            except OSError as e:
+                logger.warning(f"HLS播放列表写出失败: {e}")
+        
         logger.success(f"成功生成 {len(audio_files)}/{len(tasks)} 个音频片段")
-        return audio_files
+        if resumed:
+            logger.info(f"其中 {resumed} 个片段从断点恢复")
+        if self.tts_client.cache is not None:
+            logger.info(f"缓存统计: {self.tts_client.cache.stats()}")
+        logger.info(f"并发控制统计: {self.tts_client.limiter.stats()}")
+        if normalizer is not None:
+            logger.info(f"音色增益(dB): {normalizer.stats()}")
+        # 同一行拆分出的多个片段只报告一次
+        return audio_files, sorted(set(missing))
+    
+    def _prepare(self, audio_file: Path, pause_ms: int = 0, gain_db: float = 0.0) -> SegmentFile:
+        """
+        提交一个片段文件做拼接前的预处理（解析帧、去掉标签和头帧、调整增益），与后续片段的合成并行
+        
+        进程池不可用（audio_workers为0或创建失败）时不提交，合并时在主进程中处理
+        """
+        pool = self._get_pool()
+        if pool is not None:
+            try:
+                future = pool.submit(prepare_segment_file, str(audio_file), _gain_steps(gain_db))
+                return SegmentFile(audio_file, pause_ms, gain_db, future)
+            except (BrokenProcessPool, RuntimeError) as e:
+                logger.warning(f"音频预处理进程池不可用，改为在主进程中处理: {e}")
+                self._pool = None
+                self.audio_workers = 0
+        return SegmentFile(audio_file, pause_ms, gain_db, None)
     
-    def _merge_audio_files(self, audio_files: List[Path], output_path: str) -> bool:
-        """合并音频文件"""
+    def _get_pool(self) -> Optional[ProcessPoolExecutor]:
+        """按需创建预处理进程池"""
+        if self._pool is None and self.audio_workers > 0:
+            try:
+                self._pool = ProcessPoolExecutor(max_workers=self.audio_workers)
+                logger.debug(f"音频预处理进程池: {self.audio_workers} 个进程")
+            except (OSError, ValueError, NotImplementedError) as e:
+                logger.warning(f"无法创建音频预处理进程池，改为在主进程中处理: {e}")
+                self.audio_workers = 0
+        return self._pool
+    
+    @staticmethod
+    def _prepared_segment(segment: SegmentFile) -> PreparedSegment:
+        """取得片段的预处理结果；未提交到进程池或工作进程异常退出时在主进程中处理"""
+        if segment.future is not None:
+            try:
+                return segment.future.result()
+            except BrokenProcessPool as e:
+                logger.warning(f"预处理进程异常退出，在主进程中处理 {segment.path.name}: {e}")
+        return prepare_segment_file(str(segment.path), _gain_steps(segment.gain_db))
+    
+    def _add_to_playlist(self, segmenter: Optional[HlsSegmenter],
+                         audio_bytes: AudioBuffer, pause_ms: int = 0, gain_db: float = 0.0) -> Optional[HlsSegmenter]:
+        """把片段追加到HLS分段（之前的停顿和增益与合并时相同），出错时停止分段输出"""
+        if segmenter is None:
+            return None
         try:
-            from pydub import AudioSegment
-            from pydub.silence import Silence
-            
-            logger.info(f"开始合并 {len(audio_files)} 个音频文件")
+            segmenter.add_silence(pause_ms)
+            segmenter.add(apply_gain(audio_bytes, _gain_steps(gain_db)))
+            return segmenter
+        except (OSError, Mp3FormatError) as e:
+            logger.warning(f"HLS分段写出失败，停止分段输出: {e}")
+            return None
+    
+    def _merge_audio_files(self, segments: List[SegmentFile], output_path: str) -> bool:
+        """
+        按MP3帧拼接音频文件，片段之间按停顿规则插入预先编码的静音帧，不解码也不重新编码
+        
+        片段的解析已在进程池中与合成并行完成，这里只按顺序把帧数据整块写入输出文件
+        """
+        try:
+            logger.info(f"开始合并 {len(segments)} 个音频文件")
             
             # 确保输出目录存在
             output_path = Path(output_path)
             output_path.parent.mkdir(parents=True, exist_ok=True)
             
-            # 初始化合并音频
-            merged_audio = AudioSegment.empty()
-            
-            for audio_file in tqdm(audio_files, desc="合并音频"):
-                try:
-                    # 加载音频片段
-                    audio_segment = AudioSegment.from_mp3(str(audio_file))
-                    
-                    # 添加到合并音频中
-                    merged_audio += audio_segment
+            fd, tmp_path = tempfile.mkstemp(dir=output_path.parent, prefix=f".{output_path.name}.", suffix='.part')
+            try:
+                with os.fdopen(fd, 'w+b') as f:
+                    muxer = Mp3Muxer(f)
                     
-                    # 添加短暂间隔（0.3秒）
-                    silence = AudioSegment.silent(duration=300)
-                    merged_audio += silence
+                    for segment in tqdm(segments, desc="合并音频"):
+                        try:
+                            prepared = self._prepared_segment(segment)
+                            # 第一个片段之前不插入（尚未写入时add_silence不写）
+                            muxer.add_silence(segment.pause_ms)
+                            muxer.add_prepared(prepared)
+                        except (OSError, Mp3FormatError) as e:
+                            logger.warning(f"加载音频文件失败 {segment.path}: {e}")
+                            continue
                     
-                except Exception as e:
-                    logger.warning(f"加载音频文件失败 {audio_file}: {e}")
-                    continue
-            
-            # 导出合并后的音频
-            merged_audio.export(str(output_path), format="mp3")
+                    if not muxer.finalize():
+                        logger.error("没有有效的音频数据可合并")
+                        return False
+                
+                os.replace(tmp_path, output_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
             
             logger.success(f"音频合并完成: {output_path}")
-            logger.info(f"总时长: {len(merged_audio) / 1000:.1f} 秒")
+            logger.info(f"总时长: {muxer.duration:.1f} 秒")
             
             return True
             
-        except ImportError:
-            logger.error("请安装 pydub 库: pip install pydub")
-            return False
         except Exception as e:
             logger.error(f"合并音频失败: {e}")
             return False
     
-    def _cleanup_temp_files(self, temp_dir: Path):
-        """清理临时文件"""
+    def _merge_pcm_files(self, segments: List[SegmentFile], output_path: str) -> bool:
+        """
+        PCM流水线（以及非MP3输出格式）的合并：各片段的采样依次写入章节缓冲区，停顿为未写入的静音区域，
+        增益在缓冲区中原地调整，最后整章编码一次到配置OUTPUT_FORMAT
+
+        WAV片段直接拷贝采样，其他格式的片段先用ffmpeg解码
+        """
+        output_path = Path(output_path)
+        buffer = PcmChapterBuffer(str(output_path.parent), prefix=f".{output_path.name}.")
         try:
-            import shutil
-            if temp_dir.exists():
-                shutil.rmtree(temp_dir)
-                logger.info(f"清理临时目录: {temp_dir}")
-        except Exception as e:
-            logger.warning(f"清理临时文件失败: {e}")
+            logger.info(f"开始合并 {len(segments)} 个PCM片段")
+            for segment in tqdm(segments, desc="合并音频"):
+                try:
+                    data = segment.path.read_bytes()
+                    if not is_wav(data):
+                        data = decode_to_wav(data, config.PCM_SAMPLE_RATE)
+                    buffer.add(data, segment.pause_ms, segment.gain_db)
+                except (OSError, PcmFormatError) as e:
+                    logger.warning(f"加载音频文件失败 {segment.path}: {e}")
+            
+            if not buffer.encode(str(output_path), config.OUTPUT_FORMAT, config.PCM_ENCODE_BITRATE):
+                logger.error("没有有效的音频数据可合并")
+                return False
+            
+            logger.success(f"音频合并完成: {output_path}")
+            logger.info(f"总时长: {buffer.duration:.3f} 秒")
+            return True
+        except OSError as e:
+            logger.error(f"合并音频失败: {e}")
+            return False
+        finally:
+            buffer.close()
     
     def batch_process_story(self, story_dir: str, output_base_dir: str) -> Dict[str, bool]:
         """批量处理故事目录下的所有章节"""
@@ -228,15 +451,15 @@ class StoryTTSProcessor:
         return results
     
     def get_estimated_duration(self, script_path: str) -> float:
-        """估算音频时长（基于文字数量）"""
+        """估算音频时长（分钟），按合成耗时模型中各音色每字节文本对应的音频时长，没有样本时约每分钟200字"""
         try:
             dialogue_lines = self.script_parser.parse_script_file(script_path)
-            total_chars = sum(len(line.text) for line in dialogue_lines)
-            
-            # 假设每分钟朗读约200个中文字符
-            estimated_minutes = total_chars / 200
+            tasks = self.script_parser.prepare_tts_tasks(dialogue_lines)
+            total_seconds = sum(self.tts_client.estimate(task['text'], task['voice_config'].get('tts_voice'),
+                                                         task['voice_config'].get('speed')).audio_seconds
+                                for task in tasks)
             
-            return estimated_minutes
+            return total_seconds / 60
         except Exception as e:
             logger.warning(f"估算时长失败: {e}")
             return 0.0
\ No newline at end of file
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+合成守护进程
+常驻运行，保持模块、角色配置、TTS客户端和长连接处于就绪状态，从SQLite任务队列（见job_queue）
+按优先级领取章节、故事和文本任务执行；失败的任务按配置重试，结果写回队列。
+命令行工具加 --daemon 参数即可把任务提交到队列并等待结果
+
+启动: python src/synthesis_daemon.py run --workers 2
+查看: python src/synthesis_daemon.py list / status <任务ID> / cancel <任务ID>
+"""
+
+import sys
+import time
+import signal
+import argparse
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+try:
+    from loguru import logger
+except ImportError:
+    import logging
+    logger = logging.getLogger(__name__)
+
+from config import config
+from job_queue import (JOB_KINDS, KIND_CHAPTER, KIND_STORY, KIND_TEXT, STATUS_DONE, STATUS_QUEUED, Job, JobQueue,
+                       submit_and_wait, worker_name)
+from script_to_audio import ScriptToAudioConverter
+from story_tts import StoryTTSProcessor
+
+# 没有可执行的任务时再次查询的间隔（秒）
+IDLE_POLL_SECONDS = 0.5
+
+
+class SynthesisDaemon:
+    """
+    合成守护进程
+
+    workers个线程同时领取任务；所有章节任务共用转换器（及其请求线程池作为全局请求预算），
+    故事任务共用一个处理器并逐个执行，文本任务直接使用转换器的TTS客户端
+    """
+
+    def __init__(self, queue: Optional[JobQueue] = None, workers: Optional[int] = None,
+                 concurrency: Optional[int] = None):
+        """
+        初始化守护进程（加载角色配置、创建TTS客户端）
+
+        Args:
+            queue: 任务队列，默认按配置JOB_QUEUE_DB打开
+            workers: 同时执行的任务数，默认读取配置DAEMON_WORKERS
+            concurrency: 所有章节任务共享的最大TTS请求数，默认读取配置TTS_CONCURRENCY
+        """
+        config.validate()
+        self.queue = queue or JobQueue()
+        self.workers = max(1, config.DAEMON_WORKERS if workers is None else workers)
+        self.concurrency = max(1, config.TTS_CONCURRENCY if concurrency is None else concurrency)
+        self.name = worker_name()
+
+        # 按是否使用PCM流水线分别创建转换器（默认配置的转换器立即创建，保持连接就绪）
+        self._converters: Dict[bool, ScriptToAudioConverter] = {}
+        self._converters_lock = threading.Lock()
+        self._converter(None)
+        self._story_processor: Optional[StoryTTSProcessor] = None
+        self._story_lock = threading.Lock()
+
+        self._handlers: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+            KIND_CHAPTER: self._run_chapter,
+            KIND_STORY: self._run_story,
+            KIND_TEXT: self._run_text
+        }
+        self._stop = threading.Event()
+        self._running: Dict[int, Job] = {}
+        self._running_lock = threading.Lock()
+        self.completed_jobs = 0
+        self.failed_jobs = 0
+
+    def _converter(self, pcm: Optional[bool]) -> ScriptToAudioConverter:
+        """取得（或创建）对应PCM流水线设置的转换器"""
+        pcm = config.TTS_PCM_PIPELINE if pcm is None else pcm
+        with self._converters_lock:
+            converter = self._converters.get(pcm)
+            if converter is None:
+                request_workers = self.concurrency if self.concurrency > 1 else None
+                converter = ScriptToAudioConverter(request_workers=request_workers, pcm_pipeline=pcm)
+                self._converters[pcm] = converter
+            return converter
+
+    def run(self):
+        """领取并执行任务，直到调用stop()（或收到SIGINT/SIGTERM）"""
+        self.queue.requeue_stale()
+        self.queue.heartbeat(self.name)
+        logger.info(f"合成守护进程 {self.name} 已启动：{self.workers} 个任务线程，"
+                    f"最多 {self.concurrency} 个并发请求，队列 {self.queue.path}")
+
+        threads = [threading.Thread(target=self._work_loop, name=f"job-worker-{i}") for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        try:
+            interval = max(1.0, config.JOB_STALE_SECONDS / 4)
+            while not self._stop.wait(interval):
+                with self._running_lock:
+                    running = list(self._running)
+                self.queue.heartbeat(self.name, running)
+                self.queue.requeue_stale()
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            self.queue.unregister(self.name)
+            self.close()
+            logger.info(f"合成守护进程已退出（完成 {self.completed_jobs} 个任务，失败 {self.failed_jobs} 次）")
+
+    def stop(self):
+        """停止领取新任务，正在执行的任务完成后退出"""
+        if not self._stop.is_set():
+            logger.info("正在停止，等待执行中的任务完成...")
+            self._stop.set()
+
+    def close(self):
+        """释放转换器、处理器和它们持有的连接"""
+        for converter in self._converters.values():
+            converter.close()
+        self._converters.clear()
+        if self._story_processor is not None:
+            self._story_processor.close()
+            self._story_processor = None
+
+    def _work_loop(self):
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim(self.name)
+            except Exception as e:
+                logger.error(f"领取任务失败: {e}")
+                job = None
+            if job is None:
+                self._stop.wait(IDLE_POLL_SECONDS)
+                continue
+            with self._running_lock:
+                self._running[job.id] = job
+            try:
+                self._execute(job)
+            finally:
+                with self._running_lock:
+                    self._running.pop(job.id, None)
+
+    def _execute(self, job: Job):
+        """执行一个任务并把结果写回队列"""
+        logger.info(f"开始任务 #{job.id}（{job.kind}，第 {job.attempts}/{job.max_attempts} 次尝试）")
+        started = time.perf_counter()
+        try:
+            result = self._handlers[job.kind](job.payload)
+        except Exception as e:
+            logger.error(f"任务 #{job.id} 异常: {e}")
+            result = {'success': False, 'error': f"{type(e).__name__}: {e}"}
+        result['seconds'] = round(time.perf_counter() - started, 3)
+
+        if result.get('success'):
+            self.queue.complete(job.id, result)
+            self.completed_jobs += 1
+            logger.info(f"任务 #{job.id} 完成，用时 {result['seconds']:.1f} 秒")
+            return
+        self.failed_jobs += 1
+        error = result.get('error') or "转换失败，详见守护进程日志"
+        if self.queue.fail(job.id, error, result):
+            logger.warning(f"任务 #{job.id} 失败，稍后重试: {error}")
+        else:
+            logger.error(f"任务 #{job.id} 失败: {error}")
+
+    def _run_chapter(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """章节任务：与 script_to_audio / batch_convert_stories 相同的转换"""
+        converter = self._converter(payload.get('pcm'))
+        output_file = payload['output_file']
+        Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+        success = converter.convert_script_to_audio(
+            input_file=payload['input_file'],
+            output_file=output_file,
+            max_conversations=payload.get('max_conversations', 0),
+            concurrency=payload.get('concurrency') or self.concurrency,
+            pack=payload.get('pack'),
+            hls=payload.get('hls'),
+            normalize=payload.get('normalize')
+        )
+        return {'success': success, 'output_file': output_file}
+
+    def _run_story(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """故事任务：与 StoryTTSProcessor.batch_process_story 相同，逐个执行"""
+        with self._story_lock:
+            if self._story_processor is None:
+                self._story_processor = StoryTTSProcessor()
+            results = self._story_processor.batch_process_story(payload['story_dir'], payload['output_base_dir'])
+        failed = [chapter for chapter, ok in results.items() if not ok]
+        result = {'success': bool(results) and not failed, 'chapters': results}
+        if failed:
+            result['error'] = f"{len(failed)} 个章节失败: {', '.join(failed)}"
+        elif not results:
+            result['error'] = "没有找到章节文件"
+        return result
+
+    def _run_text(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """文本任务：与 main.py 相同，把整个文本文件合成为一个音频文件"""
+        with open(payload['input_file'], 'r', encoding='utf-8') as f:
+            text = f.read().strip()
+        if not text:
+            return {'success': False, 'error': "文件内容为空"}
+        client = self._converter(None).tts_client
+        success = client.synthesize_to_file(text, payload['output_file'], voice_type=payload.get('voice_type'),
+                                            speed_ratio=payload.get('speed_ratio'),
+                                            use_websocket=payload.get('use_websocket', False))
+        return {'success': success, 'output_file': payload['output_file']}
+
+
+def _format_job(job: Job) -> str:
+    target = job.payload.get('output_file') or job.payload.get('story_dir') or ''
+    line = f"#{job.id:<5} {job.kind:<8} {job.status:<10} 优先级 {job.priority:<3} 尝试 {job.attempts}/{job.max_attempts}  {target}"
+    if job.error and job.status != STATUS_DONE:
+        line += f"\n       错误: {job.error}"
+    return line
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="合成守护进程与任务队列")
+    parser.add_argument("--db", help="任务队列数据库（默认读取JOB_QUEUE_DB）")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="启动守护进程")
+    run.add_argument("--workers", type=int, help="同时执行的任务数（默认读取DAEMON_WORKERS）")
+    run.add_argument("--concurrency", type=int, help="所有章节任务共享的最大TTS请求数（默认读取TTS_CONCURRENCY）")
+
+    submit = commands.add_parser("submit", help="提交任务")
+    submit.add_argument("kind", choices=JOB_KINDS, help="任务类型")
+    submit.add_argument("input", help="剧本文件（chapter）、故事目录（story）或文本文件（text）")
+    submit.add_argument("output", help="输出音频文件（chapter/text）或输出根目录（story）")
+    submit.add_argument("--priority", type=int, default=0, help="优先级，数值大的先执行")
+    submit.add_argument("--no-wait", action="store_true", help="提交后立即返回，不等待结果")
+
+    commands.add_parser("list", help="列出最近的任务")
+    status = commands.add_parser("status", help="查看任务状态")
+    status.add_argument("job_id", type=int)
+    cancel = commands.add_parser("cancel", help="取消尚未开始的任务")
+    cancel.add_argument("job_id", type=int)
+
+    args = parser.parse_args()
+    queue = JobQueue(args.db)
+
+    if args.command == "run":
+        daemon = SynthesisDaemon(queue, args.workers, args.concurrency)
+        signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+        signal.signal(signal.SIGINT, lambda signum, frame: daemon.stop())
+        daemon.run()
+    elif args.command == "submit":
+        input_path, output_path = str(Path(args.input).resolve()), str(Path(args.output).resolve())
+        if args.kind == KIND_STORY:
+            payload = {'story_dir': input_path, 'output_base_dir': output_path}
+        else:
+            payload = {'input_file': input_path, 'output_file': output_path}
+        jobs = submit_and_wait(queue, args.kind, [payload], args.priority, wait=not args.no_wait)
+        sys.exit(0 if all(job.status in (STATUS_QUEUED, STATUS_DONE) for job in jobs) else 1)
+    elif args.command == "list":
+        counts = queue.counts()
+        print("，".join(f"{status}: {count}" for status, count in counts.items()) or "队列为空")
+        print(f"运行中的守护进程: {', '.join(queue.active_workers()) or '无'}")
+        for job in queue.list():
+            print(_format_job(job))
+    elif args.command == "status":
+        job = queue.get(args.job_id)
+        if job is None:
+            print(f"任务不存在: {args.job_id}")
+            sys.exit(1)
+        print(_format_job(job))
+        if job.result:
+            print(f"       结果: {job.result}")
+    elif args.command == "cancel":
+        if not queue.cancel(args.job_id):
+            print(f"任务 {args.job_id} 不存在或已开始执行，无法取消")
+            sys.exit(1)
+        print(f"已取消任务 {args.job_id}")
+
+
+if __name__ == "__main__":
+    main()
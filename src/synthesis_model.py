@@ -0,0 +1,283 @@
+"""
+合成耗时模型
+客户端每次成功请求后按（音色, 语速）记录文本字节数、请求耗时和音频时长，
+用指数加权的最小二乘拟合 耗时 ≈ 固定开销 + 每字节耗时 × 字节数，音频时长按每字节秒数估计。
+调度方据此把预计最长的片段和章节先派发（避免一个很长的旁白块排在最后拖住整批），
+并给出比“每分钟200字”更接近实际的预计时长
+"""
+
+import os
+import json
+import tempfile
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    from loguru import logger
+except ImportError:
+    import logging
+    logger = logging.getLogger(__name__)
+
+from config import config
+from mp3_frames import Mp3FormatError, iter_frames
+from pcm_audio import PcmFormatError, is_wav, parse_wav
+
+# 所有音色合并的统计，某个音色样本不足时使用
+GLOBAL_KEY = '*'
+# 每记录一次，旧样本的权重乘以该系数（约200次请求后旧样本的影响减半），服务端变慢或变快时能跟上
+DECAY = 0.9965
+# 样本权重不足时退回到全局统计或先验
+MIN_WEIGHT = 3.0
+# 没有任何样本时的先验：每次请求0.5秒固定开销加每字节3毫秒；
+# 音频每字节0.1秒（每分钟约200个汉字，UTF-8每个汉字3字节）
+PRIOR_LATENCY_BASE = 0.5
+PRIOR_LATENCY_PER_BYTE = 0.003
+PRIOR_SECONDS_PER_BYTE = 0.1
+
+# 每个键保存的加权和：权重、Σx、Σx²、Σ耗时、Σx·耗时，以及有音频时长的样本的Σx和Σ时长
+_FIELDS = ('w', 'sx', 'sxx', 'sy', 'sxy', 'dx', 'dy')
+
+
+@dataclass(frozen=True)
+class SynthesisEstimate:
+    """一段文本的预计合成耗时和音频时长（秒）"""
+    latency: float
+    audio_seconds: float
+
+
+@dataclass(frozen=True)
+class WorkEstimate:
+    """一个章节（或一批章节）的预计工作量"""
+    requests: int = 0
+    # 所有待合成请求的预计耗时之和，以及其中最长的一个（秒）
+    work_seconds: float = 0.0
+    longest_seconds: float = 0.0
+    audio_seconds: float = 0.0
+
+    def eta(self, concurrency: int) -> float:
+        """按最长优先调度时的预计墙钟时间：总工作量除以并发数，但不少于最长的一个请求"""
+        return max(self.longest_seconds, self.work_seconds / max(1, concurrency))
+
+    def __add__(self, other: 'WorkEstimate') -> 'WorkEstimate':
+        return WorkEstimate(self.requests + other.requests, self.work_seconds + other.work_seconds,
+                            max(self.longest_seconds, other.longest_seconds),
+                            self.audio_seconds + other.audio_seconds)
+
+
+def audio_duration(data) -> Optional[float]:
+    """
+    计算音频时长：WAV按采样数，MP3按帧数
+
+    Args:
+        data: 完整的WAV或MP3数据
+
+    Returns:
+        Optional[float]: 时长（秒），无法解析时返回None
+    """
+    try:
+        if is_wav(data):
+            fmt, _, length = parse_wav(data)
+            return length / fmt.block_align / fmt.sample_rate
+        return sum(header.duration for header, _ in iter_frames(data)) or None
+    except (Mp3FormatError, PcmFormatError):
+        return None
+
+
+class SynthesisTimeModel:
+    """
+    按（音色, 语速）学习的合成耗时模型（线程安全）
+
+    记录在内存中更新，调用save()时写入磁盘（跨运行复用）
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        初始化模型
+
+        Args:
+            path: 模型文件路径，默认读取配置SYNTHESIS_MODEL_FILE
+        """
+        self.path = Path(path or config.SYNTHESIS_MODEL_FILE)
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = self._load()
+        self._dirty = False
+
+    @staticmethod
+    def model_key(voice_type: Optional[str], speed_ratio: Optional[float] = None) -> str:
+        """模型的键：音色@语速（未指定时使用配置默认值）"""
+        voice = voice_type or config.TTS_VOICE_TYPE
+        speed = speed_ratio or config.TTS_SPEED_RATIO
+        return f"{voice}@{float(speed):g}"
+
+    def _load(self) -> Dict[str, Dict[str, float]]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                stats = json.load(f)
+            if not isinstance(stats, dict):
+                return {}
+            return {key: {field: float(value.get(field, 0.0)) for field in _FIELDS}
+                    for key, value in stats.items() if isinstance(value, dict)}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"读取合成耗时模型失败，重新学习: {e}")
+            return {}
+
+    def save(self):
+        """把有更新的模型写入磁盘（先写临时文件再原子替换）"""
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = json.dumps(self._stats, indent=1)
+            self._dirty = False
+        with self._save_lock:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=f".{self.path.name}.", suffix='.tmp')
+                try:
+                    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                        f.write(payload)
+                    os.replace(tmp_path, self.path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.unlink(tmp_path)
+            except OSError as e:
+                logger.warning(f"保存合成耗时模型失败: {e}")
+
+    def record(self, voice_type: Optional[str], speed_ratio: Optional[float], text_bytes: int,
+               latency: float, audio_seconds: Optional[float] = None):
+        """
+        记录一次成功的请求
+
+        Args:
+            voice_type: 音色
+            speed_ratio: 语速
+            text_bytes: 请求文本的UTF-8字节数
+            latency: 请求耗时（秒，不含排队）
+            audio_seconds: 返回音频的时长（秒），未知时为None
+        """
+        if text_bytes <= 0 or latency <= 0:
+            return
+        x = float(text_bytes)
+        with self._lock:
+            for key in (self.model_key(voice_type, speed_ratio), GLOBAL_KEY):
+                stats = self._stats.setdefault(key, dict.fromkeys(_FIELDS, 0.0))
+                for field in _FIELDS:
+                    stats[field] *= DECAY
+                stats['w'] += 1
+                stats['sx'] += x
+                stats['sxx'] += x * x
+                stats['sy'] += latency
+                stats['sxy'] += x * latency
+                if audio_seconds:
+                    stats['dx'] += x
+                    stats['dy'] += audio_seconds
+            self._dirty = True
+
+    @staticmethod
+    def _fit_latency(stats: Dict[str, float]):
+        """加权最小二乘拟合(固定开销, 每字节耗时)，两者都不为负"""
+        w = stats['w']
+        mean_x, mean_y = stats['sx'] / w, stats['sy'] / w
+        variance = stats['sxx'] / w - mean_x * mean_x
+        if variance > 1e-6 * max(mean_x * mean_x, 1.0):
+            slope = (stats['sxy'] / w - mean_x * mean_y) / variance
+            if slope >= 0:
+                base = mean_y - slope * mean_x
+                if base >= 0:
+                    return base, slope
+                # 截距为负时改为过原点拟合
+                return 0.0, stats['sxy'] / stats['sxx']
+        # 文本长度几乎相同或耗时随长度减少：只能估计平均耗时
+        return mean_y, 0.0
+
+    def _usable(self, key: str, weight_field: str) -> Optional[Dict[str, float]]:
+        """某个键的统计，样本不足时退回到全局统计，都不足时返回None（调用方需持有锁）"""
+        for candidate in (key, GLOBAL_KEY):
+            stats = self._stats.get(candidate)
+            if stats is not None and stats[weight_field] >= (MIN_WEIGHT if weight_field == 'w' else 1.0):
+                return stats
+        return None
+
+    def estimate(self, voice_type: Optional[str], speed_ratio: Optional[float], text_bytes: int) -> SynthesisEstimate:
+        """
+        估计一段文本的合成耗时和音频时长
+
+        Args:
+            voice_type: 音色
+            speed_ratio: 语速
+            text_bytes: 文本的UTF-8字节数
+
+        Returns:
+            SynthesisEstimate: 预计的请求耗时和音频时长（秒）
+        """
+        key = self.model_key(voice_type, speed_ratio)
+        with self._lock:
+            stats = self._usable(key, 'w')
+            base, per_byte = self._fit_latency(stats) if stats else (PRIOR_LATENCY_BASE, PRIOR_LATENCY_PER_BYTE)
+            stats = self._usable(key, 'dx')
+            seconds_per_byte = stats['dy'] / stats['dx'] if stats else PRIOR_SECONDS_PER_BYTE
+        return SynthesisEstimate(base + per_byte * text_bytes, seconds_per_byte * text_bytes)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        各音色当前的模型参数
+
+        Returns:
+            Dict[str, Dict[str, float]]: 音色@语速 -> 样本权重、固定开销(ms)、每KB耗时(ms)、每KB音频秒数
+        """
+        result = {}
+        with self._lock:
+            for key, stats in self._stats.items():
+                if stats['w'] <= 0:
+                    continue
+                base, per_byte = self._fit_latency(stats)
+                result[key] = {
+                    'samples': round(stats['w'], 1),
+                    'base_ms': round(base * 1000, 1),
+                    'per_kb_ms': round(per_byte * 1024 * 1000, 1),
+                    'audio_per_kb_s': round(stats['dy'] / stats['dx'] * 1024, 1) if stats['dx'] else None
+                }
+        return result
+
+
+def longest_first(costs: List[float], block: int) -> List[int]:
+    """
+    最长优先的派发顺序：按block个一组，组内按预计耗时从长到短排列
+
+    分组保证按序写出时重排窗口（大小不小于block）不会被尚未派发的前序片段卡住
+
+    Args:
+        costs: 每项的预计耗时
+        block: 分组大小，不大于1时保持原顺序
+
+    Returns:
+        List[int]: 派发顺序（项的下标）
+    """
+    if block <= 1:
+        return list(range(len(costs)))
+    order = []
+    for start in range(0, len(costs), block):
+        order.extend(sorted(range(start, min(start + block, len(costs))), key=lambda i: -costs[i]))
+    return order
+
+
+_shared_model: Optional[SynthesisTimeModel] = None
+_shared_lock = threading.Lock()
+
+
+def get_synthesis_model() -> SynthesisTimeModel:
+    """
+    获取进程内共享的合成耗时模型（按配置创建）
+
+    Returns:
+        SynthesisTimeModel: 共享实例
+    """
+    global _shared_model
+    with _shared_lock:
+        if _shared_model is None:
+            _shared_model = SynthesisTimeModel()
+        return _shared_model
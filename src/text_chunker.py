@@ -0,0 +1,76 @@
+"""
+按UTF-8字节数切分长文本
+优先在句末切分并保留原标点（问句、感叹句的语调不变）；单句超长时退到分句（，；、和空白）切分，
+仍超长时按字符切分并与前后内容装进同一段，保证每段都不超过字节上限，且段数最少
+"""
+
+import re
+from typing import Iterator, List
+
+# 句末标点之后的引号和括号
+_CLOSERS = r'[”’"\'」』）)]'
+# 句子：到句末标点为止，包括紧随其后的引号、括号和空白；
+# 英文句点只有后面是空白、引号、括号或文本结尾时才算句末（3.14、e.g不切开）
+_SENTENCE = re.compile(r'(?:[^。！？!?….]|\.(?![.\s”’"\'」』）)]|$))*'
+                       r'(?:(?:[。！？!?…]+|\.+)' + _CLOSERS + r'*\s*|$)')
+# 分句：到逗号、分号、顿号、冒号或空白为止（英文按单词切分）
+_CLAUSE = re.compile(r'[^，,；;、：:\s]*(?:[，,；;、：:\s]+|$)')
+
+
+def utf8_len(text: str) -> int:
+    """文本的UTF-8字节数"""
+    return len(text.encode('utf-8'))
+
+
+def _split(pattern: re.Pattern, text: str) -> List[str]:
+    return [piece for piece in pattern.findall(text) if piece]
+
+
+def _pieces(text: str, max_bytes: int) -> Iterator[str]:
+    """切成不超过上限的最小单位：句子，超长时为分句，仍超长时为单个字符"""
+    for sentence in _split(_SENTENCE, text):
+        if utf8_len(sentence) <= max_bytes:
+            yield sentence
+            continue
+        for clause in _split(_CLAUSE, sentence):
+            if utf8_len(clause) <= max_bytes:
+                yield clause
+            else:
+                # 逐字符交给装箱，硬切的部分可以和前面未装满的段合在一起
+                yield from clause
+
+
+def split_text(text: str, max_bytes: int) -> List[str]:
+    """
+    把文本切成不超过字节上限的若干段
+
+    Args:
+        text: 原文本
+        max_bytes: 每段的UTF-8字节上限
+
+    Returns:
+        List[str]: 按顺序排列的文本段，拼接后与原文本（去掉首尾空白）一致；
+            不超过上限的文本原样返回一段
+    """
+    text = text.strip()
+    if not text:
+        return []
+    if utf8_len(text) <= max_bytes:
+        return [text]
+
+    # 按顺序贪心装箱（切分点只能在单位之间时，贪心得到的段数最少）
+    chunks = []
+    current = ''
+    current_size = 0
+    for piece in _pieces(text, max_bytes):
+        piece_size = utf8_len(piece)
+        if current and current_size + piece_size > max_bytes:
+            chunks.append(current)
+            current, current_size = '', 0
+        current += piece
+        current_size += piece_size
+    if current:
+        chunks.append(current)
+
+    # 切分点后的空白不单独发送
+    return [chunk.strip() for chunk in chunks if chunk.strip()]
@@ -0,0 +1,220 @@
+"""
+TTS音频磁盘缓存
+按 (文本, 音色, 语速, 编码, 集群) 的哈希寻址，总大小超过上限时按LRU淘汰
+"""
+
+import os
+import re
+import json
+import hashlib
+import unicodedata
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional, Dict, List, Tuple
+
+try:
+    from loguru import logger
+except ImportError:
+    import logging
+    logger = logging.getLogger(__name__)
+
+from config import config
+from tts_response import AudioBuffer
+
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_text(text: str) -> str:
+    """
+    规范化合成文本，用于判断两段文本是否会合成出相同的音频
+
+    统一全角/半角（NFKC）、合并连续空白并去掉首尾空白
+    """
+    return _WHITESPACE.sub(' ', unicodedata.normalize('NFKC', text)).strip()
+
+
+class TTSCache:
+    """内容寻址的TTS音频缓存，多线程/多进程并发读写安全"""
+
+    # 淘汰时清理到上限的这个比例以下，避免每次写入都触发淘汰
+    EVICT_LOW_WATERMARK = 0.9
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None):
+        """
+        初始化缓存
+
+        Args:
+            cache_dir: 缓存目录，默认读取配置TTS_CACHE_DIR
+            max_bytes: 缓存总大小上限（字节），默认读取配置TTS_CACHE_MAX_MB
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir else Path(config.TTS_CACHE_DIR)
+        self.max_bytes = max_bytes if max_bytes is not None else int(config.TTS_CACHE_MAX_MB * 1024 * 1024)
+
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(text: str, voice_type: str, speed_ratio: float, encoding: str, cluster: str) -> str:
+        """
+        计算缓存键（文本先规范化，仅全半角或空白不同的文本共用同一个键）
+
+        Args:
+            text: 合成文本
+            voice_type: 音色类型
+            speed_ratio: 语速比例
+            encoding: 音频编码格式
+            cluster: TTS集群
+
+        Returns:
+            str: SHA-256十六进制摘要
+        """
+        payload = json.dumps([normalize_text(text), voice_type, float(speed_ratio), encoding, cluster],
+                             ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        """缓存文件路径（按前两位分桶，避免单目录文件过多）"""
+        return self.cache_dir / key[:2] / key
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        读取缓存
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            Optional[bytes]: 命中返回音频数据，未命中返回None
+        """
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            # 更新修改时间，作为LRU的访问时间
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except OSError as e:
+            logger.warning(f"读取缓存失败 {key[:12]}: {e}")
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        logger.debug(f"缓存命中 {key[:12]}，大小: {len(data)} bytes")
+        return data
+
+    def put(self, key: str, data: AudioBuffer):
+        """
+        写入缓存（先写临时文件再原子替换）
+
+        Args:
+            key: 缓存键
+            data: 音频数据
+        """
+        if not data or len(data) > self.max_bytes:
+            return
+
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{key[:12]}.", suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                # 覆盖已有条目时，总大小只增加差值
+                try:
+                    replaced_bytes = path.stat().st_size
+                except FileNotFoundError:
+                    replaced_bytes = 0
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            logger.warning(f"写入缓存失败 {key[:12]}: {e}")
+            return
+
+        with self._lock:
+            self.writes += 1
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_total_bytes()
+            else:
+                self._total_bytes += len(data) - replaced_bytes
+            need_evict = self._total_bytes > self.max_bytes
+
+        if need_evict:
+            self._evict()
+
+    def _list_entries(self) -> List[Tuple[float, int, Path]]:
+        """列出所有缓存文件: [(修改时间, 大小, 路径)]"""
+        entries = []
+        if not self.cache_dir.exists():
+            return entries
+        for bucket in self.cache_dir.iterdir():
+            if not bucket.is_dir():
+                continue
+            for path in bucket.iterdir():
+                if path.name.startswith('.'):
+                    continue
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _scan_total_bytes(self) -> int:
+        """统计缓存目录总大小"""
+        return sum(size for _, size, _ in self._list_entries())
+
+    def _evict(self):
+        """按最近访问时间淘汰最旧的缓存文件，直到低于水位线"""
+        with self._lock:
+            # 重新扫描，其他进程可能也在写入或淘汰
+            entries = self._list_entries()
+            entries.sort()
+            total = sum(size for _, size, _ in entries)
+            target = int(self.max_bytes * self.EVICT_LOW_WATERMARK)
+
+            removed = 0
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+
+            self._total_bytes = total
+            self.evictions += removed
+
+        if removed:
+            logger.info(f"缓存超过上限，已淘汰 {removed} 个文件，当前大小: {total / 1024 / 1024:.1f} MB")
+
+    def stats(self) -> Dict[str, int]:
+        """
+        获取缓存统计信息
+
+        Returns:
+            Dict[str, int]: 命中、未命中、写入、淘汰次数
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'writes': self.writes,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,350 @@
+"""
+TTS请求的结构化计时指标
+每次请求记录排队、取得连接（新建或复用）、首字节、下载响应体、JSON解析和base64解码各阶段的耗时，
+连同文本长度、音色和结果分类汇总为直方图和计数器；运行结束时可导出JSON，
+长时间的批量转换中也可以通过HTTP以Prometheus文本格式抓取
+"""
+
+import json
+import time
+import bisect
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import aiohttp
+
+try:
+    from loguru import logger
+except ImportError:
+    import logging
+    logger = logging.getLogger(__name__)
+
+# 请求结果分类
+OUTCOME_OK = 'ok'
+OUTCOME_THROTTLED = 'throttled'        # HTTP 429或并发超限
+OUTCOME_SERVER_ERROR = 'server_error'  # 服务端错误（5xx或可重试的业务码）
+OUTCOME_NETWORK = 'network'            # 连接失败、超时等，没有收到响应
+OUTCOME_CLIENT_ERROR = 'client_error'  # 认证失败、请求无效等不可重试的错误
+OUTCOME_ERROR = 'error'                # 其他异常（如请求被取消）
+
+# 请求的各个阶段，total为从取得并发名额到结束的总耗时（不含排队）
+PHASES = ('queue_wait', 'connect', 'ttfb', 'download', 'parse', 'decode', 'total')
+
+# 耗时直方图的桶上界（秒）和文本长度直方图的桶上界（UTF-8字节）
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.4, 0.5,
+                   0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0, 30.0, 60.0)
+TEXT_BYTES_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048)
+
+
+@dataclass
+class RequestTiming:
+    """单次请求（一次尝试）的计时，各阶段单位为秒"""
+    voice: str = ''
+    text_bytes: int = 0
+    queue_wait: float = 0.0
+    # 等待连接池空位和新建连接（DNS、TCP、TLS）的时间，复用连接时接近0
+    connect: float = 0.0
+    connection_reused: Optional[bool] = None
+    # 发出请求到收到响应头（WebSocket为收到第一个音频分片）
+    ttfb: float = 0.0
+    download: float = 0.0
+    parse: float = 0.0
+    decode: float = 0.0
+    total: float = 0.0
+    status: Optional[int] = None
+    audio_bytes: int = 0
+    # 服务端在addition.duration中报告的音频时长（秒），没有时为None
+    audio_seconds: Optional[float] = None
+    outcome: str = OUTCOME_ERROR
+    # aiohttp跟踪回调使用的时间点
+    request_started: float = 0.0
+
+
+class Histogram:
+    """固定桶的直方图（非线程安全，由TTSMetrics加锁）"""
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        # 最后一个桶为+Inf
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """按桶内线性插值估计分位数（q取0~1），结果限制在观测到的最小值和最大值之间"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                lower = self.bounds[i - 1] if i else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.max
+                estimate = lower + (upper - lower) * (rank - cumulative) / bucket_count
+                return min(max(estimate, self.min), self.max)
+            cumulative += bucket_count
+        return self.max
+
+    def cumulative_buckets(self) -> List[Tuple[str, int]]:
+        """Prometheus格式的累计桶：[(上界, 累计数)]，最后一个为+Inf"""
+        buckets = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.bounds + (float('inf'),), self.counts):
+            cumulative += bucket_count
+            buckets.append(('+Inf' if bound == float('inf') else f"{bound:g}", cumulative))
+        return buckets
+
+    def summary(self, scale: float = 1.0, digits: int = 1) -> Dict[str, Any]:
+        """数量、平均值和p50/p95/p99估计，数值乘以scale（例如秒转毫秒）"""
+        return {
+            'count': self.count,
+            'mean': round(self.sum / self.count * scale, digits) if self.count else 0.0,
+            'p50': round(self.quantile(0.50) * scale, digits),
+            'p95': round(self.quantile(0.95) * scale, digits),
+            'p99': round(self.quantile(0.99) * scale, digits),
+            'max': round(self.max * scale, digits)
+        }
+
+
+class TTSMetrics:
+    """
+    TTS请求指标的汇总（线程安全）
+
+    进程内的所有客户端默认共享同一个实例（见get_metrics），
+    批量转换结束时导出或在运行期间通过start_metrics_server抓取
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """清空所有指标"""
+        with self._lock:
+            self._phases: Dict[str, Histogram] = {phase: Histogram(SECONDS_BUCKETS) for phase in PHASES}
+            # 按(音色, 结果)统计的总耗时，count即为请求数
+            self._requests: Dict[Tuple[str, str], Histogram] = {}
+            self._text_bytes = Histogram(TEXT_BYTES_BUCKETS)
+            self._connections = {'new': 0, 'reused': 0}
+            self._audio_bytes = 0
+
+    def record(self, timing: RequestTiming):
+        """
+        记录一次请求
+
+        Args:
+            timing: 请求计时；只有成功的请求计入下载、解析和解码阶段
+        """
+        with self._lock:
+            self._phases['queue_wait'].observe(timing.queue_wait)
+            self._phases['total'].observe(timing.total)
+            if timing.status is not None or timing.outcome == OUTCOME_OK:
+                self._phases['connect'].observe(timing.connect)
+                self._phases['ttfb'].observe(timing.ttfb)
+            if timing.outcome == OUTCOME_OK:
+                for phase in ('download', 'parse', 'decode'):
+                    self._phases[phase].observe(getattr(timing, phase))
+                self._audio_bytes += timing.audio_bytes
+
+            key = (timing.voice, timing.outcome)
+            if key not in self._requests:
+                self._requests[key] = Histogram(SECONDS_BUCKETS)
+            self._requests[key].observe(timing.total)
+            self._text_bytes.observe(timing.text_bytes)
+            if timing.connection_reused is not None:
+                self._connections['reused' if timing.connection_reused else 'new'] += 1
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        获取汇总结果（耗时单位为毫秒）
+
+        Returns:
+            Dict[str, Any]: 各阶段耗时分布、按结果和音色的请求数、连接复用、文本长度和音频字节数
+        """
+        with self._lock:
+            outcomes: Dict[str, int] = {}
+            voices: Dict[str, Dict[str, Any]] = {}
+            for (voice, outcome), histogram in sorted(self._requests.items()):
+                outcomes[outcome] = outcomes.get(outcome, 0) + histogram.count
+                voice_stats = voices.setdefault(voice, {'requests': 0, 'outcomes': {}})
+                voice_stats['requests'] += histogram.count
+                voice_stats['outcomes'][outcome] = histogram.count
+                if outcome == OUTCOME_OK:
+                    voice_stats['latency_ms'] = histogram.summary(1000)
+            return {
+                'requests': sum(outcomes.values()),
+                'outcomes': outcomes,
+                'phases_ms': {phase: histogram.summary(1000) for phase, histogram in self._phases.items()},
+                'connections': dict(self._connections),
+                'text_bytes': self._text_bytes.summary(),
+                'audio_bytes': self._audio_bytes,
+                'voices': voices
+            }
+
+    def dump_json(self, path: str):
+        """把汇总结果写入JSON文件"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+        logger.info(f"请求指标已写入: {path}")
+
+    def prometheus_text(self) -> str:
+        """Prometheus文本格式（0.0.4）的指标"""
+        lines: List[str] = []
+        with self._lock:
+            lines += _histogram_lines('tts_request_phase_seconds', '单次TTS请求各阶段的耗时',
+                                      [({'phase': phase}, h) for phase, h in self._phases.items()])
+            lines += _histogram_lines('tts_request_seconds', '按音色和结果分类的TTS请求总耗时',
+                                      [({'voice': voice, 'outcome': outcome}, h)
+                                       for (voice, outcome), h in sorted(self._requests.items())])
+            lines += _histogram_lines('tts_request_text_bytes', 'TTS请求文本的UTF-8字节数',
+                                      [({}, self._text_bytes)])
+            lines += ['# HELP tts_connections_total 请求使用的HTTP连接（新建或复用）',
+                      '# TYPE tts_connections_total counter']
+            lines += [f'tts_connections_total{_labels({"kind": kind})} {count}'
+                      for kind, count in self._connections.items()]
+            lines += ['# HELP tts_audio_bytes_total 成功返回的音频字节数',
+                      '# TYPE tts_audio_bytes_total counter',
+                      f'tts_audio_bytes_total {self._audio_bytes}']
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _histogram_lines(name: str, help_text: str,
+                     series: List[Tuple[Dict[str, str], Histogram]]) -> List[str]:
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+    for labels, histogram in series:
+        for bound, cumulative in histogram.cumulative_buckets():
+            lines.append(f'{name}_bucket{_labels({**labels, "le": bound})} {cumulative}')
+        lines.append(f'{name}_sum{_labels(labels)} {histogram.sum:.6f}')
+        lines.append(f'{name}_count{_labels(labels)} {histogram.count}')
+    return lines
+
+
+def create_trace_config() -> aiohttp.TraceConfig:
+    """
+    创建aiohttp跟踪配置：请求时以trace_request_ctx传入RequestTiming，
+    回调记录等待连接池、新建或复用连接以及收到响应头的时间
+    """
+    async def on_request_start(session, ctx, params):
+        if ctx.trace_request_ctx is not None:
+            ctx.trace_request_ctx.request_started = time.perf_counter()
+
+    async def on_phase_start(session, ctx, params):
+        ctx.phase_started = time.perf_counter()
+
+    async def on_phase_end(session, ctx, params):
+        if ctx.trace_request_ctx is not None:
+            ctx.trace_request_ctx.connect += time.perf_counter() - ctx.phase_started
+
+    async def on_connection_create_end(session, ctx, params):
+        await on_phase_end(session, ctx, params)
+        if ctx.trace_request_ctx is not None:
+            ctx.trace_request_ctx.connection_reused = False
+
+    async def on_connection_reuseconn(session, ctx, params):
+        if ctx.trace_request_ctx is not None:
+            ctx.trace_request_ctx.connection_reused = True
+
+    async def on_request_end(session, ctx, params):
+        # 收到响应头时触发；首字节时间不含等待和建立连接
+        timing = ctx.trace_request_ctx
+        if timing is not None:
+            timing.ttfb = time.perf_counter() - timing.request_started - timing.connect
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_connection_queued_start.append(on_phase_start)
+    trace_config.on_connection_queued_end.append(on_phase_end)
+    trace_config.on_connection_create_start.append(on_phase_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """/metrics 返回Prometheus文本格式，/metrics.json 返回JSON汇总"""
+    metrics: 'TTSMetrics'
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/metrics':
+            body = self.metrics.prometheus_text().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif path == '/metrics.json':
+            body = json.dumps(self.metrics.summary(), ensure_ascii=False).encode('utf-8')
+            content_type = 'application/json; charset=utf-8'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 抓取很频繁，不输出访问日志
+        pass
+
+
+def start_metrics_server(port: int, metrics: Optional[TTSMetrics] = None,
+                         host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """
+    在后台线程中启动指标HTTP服务
+
+    Args:
+        port: 监听端口
+        metrics: 要导出的指标，默认为进程内共享的实例
+        host: 监听地址
+
+    Returns:
+        ThreadingHTTPServer: 服务实例，调用shutdown()停止
+    """
+    handler = type('MetricsHandler', (_MetricsHandler,), {'metrics': metrics or get_metrics()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="tts-metrics", daemon=True).start()
+    logger.info(f"请求指标: http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+_shared_metrics: Optional[TTSMetrics] = None
+_shared_lock = threading.Lock()
+
+
+def get_metrics() -> TTSMetrics:
+    """
+    获取进程内共享的指标实例
+
+    Returns:
+        TTSMetrics: 共享实例
+    """
+    global _shared_metrics
+    with _shared_lock:
+        if _shared_metrics is None:
+            _shared_metrics = TTSMetrics()
+        return _shared_metrics
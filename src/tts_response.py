@@ -0,0 +1,209 @@
+"""
+流式解码TTS的JSON响应
+响应体按分块到达时边扫描边处理：顶层data字段的base64内容直接增量解码到预分配的缓冲区，
+其余字段（code、message等）保留下来解析，因此内存中不会同时存在原始响应体、
+解码后的JSON字符串和音频三份数据
+"""
+
+import re
+import json
+import binascii
+from typing import Any, Dict, Optional, Tuple, Union
+
+# 音频所在的顶层字段
+DATA_KEY = b'data'
+
+_JSON_WHITESPACE = b' \t\r\n'
+# data字符串中需要特殊处理的字符：结束引号和转义
+_DATA_SPECIAL = re.compile(rb'["\\]')
+
+# 音频数据：缓存、WebSocket等路径为bytes，HTTP响应为解码缓冲区的只读视图（不复制）
+AudioBuffer = Union[bytes, memoryview]
+
+
+class AudioResponseDecoder:
+    """
+    增量解码 {"code": ..., "message": ..., "data": "<base64>"} 格式的响应
+
+    用法：按顺序调用feed()传入响应体分块，最后调用close()取得其余字段和音频。
+    data之外的内容只占几百字节，逐字节扫描；data的内容按块查找引号并批量解码
+    """
+
+    def __init__(self, size_hint: Optional[int] = None):
+        """
+        初始化解码器
+
+        Args:
+            size_hint: 响应体的字节数（Content-Length），用于预分配音频缓冲区；
+                未知时缓冲区按需增长
+        """
+        # 去掉data内容后的响应（data替换为空字符串），用于解析code和message
+        self._envelope = bytearray()
+        # base64解码后不超过原长度的3/4
+        self._audio = bytearray(size_hint * 3 // 4) if size_hint else bytearray()
+        self._audio_size = 0
+        # 不足4个字符的base64尾部，留到下一块一起解码
+        self._carry = b''
+        self.error: Optional[str] = None
+
+        # 扫描状态
+        self._in_data = False
+        self._data_escape = False
+        self._in_string = False
+        self._escape = False
+        self._depth = 0
+        self._string = bytearray()
+        self._last_string: Optional[bytes] = None
+        self._after_string = False
+        self._data_value_next = False
+        self._found_data = False
+
+    @property
+    def audio_size(self) -> int:
+        """已解码的音频字节数"""
+        return self._audio_size
+
+    def feed(self, chunk: bytes):
+        """
+        处理响应体的下一块
+
+        Args:
+            chunk: 响应体分块
+        """
+        view = memoryview(chunk)
+        pos = 0
+        while pos < len(view):
+            if self._in_data:
+                pos = self._feed_data(chunk, pos)
+            else:
+                pos = self._feed_envelope(view, pos)
+
+    def _feed_envelope(self, view: memoryview, pos: int) -> int:
+        """逐字节扫描data之外的内容，遇到顶层data的字符串值时切换到解码状态，返回下一个位置"""
+        envelope = self._envelope
+        while pos < len(view):
+            c = view[pos]
+            pos += 1
+            if self._in_string:
+                envelope.append(c)
+                if self._escape:
+                    self._escape = False
+                elif c == 0x5C:  # 反斜杠
+                    self._escape = True
+                elif c == 0x22:  # 引号
+                    self._in_string = False
+                    self._last_string = bytes(self._string)
+                    self._after_string = True
+                    continue
+                if self._depth == 1:
+                    self._string.append(c)
+                continue
+
+            if c in _JSON_WHITESPACE:
+                envelope.append(c)
+                continue
+            if c == 0x22:
+                envelope.append(c)
+                if self._data_value_next:
+                    # 进入data字符串，内容不写入envelope
+                    self._data_value_next = False
+                    self._in_data = True
+                    self._found_data = True
+                    return pos
+                self._in_string = True
+                self._string.clear()
+                continue
+
+            if c == 0x3A and self._depth == 1 and self._after_string and self._last_string == DATA_KEY:  # 冒号
+                self._data_value_next = True
+            else:
+                self._data_value_next = False
+                if c in b'{[':
+                    self._depth += 1
+                elif c in b'}]':
+                    self._depth -= 1
+            self._after_string = False
+            envelope.append(c)
+        return pos
+
+    def _feed_data(self, chunk: bytes, pos: int) -> int:
+        """解码data字符串中的base64，遇到结束引号时切换回扫描状态，返回下一个位置"""
+        if self._data_escape:
+            # 上一块以反斜杠结尾；base64中只可能出现转义的斜杠
+            self._data_escape = False
+            escaped = chunk[pos:pos + 1]
+            if escaped == b'/':
+                self._decode(b'/')
+            elif escaped not in (b'n', b'r', b't'):
+                self._fail(f"data中不支持的转义: \\{escaped.decode('ascii', 'replace')}")
+            return pos + 1
+
+        match = _DATA_SPECIAL.search(chunk, pos)
+        end = match.start() if match else len(chunk)
+        if end > pos:
+            self._decode(chunk[pos:end])
+        if match is None:
+            return end
+        if chunk[end] == 0x22:
+            self._finish_data()
+            self._envelope.append(0x22)
+        else:
+            self._data_escape = True
+        return end + 1
+
+    def _decode(self, text: bytes):
+        """解码一段base64（凑齐4个字符为一组），写入音频缓冲区"""
+        if self.error is not None:
+            return
+        data = self._carry + text if self._carry else text
+        usable = len(data) - len(data) % 4
+        self._carry = bytes(data[usable:])
+        if usable:
+            try:
+                self._write(binascii.a2b_base64(data[:usable]))
+            except binascii.Error as e:
+                self._fail(f"音频base64解码失败: {e}")
+
+    def _finish_data(self):
+        """data字符串结束：剩余字符不足一组说明base64长度不正确"""
+        self._in_data = False
+        if self._carry and self.error is None:
+            self._fail("音频base64长度不正确")
+        self._carry = b''
+
+    def _write(self, decoded: bytes):
+        end = self._audio_size + len(decoded)
+        if end > len(self._audio):
+            self._audio.extend(bytes(end - len(self._audio)))
+        self._audio[self._audio_size:end] = decoded
+        self._audio_size = end
+
+    def _fail(self, message: str):
+        # 记录第一个错误，之后不再解码；是否报错由调用方结合code决定
+        if self.error is None:
+            self.error = message
+
+    def close(self) -> Tuple[Dict[str, Any], AudioBuffer]:
+        """
+        结束解码
+
+        Returns:
+            Tuple[Dict[str, Any], AudioBuffer]: 响应中除音频外的字段（data为空字符串）和解码后的音频；
+                音频是解码缓冲区的只读memoryview（不复制，不能修改，可以安全地在合并的请求之间共享并写入缓存）
+
+        Raises:
+            ValueError: 响应不是有效的JSON对象（包括在data字符串中途结束）
+        """
+        if self._in_data:
+            raise ValueError("响应在data字段中途结束")
+        result = json.loads(self._envelope)
+        if not isinstance(result, dict):
+            raise ValueError("响应不是JSON对象")
+        if not self._found_data:
+            # 没有data字段（或不是字符串）时与直接解析的结果一致
+            return result, b''
+        # 截掉预分配多出的部分后交出缓冲区，解码器不再持有
+        del self._audio[self._audio_size:]
+        audio = memoryview(self._audio).toreadonly()
+        self._audio = bytearray()
+        return result, audio
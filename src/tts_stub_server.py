@@ -0,0 +1,412 @@
+"""
+本地模拟TTS服务
+实现与线上相同的 /api/v1/tts JSON接口和WebSocket二进制协议，按文本长度返回静音MP3（或WAV/PCM）；
+延迟分布、音频大小以及429、5xx、并发超限的比例都可以配置，用于在不消耗配额的情况下
+测量整条流水线的吞吐（见 benchmark_tts.py）
+
+单独运行: python src/tts_stub_server.py --port 18080 --latency-ms 300 --rate-429 0.02
+然后设置 TTS_HTTP_URL=http://127.0.0.1:18080/api/v1/tts
+"""
+
+import re
+import math
+import uuid
+import base64
+import random
+import asyncio
+import argparse
+import threading
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, Optional, Tuple
+
+from aiohttp import web, WSMsgType
+
+try:
+    from loguru import logger
+except ImportError:
+    import logging
+    logger = logging.getLogger(__name__)
+
+from mp3_frames import BITRATES, CHANNEL_MODE_MONO, MPEG_2, FrameHeader, silent_frame
+from pcm_audio import PcmFormat, SAMPLE_WIDTH, wav_header
+from tts_ws_protocol import ProtocolError, decode_request, encode_audio, encode_error
+
+HTTP_PATH = '/api/v1/tts'
+WS_PATH = '/api/v1/tts/ws_binary'
+STATS_PATH = '/stats'
+
+LATENCY_DISTRIBUTIONS = ('fixed', 'uniform', 'lognormal')
+
+# 与线上接口一致的错误码和并发超限信息
+CODE_SUCCESS = 3000
+CODE_CONCURRENCY_QUOTA = 3003
+CODE_INVALID_TEXT = 3011
+CODE_SERVER_ERROR = 5000
+QUOTA_MESSAGE = 'quota exceeded for types: concurrency'
+
+_SSML_TAG = re.compile(r'<[^>]+>')
+_SSML_BREAK = re.compile(r'<break\s+time="(\d+)ms"\s*/>')
+
+
+@dataclass
+class StubProfile:
+    """模拟服务的行为配置"""
+    # 延迟分布：fixed为固定值，uniform在 latency_ms*(1±spread) 之间均匀分布，
+    # lognormal的中位数为latency_ms、形状参数为spread（长尾）
+    latency: str = 'lognormal'
+    latency_ms: float = 300.0
+    latency_spread: float = 0.5
+    # 每个字符额外增加的延迟（毫秒），模拟长文本合成更慢
+    latency_per_char_ms: float = 2.0
+    # 音频大小：语速为1时每个字符的时长（秒）和MP3比特率（kbps，24kHz单声道）
+    seconds_per_char: float = 0.25
+    bitrate_kbps: int = 48
+    # 故障比例：HTTP 429、HTTP 503、业务码3003（并发超限）
+    rate_429: float = 0.0
+    rate_5xx: float = 0.0
+    rate_quota: float = 0.0
+    # 账号并发配额，同时在途的请求超过该值时返回并发超限（0表示不限制）
+    max_concurrency: int = 0
+    # WebSocket模式下每个音频分片的字节数
+    ws_chunk_bytes: int = 4096
+    # 随机数种子，固定后故障和延迟序列可复现
+    seed: Optional[int] = None
+
+    def __post_init__(self):
+        if self.latency not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"未知的延迟分布: {self.latency}，可选 {', '.join(LATENCY_DISTRIBUTIONS)}")
+        if self.bitrate_kbps not in BITRATES[MPEG_2][1:]:
+            raise ValueError(f"不支持的比特率: {self.bitrate_kbps}kbps，可选 {BITRATES[MPEG_2][1:]}")
+
+
+class StubTTSServer:
+    """
+    模拟TTS服务
+
+    可在独立进程中运行（run_forever），也可在后台线程中启动（start_background），
+    供压测脚本在同一进程内使用
+    """
+
+    def __init__(self, profile: Optional[StubProfile] = None, host: str = '127.0.0.1', port: int = 0):
+        """
+        初始化模拟服务
+
+        Args:
+            profile: 行为配置，默认使用StubProfile()
+            host: 监听地址
+            port: 监听端口，0表示自动分配
+        """
+        self.profile = profile or StubProfile()
+        self.host = host
+        self.port = port
+        self._rng = random.Random(self.profile.seed)
+        self._header = FrameHeader(version=MPEG_2,
+                                   bitrate_index=BITRATES[MPEG_2].index(self.profile.bitrate_kbps),
+                                   sample_rate_index=1, padding=0,
+                                   channel_mode=CHANNEL_MODE_MONO, protected=False)
+        self._frame = silent_frame(self._header)
+
+        self._runner: Optional[web.AppRunner] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._in_flight = 0
+        self.stats: Dict[str, int] = {}
+        self.reset_stats()
+
+    @property
+    def http_url(self) -> str:
+        return f"http://{self.host}:{self.port}{HTTP_PATH}"
+
+    @property
+    def ws_url(self) -> str:
+        return f"ws://{self.host}:{self.port}{WS_PATH}"
+
+    def reset_stats(self):
+        """清零请求统计"""
+        self.stats = {
+            'requests': 0,
+            'ok': 0,
+            'throttled_429': 0,
+            'server_errors': 0,
+            'quota_exceeded': 0,
+            'invalid': 0,
+            'ws_sessions': 0,
+            'peak_concurrency': 0,
+            'audio_bytes': 0
+        }
+
+    def _build_app(self) -> web.Application:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post(HTTP_PATH, self._handle_http)
+        app.router.add_get(WS_PATH, self._handle_ws)
+        app.router.add_get(STATS_PATH, self._handle_stats)
+        return app
+
+    async def start(self):
+        """在当前事件循环中启动服务"""
+        self._runner = web.AppRunner(self._build_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # 端口为0时读取实际分配的端口
+        self.port = self._runner.addresses[0][1]
+        logger.info(f"模拟TTS服务已启动: {self.http_url}")
+
+    async def stop(self):
+        """停止服务"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def start_background(self) -> 'StubTTSServer':
+        """在后台线程的事件循环中启动服务，返回自身"""
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self.start())
+        self._thread = threading.Thread(target=self._loop.run_forever, name="tts-stub-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        """停止后台线程中的服务"""
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result(timeout=10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=10)
+        self._loop.close()
+        self._loop, self._thread = None, None
+
+    def __enter__(self):
+        return self.start_background()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def run_forever(self):
+        """在前台运行服务直到中断"""
+        async def serve():
+            await self.start()
+            print(f"HTTP:      {self.http_url}")
+            print(f"WebSocket: {self.ws_url}")
+            print(f"统计:      http://{self.host}:{self.port}{STATS_PATH}")
+            await asyncio.Event().wait()
+
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            pass
+
+    def _sample_latency(self, text: str) -> float:
+        """按配置的分布抽取一次请求的延迟（秒）"""
+        p = self.profile
+        if p.latency == 'fixed':
+            base = p.latency_ms
+        elif p.latency == 'uniform':
+            base = p.latency_ms * self._rng.uniform(max(0.0, 1 - p.latency_spread), 1 + p.latency_spread)
+        else:
+            base = p.latency_ms * self._rng.lognormvariate(0.0, p.latency_spread)
+        return (base + p.latency_per_char_ms * len(text)) / 1000
+
+    def _sample_fault(self) -> Optional[str]:
+        """按配置的比例抽取本次请求的故障类型，None表示正常返回"""
+        p = self.profile
+        if p.max_concurrency and self._in_flight > p.max_concurrency:
+            return 'quota'
+        roll = self._rng.random()
+        for fault, rate in (('429', p.rate_429), ('5xx', p.rate_5xx), ('quota', p.rate_quota)):
+            if roll < rate:
+                return fault
+            roll -= rate
+        return None
+
+    def _synthesize(self, text: str, speed_ratio: float, encoding: str = 'mp3',
+                    rate: int = 24000) -> Tuple[bytes, float]:
+        """
+        生成与文本长度相称的静音（SSML的停顿计入时长）
+
+        Returns:
+            Tuple[bytes, float]: 音频（mp3，或rate采样率的单声道wav/pcm）和时长（秒）
+        """
+        pause = sum(int(ms) for ms in _SSML_BREAK.findall(text)) / 1000
+        chars = len(_SSML_TAG.sub('', text).strip())
+        seconds = chars * self.profile.seconds_per_char / max(speed_ratio, 0.1) + pause
+        if encoding in ('wav', 'pcm'):
+            samples = bytes(max(1, round(seconds * rate)) * SAMPLE_WIDTH)
+            duration = len(samples) / SAMPLE_WIDTH / rate
+            if encoding == 'wav':
+                return wav_header(PcmFormat(rate, 1), len(samples)) + samples, duration
+            return samples, duration
+        frames = max(1, math.ceil(seconds / self._header.duration))
+        return self._frame * frames, frames * self._header.duration
+
+    def _enter(self):
+        self._in_flight += 1
+        self.stats['requests'] += 1
+        self.stats['peak_concurrency'] = max(self.stats['peak_concurrency'], self._in_flight)
+
+    def _count_fault(self, fault: str):
+        key = {'429': 'throttled_429', '5xx': 'server_errors', 'quota': 'quota_exceeded'}[fault]
+        self.stats[key] += 1
+
+    @staticmethod
+    def _parse(payload: Dict[str, Any]):
+        """取出文本、请求ID和合成参数（语速、编码、采样率）"""
+        request = payload.get('request') or {}
+        audio = payload.get('audio') or {}
+        params = {
+            'speed_ratio': float(audio.get('speed_ratio') or 1.0),
+            'encoding': audio.get('encoding') or 'mp3',
+            'rate': int(audio.get('rate') or 24000)
+        }
+        return request.get('text') or '', request.get('reqid', ''), params
+
+    async def _handle_http(self, request: web.Request) -> web.Response:
+        try:
+            payload = await request.json()
+        except ValueError:
+            self.stats['invalid'] += 1
+            return web.Response(status=400, text='invalid json')
+        text, reqid, params = self._parse(payload)
+
+        self._enter()
+        try:
+            if not text.strip():
+                self.stats['invalid'] += 1
+                return web.json_response({'reqid': reqid, 'code': CODE_INVALID_TEXT, 'message': 'empty text'})
+
+            fault = self._sample_fault()
+            if fault is not None:
+                self._count_fault(fault)
+            if fault == '429':
+                return web.Response(status=429, text='too many requests')
+            if fault == 'quota':
+                return web.json_response({'reqid': reqid, 'code': CODE_CONCURRENCY_QUOTA, 'message': QUOTA_MESSAGE})
+
+            await asyncio.sleep(self._sample_latency(text))
+            if fault == '5xx':
+                return web.Response(status=503, text='service unavailable')
+
+            audio, duration = self._synthesize(text, **params)
+            self.stats['ok'] += 1
+            self.stats['audio_bytes'] += len(audio)
+            return web.json_response({
+                'reqid': reqid or str(uuid.uuid4()),
+                'code': CODE_SUCCESS,
+                'operation': 'query',
+                'message': 'Success',
+                'sequence': -1,
+                'data': base64.b64encode(audio).decode('ascii'),
+                'addition': {'duration': str(int(duration * 1000))}
+            })
+        finally:
+            self._in_flight -= 1
+
+    async def _handle_ws(self, request: web.Request) -> web.StreamResponse:
+        # 429在握手阶段返回，与线上网关一致
+        self._enter()
+        try:
+            fault = self._sample_fault()
+            if fault is not None:
+                self._count_fault(fault)
+            if fault == '429':
+                return web.Response(status=429, text='too many requests')
+
+            ws = web.WebSocketResponse(max_msg_size=0)
+            await ws.prepare(request)
+            self.stats['ws_sessions'] += 1
+
+            msg = await ws.receive()
+            if msg.type != WSMsgType.BINARY:
+                await ws.close()
+                return ws
+            try:
+                text, _, params = self._parse(decode_request(msg.data))
+            except (ProtocolError, ValueError) as e:
+                self.stats['invalid'] += 1
+                await ws.send_bytes(encode_error(CODE_INVALID_TEXT, f'invalid request: {e}'))
+                await ws.close()
+                return ws
+
+            if fault == 'quota':
+                await ws.send_bytes(encode_error(CODE_CONCURRENCY_QUOTA, QUOTA_MESSAGE))
+            elif fault == '5xx':
+                await asyncio.sleep(self._sample_latency(text))
+                await ws.send_bytes(encode_error(CODE_SERVER_ERROR, 'internal error'))
+            else:
+                # 首个分片在延迟之后到达，之后的分片陆续发送
+                await asyncio.sleep(self._sample_latency(text))
+                audio, _ = self._synthesize(text, **params)
+                size = self.profile.ws_chunk_bytes
+                chunks = [audio[i:i + size] for i in range(0, len(audio), size)]
+                for sequence, chunk in enumerate(chunks, 1):
+                    last = sequence == len(chunks)
+                    await ws.send_bytes(encode_audio(-sequence if last else sequence, chunk))
+                self.stats['ok'] += 1
+                self.stats['audio_bytes'] += len(audio)
+            await ws.close()
+            return ws
+        finally:
+            self._in_flight -= 1
+
+    async def _handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({'profile': asdict(self.profile), 'stats': self.stats})
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    """把模拟服务的行为配置添加为命令行参数（服务和压测脚本共用）"""
+    defaults = StubProfile()
+    group = parser.add_argument_group("模拟服务")
+    group.add_argument("--latency", choices=LATENCY_DISTRIBUTIONS, default=defaults.latency,
+                       help=f"延迟分布（默认{defaults.latency}）")
+    group.add_argument("--latency-ms", type=float, default=defaults.latency_ms,
+                       help=f"延迟的中位数/基准值，毫秒（默认{defaults.latency_ms:g}）")
+    group.add_argument("--latency-spread", type=float, default=defaults.latency_spread,
+                       help=f"uniform为相对浮动范围，lognormal为形状参数（默认{defaults.latency_spread:g}）")
+    group.add_argument("--latency-per-char-ms", type=float, default=defaults.latency_per_char_ms,
+                       help=f"每个字符额外的延迟，毫秒（默认{defaults.latency_per_char_ms:g}）")
+    group.add_argument("--seconds-per-char", type=float, default=defaults.seconds_per_char,
+                       help=f"每个字符的音频时长，秒（默认{defaults.seconds_per_char:g}）")
+    group.add_argument("--bitrate", type=int, default=defaults.bitrate_kbps,
+                       help=f"返回音频的比特率，kbps（默认{defaults.bitrate_kbps}）")
+    group.add_argument("--rate-429", type=float, default=0.0, help="返回HTTP 429的比例")
+    group.add_argument("--rate-5xx", type=float, default=0.0, help="返回HTTP 503的比例")
+    group.add_argument("--rate-quota", type=float, default=0.0, help="返回并发超限（3003）的比例")
+    group.add_argument("--max-concurrency", type=int, default=0,
+                       help="账号并发配额，超过时返回并发超限（默认0，不限制）")
+    group.add_argument("--seed", type=int, help="随机数种子（固定后结果可复现）")
+
+
+def profile_from_args(args: argparse.Namespace) -> StubProfile:
+    """根据命令行参数创建行为配置"""
+    return StubProfile(
+        latency=args.latency,
+        latency_ms=args.latency_ms,
+        latency_spread=args.latency_spread,
+        latency_per_char_ms=args.latency_per_char_ms,
+        seconds_per_char=args.seconds_per_char,
+        bitrate_kbps=args.bitrate,
+        rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx,
+        rate_quota=args.rate_quota,
+        max_concurrency=args.max_concurrency,
+        seed=args.seed
+    )
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="本地模拟TTS服务（与线上 /api/v1/tts 接口一致）")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址（默认127.0.0.1）")
+    parser.add_argument("--port", type=int, default=18080, help="监听端口（默认18080）")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        profile = profile_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+    StubTTSServer(profile, args.host, args.port).run_forever()
+
+
+if __name__ == "__main__":
+    main()
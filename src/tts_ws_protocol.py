@@ -0,0 +1,153 @@
+"""
+语音合成WebSocket二进制协议（ws_binary）
+每条消息为4字节头 + 可选序号 + 4字节负载长度 + 负载：
+客户端发送一条gzip压缩的JSON完整请求，服务端按序返回若干音频分片，序号为负数的分片是最后一片
+"""
+
+import gzip
+import json
+import struct
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+PROTOCOL_VERSION = 0b0001
+HEADER_SIZE = 0b0001          # 头长度，单位4字节
+
+# 消息类型
+FULL_CLIENT_REQUEST = 0b0001
+AUDIO_ONLY_RESPONSE = 0b1011
+FRONTEND_RESPONSE = 0b1100
+ERROR_RESPONSE = 0b1111
+
+# 序列化与压缩方式
+SERIALIZATION_NONE = 0b0000
+SERIALIZATION_JSON = 0b0001
+COMPRESSION_NONE = 0b0000
+COMPRESSION_GZIP = 0b0001
+
+# 音频分片的标志位：0表示不带序号（确认消息），其他值表示带序号，2/3表示最后一片
+FLAG_NO_SEQUENCE = 0b0000
+FLAG_POSITIVE_SEQUENCE = 0b0001
+FLAG_LAST_NO_SEQUENCE = 0b0010
+FLAG_NEGATIVE_SEQUENCE = 0b0011
+
+
+class ProtocolError(ValueError):
+    """无法解析的WebSocket消息"""
+
+
+def _header(message_type: int, flags: int, serialization: int, compression: int) -> bytes:
+    return bytes((
+        (PROTOCOL_VERSION << 4) | HEADER_SIZE,
+        (message_type << 4) | flags,
+        (serialization << 4) | compression,
+        0
+    ))
+
+
+def encode_request(payload: Dict[str, Any], compress: bool = True) -> bytes:
+    """
+    编码客户端完整请求
+
+    Args:
+        payload: 请求JSON（与HTTP接口相同，operation为submit）
+        compress: 是否gzip压缩负载
+
+    Returns:
+        bytes: 二进制消息
+    """
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    compression = COMPRESSION_NONE
+    if compress:
+        body = gzip.compress(body)
+        compression = COMPRESSION_GZIP
+    return (_header(FULL_CLIENT_REQUEST, FLAG_NO_SEQUENCE, SERIALIZATION_JSON, compression)
+            + struct.pack('>I', len(body)) + body)
+
+
+def encode_audio(sequence: int, audio: bytes) -> bytes:
+    """编码服务端音频分片（sequence为负数表示最后一片），用于本地模拟服务"""
+    flags = FLAG_NEGATIVE_SEQUENCE if sequence < 0 else FLAG_POSITIVE_SEQUENCE
+    return (_header(AUDIO_ONLY_RESPONSE, flags, SERIALIZATION_NONE, COMPRESSION_NONE)
+            + struct.pack('>iI', sequence, len(audio)) + audio)
+
+
+def encode_error(code: int, message: str) -> bytes:
+    """编码服务端错误消息，用于本地模拟服务"""
+    body = gzip.compress(message.encode('utf-8'))
+    return (_header(ERROR_RESPONSE, FLAG_NO_SEQUENCE, SERIALIZATION_JSON, COMPRESSION_GZIP)
+            + struct.pack('>II', code, len(body)) + body)
+
+
+def decode_request(data: bytes) -> Dict[str, Any]:
+    """解码客户端完整请求，用于本地模拟服务"""
+    if len(data) < 8:
+        raise ProtocolError("消息过短")
+    header_size = (data[0] & 0x0F) * 4
+    compression = data[2] & 0x0F
+    size = struct.unpack('>I', data[header_size:header_size + 4])[0]
+    body = data[header_size + 4:header_size + 4 + size]
+    if compression == COMPRESSION_GZIP:
+        body = gzip.decompress(body)
+    return json.loads(body)
+
+
+@dataclass
+class ServerMessage:
+    """解析后的服务端消息"""
+    message_type: int
+    # 音频分片序号，最后一片为负数
+    sequence: int = 0
+    audio: bytes = b''
+    last: bool = False
+    error_code: Optional[int] = None
+    error_message: str = ''
+
+    @property
+    def is_error(self) -> bool:
+        return self.message_type == ERROR_RESPONSE
+
+
+def decode_message(data: bytes) -> ServerMessage:
+    """
+    解析服务端消息
+
+    Args:
+        data: WebSocket二进制帧
+
+    Returns:
+        ServerMessage: 音频分片、错误或前端消息
+
+    Raises:
+        ProtocolError: 消息过短或类型未知
+    """
+    if len(data) < 4:
+        raise ProtocolError("消息过短")
+    header_size = (data[0] & 0x0F) * 4
+    message_type = data[1] >> 4
+    flags = data[1] & 0x0F
+    compression = data[2] & 0x0F
+    payload = memoryview(data)[header_size:]
+
+    if message_type == AUDIO_ONLY_RESPONSE:
+        if flags == FLAG_NO_SEQUENCE:
+            return ServerMessage(message_type)
+        if flags == FLAG_LAST_NO_SEQUENCE:
+            # 最后一片且没有序号字段：文件头之后直接是长度和音频
+            size = struct.unpack('>I', payload[:4])[0]
+            return ServerMessage(message_type, audio=bytes(payload[4:4 + size]), last=True)
+        sequence, size = struct.unpack('>iI', payload[:8])
+        last = sequence < 0 or flags == FLAG_NEGATIVE_SEQUENCE
+        return ServerMessage(message_type, sequence=sequence, audio=bytes(payload[8:8 + size]), last=last)
+
+    if message_type == ERROR_RESPONSE:
+        code, size = struct.unpack('>II', payload[:8])
+        body = bytes(payload[8:8 + size])
+        if compression == COMPRESSION_GZIP:
+            body = gzip.decompress(body)
+        return ServerMessage(message_type, error_code=code, error_message=body.decode('utf-8', 'replace'))
+
+    if message_type == FRONTEND_RESPONSE:
+        return ServerMessage(message_type)
+
+    raise ProtocolError(f"未知的消息类型: {message_type}")